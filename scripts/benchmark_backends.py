@@ -0,0 +1,75 @@
+"""Compare event downloads through HCNetSDK and through ISAPI.
+
+Usage:
+    python scripts/benchmark_backends.py [--days 30] [--rounds 3] [--isapi-port 80]
+
+Uses the device from the configured DEVICE section and reports, per backend,
+the time to log in and the time to download the events of the last N days.
+"""
+
+import argparse
+import datetime
+import statistics
+import time
+
+from cida_attendance.config import load_config
+from cida_attendance.core.wire import AttendanceBatch
+from cida_attendance.isapi import IsapiSession
+from cida_attendance.sdk.session import Session
+
+
+def run_sdk(config, days):
+    from cida_attendance.core.tasks import build_acs_event_handler
+
+    started = time.perf_counter()
+    with Session() as session:
+        if not session.login(**config):
+            raise SystemExit("SDK login failed")
+        logged_in = time.perf_counter()
+        end, tz = session.get_device_time()
+        batch = AttendanceBatch("bench", "bench", None, tz)
+        session.async_get_asc_event(
+            end - datetime.timedelta(days=days), end, build_acs_event_handler(batch, tz)
+        )
+        session.logout()
+    return logged_in - started, time.perf_counter() - logged_in, len(batch)
+
+
+def run_isapi(config, days):
+    started = time.perf_counter()
+    with IsapiSession() as session:
+        if not session.login(**config):
+            raise SystemExit("ISAPI login failed")
+        logged_in = time.perf_counter()
+        end, tz = session.get_device_time()
+        batch = AttendanceBatch("bench", "bench", None, tz)
+        for event in session.iter_acs_events(end - datetime.timedelta(days=days), end):
+            batch.append(*event)
+    return logged_in - started, time.perf_counter() - logged_in, len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--isapi-port", type=int, default=80)
+    args = parser.parse_args()
+
+    config = load_config()
+    config["isapi_port"] = args.isapi_port
+
+    for name, run in (("sdk", run_sdk), ("isapi", run_isapi)):
+        logins, downloads, count = [], [], 0
+        for _ in range(args.rounds):
+            login_s, download_s, count = run(config, args.days)
+            logins.append(login_s)
+            downloads.append(download_s)
+        print(
+            f"{name:>5}: login {statistics.median(logins) * 1000:.0f} ms, "
+            f"{count} events in {statistics.median(downloads):.3f} s "
+            f"({count / max(statistics.median(downloads), 1e-9):.0f} events/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
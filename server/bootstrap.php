@@ -0,0 +1,176 @@
+<?php
+declare(strict_types=1);
+
+// bootstrap.php: código compartido por el endpoint y los scripts de CLI.
+
+/**
+ * Carga variables de entorno desde un archivo .env simple.
+ *
+ * Con APCu el resultado del parseo se comparte entre peticiones del mismo
+ * servidor y sólo se vuelve a leer el archivo cuando cambia su mtime o tamaño.
+ */
+class DotEnv
+{
+    private const CACHE_PREFIX = 'cida_dotenv:';
+
+    private static ?string $loaded = null;
+
+    public static function load(string $path = __DIR__ . '/.env', int $maxBytes = 1048576): void
+    {
+        if (self::$loaded === $path) {
+            return;
+        }
+
+        $stat = @stat($path);
+        if ($stat === false || $stat['size'] > $maxBytes) {
+            return;
+        }
+
+        $stamp = $stat['mtime'] . ':' . $stat['size'];
+        $useApcu = function_exists('apcu_fetch') && apcu_enabled();
+        $vars = null;
+
+        if ($useApcu) {
+            $cached = apcu_fetch(self::CACHE_PREFIX . $path);
+            if (is_array($cached) && ($cached['stamp'] ?? null) === $stamp) {
+                $vars = $cached['vars'];
+            }
+        }
+
+        if ($vars === null) {
+            $vars = self::parse($path);
+            if ($vars === null) {
+                return;
+            }
+            if ($useApcu) {
+                apcu_store(self::CACHE_PREFIX . $path, ['stamp' => $stamp, 'vars' => $vars]);
+            }
+        }
+
+        foreach ($vars as $name => $value) {
+            if (getenv($name) === false) {
+                @putenv("$name=$value");
+            }
+            $_ENV[$name] = $value;
+            $_SERVER[$name] = $value;
+        }
+        self::$loaded = $path;
+    }
+
+    private static function parse(string $path): ?array
+    {
+        $lines = @file($path, FILE_IGNORE_NEW_LINES | FILE_SKIP_EMPTY_LINES);
+        if ($lines === false) {
+            return null;
+        }
+
+        $vars = [];
+
+        foreach ($lines as $raw) {
+            $line = trim($raw);
+            if ($line === '' || $line[0] === '#') {
+                continue;
+            }
+
+            if (stripos($line, 'export ') === 0) {
+                $line = trim(substr($line, 7));
+            }
+
+            $pos = strpos($line, '=');
+            if ($pos === false) {
+                continue;
+            }
+
+            $name = trim(substr($line, 0, $pos));
+            $value = trim(substr($line, $pos + 1));
+
+            if ($name === '') {
+                continue;
+            }
+
+            if (strlen($value) >= 2) {
+                $first = $value[0];
+                $last = $value[strlen($value) - 1];
+                if (($first === '"' && $last === '"') || ($first === "'" && $last === "'")) {
+                    $value = substr($value, 1, -1);
+                    if ($first === '"') {
+                        $value = str_replace(
+                            ["\\n", "\\r", "\\t", "\\\"", "\\\\", "\\'"],
+                            ["\n", "\r", "\t", "\"", "\\", "'"],
+                            $value
+                        );
+                    }
+                } else {
+                    $hashPos = strpos($value, ' #');
+                    if ($hashPos !== false) {
+                        $value = trim(substr($value, 0, $hashPos));
+                    }
+                }
+            }
+
+            $vars[$name] = $value;
+        }
+
+        return $vars;
+    }
+}
+
+class Database
+{
+    public static function connect(): PDO
+    {
+        $uri = getenv('DB_URI');
+        $dsn = 'pgsql:host=localhost;port=5432;dbname=cida_attendance';
+        $user = 'tu_usuario';
+        $pass = '';
+
+        if (is_string($uri) && $uri !== '') {
+            $parts = parse_url($uri);
+            if ($parts && ($parts['scheme'] ?? '') === 'postgres') {
+                $host = $parts['host'] ?? 'localhost';
+                $port = $parts['port'] ?? 5432;
+                $user = $parts['user'] ?? '';
+                $pass = $parts['pass'] ?? '';
+                $dbname = ltrim($parts['path'] ?? '', '/') ?: 'cida_attendance';
+                $dsn = sprintf('pgsql:host=%s;port=%d;dbname=%s', $host, (int) $port, $dbname);
+            }
+        }
+
+        // DB_POOL_MODE: "persistent" (por defecto) reutiliza la conexión del
+        // proceso de Apache entre peticiones; "pgbouncer" abre conexiones
+        // normales sin sentencias preparadas en el servidor (modo transacción).
+        $mode = strtolower((string) (getenv('DB_POOL_MODE') ?: 'persistent'));
+
+        return new PDO($dsn, $user, $pass, [
+            PDO::ATTR_ERRMODE => PDO::ERRMODE_EXCEPTION,
+            PDO::ATTR_DEFAULT_FETCH_MODE => PDO::FETCH_ASSOC,
+            PDO::ATTR_EMULATE_PREPARES => $mode === 'pgbouncer',
+            PDO::ATTR_PERSISTENT => $mode === 'persistent' && PHP_SAPI !== 'cli',
+        ]);
+    }
+}
+
+class BearerAuth
+{
+    /**
+     * Valida "Authorization: Bearer <AUTH_TOKEN>"; lanza una excepción 401 si no coincide.
+     */
+    public static function check(): void
+    {
+        $authHeader = $_SERVER['HTTP_AUTHORIZATION'] ?? getallheaders()['Authorization'] ?? '';
+        $token = '';
+
+        if (stripos($authHeader, 'Bearer ') === 0) {
+            $token = trim(substr($authHeader, 7));
+        }
+
+        $expectedToken = getenv('AUTH_TOKEN');
+        if (!$expectedToken) {
+            $expectedToken = 'CAMBIA_ESTE_TOKEN_POR_UNO_MUY_LARGO_Y_ALEATORIO';
+        }
+
+        if (!hash_equals($expectedToken, $token)) {
+            throw new Exception('Unauthorized', 401);
+        }
+    }
+}
@@ -1,10 +1,156 @@
-CREATE TABLE cida_attendance (
+-- Dimensiones: cada dispositivo y empleado se guarda una sola vez y los eventos
+-- los referencian por una clave entera.
+CREATE TABLE cida_devices (
     id SERIAL PRIMARY KEY,
-    event_user_id VARCHAR(100) NOT NULL,
+    serial VARCHAR(100) NOT NULL UNIQUE,
+    model VARCHAR(100) NOT NULL,
+    name VARCHAR(100),
+    -- Cursor de sincronización: lo avanza cada ingesta en su transacción.
+    last_event_time TIMESTAMP,
+    last_serial BIGINT
+);
+
+CREATE TABLE cida_employees (
+    id SERIAL PRIMARY KEY,
+    code VARCHAR(100) NOT NULL UNIQUE
+);
+
+-- Tabla de hechos particionada por mes sobre event_time: las consultas por
+-- ventana de tiempo sólo recorren las particiones del rango y la retención
+-- separa meses enteros.
+CREATE TABLE cida_attendance_events (
+    id BIGSERIAL,
     event_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    device_id INTEGER NOT NULL REFERENCES cida_devices (id),
+    employee_id INTEGER NOT NULL REFERENCES cida_employees (id),
     event_type INTEGER NOT NULL,
-    device_model VARCHAR(100) NOT NULL,
+    event_minor INTEGER NOT NULL DEFAULT 0,
+    event_serial BIGINT,
+    PRIMARY KEY (id, event_time)
+) PARTITION BY RANGE (event_time);
+
+-- Evita duplicados al reenviar lotes (requerido por ON CONFLICT DO NOTHING).
+CREATE UNIQUE INDEX cida_attendance_events_dedupe_idx
+    ON cida_attendance_events (device_id, employee_id, event_time, event_minor);
+
+-- Los eventos llegan casi en orden cronológico: BRIN ocupa unas pocas páginas.
+CREATE INDEX cida_attendance_events_time_brin
+    ON cida_attendance_events USING BRIN (event_time) WITH (pages_per_range = 32);
+-- Orden de la paginación por clave de export_attendance.php.
+CREATE INDEX cida_attendance_events_time_id_idx
+    ON cida_attendance_events (event_time, id);
+CREATE INDEX cida_attendance_events_device_time_idx
+    ON cida_attendance_events (device_id, event_time);
+CREATE INDEX cida_attendance_events_employee_time_idx
+    ON cida_attendance_events (employee_id, event_time);
+
+-- Vista de compatibilidad con la forma original de cida_attendance.
+CREATE VIEW cida_attendance AS
+SELECT a.id,
+       e.code AS event_user_id,
+       a.event_time,
+       a.event_type,
+       d.model AS device_model,
+       d.serial AS device_serial,
+       d.name AS device_name,
+       a.event_minor,
+       a.event_serial
+FROM cida_attendance_events a
+JOIN cida_devices d ON d.id = a.device_id
+JOIN cida_employees e ON e.id = a.employee_id;
+
+-- Resumen diario por empleado, mantenido por la ingesta (ver daily_summary.php).
+CREATE TABLE cida_daily_attendance (
+    employee_id INTEGER NOT NULL REFERENCES cida_employees (id),
+    day DATE NOT NULL,
+    first_event TIMESTAMP NOT NULL,
+    last_event TIMESTAMP NOT NULL,
+    event_count INTEGER NOT NULL,
+    type_counts JSONB NOT NULL DEFAULT '{}',
+    PRIMARY KEY (employee_id, day)
+);
+
+CREATE INDEX cida_daily_attendance_day_idx ON cida_daily_attendance (day);
+
+-- Suma dos objetos {"event_type": conteo}.
+CREATE OR REPLACE FUNCTION cida_add_counts(a JSONB, b JSONB)
+RETURNS JSONB
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT key, sum(CAST(value AS bigint)) AS total
+        FROM (
+            SELECT * FROM jsonb_each_text(a)
+            UNION ALL
+            SELECT * FROM jsonb_each_text(b)
+        ) kv
+        GROUP BY key
+    ) totals
+$$;
+
+-- Crea (si falta) la partición mensual que contiene p_time. Se crea como tabla
+-- suelta y luego se adjunta: ATTACH PARTITION sólo toma SHARE UPDATE EXCLUSIVE
+-- sobre cida_attendance_events, así que no bloquea las ingestas en curso.
+CREATE OR REPLACE FUNCTION cida_attendance_ensure_partition(p_time TIMESTAMP)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_from DATE := date_trunc('month', p_time)::date;
+    v_to DATE := (date_trunc('month', p_time) + INTERVAL '1 month')::date;
+    v_name TEXT := 'cida_attendance_events_p' || to_char(p_time, 'YYYYMM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    -- Serializa la creación concurrente desde varias ingestas.
+    PERFORM pg_advisory_xact_lock(hashtext('cida_attendance_partitions'));
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE cida_attendance_events INCLUDING DEFAULTS)', v_name);
+    EXECUTE format(
+        'ALTER TABLE cida_attendance_events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_from, v_to);
+
+    RETURN v_name;
+END;
+$$;
+
+-- Mes actual y siguiente; retention.php --premake mantiene creados los próximos.
+SELECT cida_attendance_ensure_partition(CAST(now() AS TIMESTAMP));
+SELECT cida_attendance_ensure_partition(CAST(now() + INTERVAL '1 month' AS TIMESTAMP));
+
+-- Ingesta asíncrona: lotes aceptados con 202 y filas crudas pendientes de merge.
+CREATE TABLE cida_ingest_batches (
+    id BIGSERIAL PRIMARY KEY,
     device_serial VARCHAR(100) NOT NULL,
+    device_model VARCHAR(100) NOT NULL,
     device_name VARCHAR(100),
-    event_minor INTEGER NOT NULL DEFAULT 0
-);
\ No newline at end of file
+    record_count INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    inserted INTEGER,
+    error TEXT,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    merged_at TIMESTAMPTZ,
+    first_event_time TIMESTAMP
+);
+
+CREATE INDEX cida_ingest_batches_pending_idx
+    ON cida_ingest_batches (id) WHERE status = 'pending';
+
+CREATE INDEX cida_ingest_batches_failed_idx
+    ON cida_ingest_batches (device_serial) WHERE status = 'failed';
+
+CREATE UNLOGGED TABLE cida_attendance_staging (
+    batch_id BIGINT NOT NULL,
+    event_user_id VARCHAR(100) NOT NULL,
+    event_time TIMESTAMP NOT NULL,
+    event_type INTEGER NOT NULL,
+    event_minor INTEGER NOT NULL DEFAULT 0,
+    event_serial BIGINT
+);
+
+CREATE INDEX cida_attendance_staging_batch_idx ON cida_attendance_staging (batch_id);
@@ -0,0 +1,125 @@
+<?php
+declare(strict_types=1);
+
+// daily_summary.php: resumen diario por empleado (cida_daily_attendance).
+
+/**
+ * cida_daily_attendance guarda por empleado y día la primera y última marca,
+ * el total y los conteos por event_type. Sólo suma las filas que de verdad se
+ * insertaron (no los duplicados descartados por ON CONFLICT), y una vez por
+ * transacción: la ingesta por bloques deja lo insertado en una tabla temporal
+ * (pendingCte) y applyPending lo agrega justo antes del commit, en orden
+ * (employee_id, day), para que transacciones concurrentes no se bloqueen en
+ * orden cruzado.
+ */
+class DailySummary
+{
+    /** Crea, si falta, la tabla temporal de la sesión que usa pendingCte. */
+    public static function preparePending(PDO $pdo): void
+    {
+        $pdo->exec(
+            'CREATE TEMP TABLE IF NOT EXISTS cida_daily_pending (
+                employee_id BIGINT NOT NULL,
+                event_time TIMESTAMP NOT NULL,
+                event_type INTEGER NOT NULL
+            ) ON COMMIT DELETE ROWS'
+        );
+    }
+
+    /** CTE que guarda las filas de $source para el próximo applyPending. */
+    public static function pendingCte(string $source): string
+    {
+        return "daily_pending AS (
+                INSERT INTO pg_temp.cida_daily_pending (employee_id, event_time, event_type)
+                SELECT employee_id, event_time, event_type FROM $source
+            )";
+    }
+
+    /**
+     * Suma al resumen lo acumulado por pendingCte en la transacción actual y
+     * devuelve cuántas filas de resumen tocó.
+     */
+    public static function applyPending(PDO $pdo): int
+    {
+        return (int) $pdo->query(
+            'WITH source AS (
+                DELETE FROM pg_temp.cida_daily_pending
+                RETURNING employee_id, event_time, event_type
+            ), ' . self::upsertCtes('source') . '
+            SELECT count(*) FROM per_day'
+        )->fetchColumn();
+    }
+
+    /**
+     * CTEs que agregan $source (employee_id, event_time, event_type) por
+     * empleado y día y los suman al resumen. Van después del CTE $source en un
+     * WITH; Postgres ejecuta el INSERT aunque el SELECT final no lo lea.
+     */
+    public static function upsertCtes(string $source): string
+    {
+        return "per_type AS (
+                SELECT employee_id, CAST(event_time AS date) AS day, event_type,
+                       min(event_time) AS first_event, max(event_time) AS last_event,
+                       count(*) AS n
+                FROM $source
+                GROUP BY 1, 2, 3
+            ),
+            per_day AS (
+                SELECT employee_id, day, min(first_event) AS first_event,
+                       max(last_event) AS last_event, sum(n) AS event_count,
+                       jsonb_object_agg(event_type, n) AS type_counts
+                FROM per_type
+                GROUP BY 1, 2
+            ),
+            summary AS (
+                INSERT INTO cida_daily_attendance AS s
+                    (employee_id, day, first_event, last_event, event_count, type_counts)
+                SELECT employee_id, day, first_event, last_event, event_count, type_counts
+                FROM per_day
+                ORDER BY employee_id, day
+                ON CONFLICT (employee_id, day) DO UPDATE SET
+                    first_event = LEAST(s.first_event, EXCLUDED.first_event),
+                    last_event = GREATEST(s.last_event, EXCLUDED.last_event),
+                    event_count = s.event_count + EXCLUDED.event_count,
+                    type_counts = cida_add_counts(s.type_counts, EXCLUDED.type_counts)
+            )";
+    }
+
+    /**
+     * Recalcula desde cero los días [$from, $to) (fechas "YYYY-MM-DD") y
+     * devuelve cuántas filas de resumen quedaron. Bloquea las actualizaciones
+     * concurrentes del resumen mientras dura la transacción.
+     */
+    public static function rebuild(PDO $pdo, string $from, string $to): int
+    {
+        $pdo->beginTransaction();
+
+        try {
+            $pdo->exec('LOCK TABLE cida_daily_attendance IN SHARE ROW EXCLUSIVE MODE');
+
+            $pdo->prepare(
+                'DELETE FROM cida_daily_attendance WHERE day >= CAST(:from AS date) AND day < CAST(:to AS date)'
+            )->execute([':from' => $from, ':to' => $to]);
+
+            $stmt = $pdo->prepare(
+                'WITH source AS (
+                    SELECT employee_id, event_time, event_type
+                    FROM cida_attendance_events
+                    WHERE event_time >= CAST(:from AS timestamp) AND event_time < CAST(:to AS timestamp)
+                ), ' . self::upsertCtes('source') . '
+                SELECT count(*) FROM per_day'
+            );
+            $stmt->execute([':from' => $from, ':to' => $to]);
+            $rows = (int) $stmt->fetchColumn();
+
+            $pdo->commit();
+        } catch (Throwable $e) {
+            if ($pdo->inTransaction()) {
+                $pdo->rollBack();
+            }
+            throw $e;
+        }
+
+        return $rows;
+    }
+}
@@ -0,0 +1,170 @@
+<?php
+declare(strict_types=1);
+
+// dimensions.php: claves enteras de dispositivos y empleados (cida_devices, cida_employees).
+
+/**
+ * Resuelve serial de dispositivo y código de empleado a sus claves enteras,
+ * insertándolos si no existen. Los resultados se guardan durante la petición:
+ * un lote repite los mismos pocos empleados miles de veces.
+ */
+class Dimensions
+{
+    private PDO $pdo;
+
+    /** @var array<string, int> */
+    private array $devices = [];
+
+    /** @var array<string, int> */
+    private array $employees = [];
+
+    public function __construct(PDO $pdo)
+    {
+        $this->pdo = $pdo;
+    }
+
+    public function deviceId(array $device): int
+    {
+        $serial = $device['device_id'];
+        if (isset($this->devices[$serial])) {
+            return $this->devices[$serial];
+        }
+
+        // Sólo reescribe la fila si cambió el modelo o el nombre.
+        $stmt = $this->pdo->prepare(
+            'INSERT INTO cida_devices (serial, model, name)
+             VALUES (:serial, :model, :name)
+             ON CONFLICT (serial) DO UPDATE SET model = EXCLUDED.model, name = EXCLUDED.name
+             WHERE (cida_devices.model, cida_devices.name) IS DISTINCT FROM (EXCLUDED.model, EXCLUDED.name)
+             RETURNING id'
+        );
+        $stmt->execute([
+            ':serial' => $serial,
+            ':model' => $device['device_model'],
+            ':name' => $device['device_name'],
+        ]);
+        $id = $stmt->fetchColumn();
+
+        if ($id === false) {
+            $stmt = $this->pdo->prepare('SELECT id FROM cida_devices WHERE serial = :serial');
+            $stmt->execute([':serial' => $serial]);
+            $id = $stmt->fetchColumn();
+        }
+
+        return $this->devices[$serial] = (int) $id;
+    }
+
+    /**
+     * Devuelve [código => id] para los códigos dados, creando los que falten.
+     */
+    public function employeeIds(array $codes): array
+    {
+        $missing = [];
+        foreach ($codes as $code) {
+            if (!isset($this->employees[$code])) {
+                $missing[$code] = true;
+            }
+        }
+
+        if ($missing) {
+            $array = self::pgTextArray(array_keys($missing));
+
+            $this->pdo->prepare(
+                'INSERT INTO cida_employees (code)
+                 SELECT DISTINCT unnest(CAST(:codes AS text[]))
+                 ON CONFLICT (code) DO NOTHING'
+            )->execute([':codes' => $array]);
+
+            // Consulta aparte: ve también los códigos insertados por otra petición concurrente.
+            $stmt = $this->pdo->prepare(
+                'SELECT code, id FROM cida_employees WHERE code = ANY(CAST(:codes AS text[]))'
+            );
+            $stmt->execute([':codes' => $array]);
+            foreach ($stmt->fetchAll() as $row) {
+                $this->employees[$row['code']] = (int) $row['id'];
+            }
+        }
+
+        $ids = [];
+        foreach ($codes as $code) {
+            $ids[$code] = $this->employees[$code];
+        }
+        return $ids;
+    }
+
+    /**
+     * Avanza el cursor del dispositivo con lo insertado y devuelve el valor
+     * resultante. La fila queda bloqueada hasta el commit, así que lo devuelto
+     * es exactamente lo confirmado por esta transacción.
+     */
+    public function advanceCursor(int $deviceId, ?string $lastEventTime, ?int $lastSerial): array
+    {
+        $stmt = $this->pdo->prepare(
+            'UPDATE cida_devices
+             SET last_event_time = GREATEST(last_event_time, CAST(:last_event_time AS timestamp)),
+                 last_serial = GREATEST(last_serial, CAST(:last_serial AS bigint))
+             WHERE id = :id
+             RETURNING LEAST(last_event_time, ' . self::resendFromSql('cida_devices') . ') AS last_event_time,
+                       last_serial'
+        );
+        $stmt->execute([
+            ':last_event_time' => $lastEventTime,
+            ':last_serial' => $lastSerial,
+            ':id' => $deviceId,
+        ]);
+        $row = $stmt->fetch() ?: [];
+
+        return [
+            'last_sync' => $row['last_event_time'] ?? null,
+            'last_serial' => isset($row['last_serial']) ? (int) $row['last_serial'] : null,
+        ];
+    }
+
+    /**
+     * CTE que avanza los cursores de los dispositivos presentes en $source
+     * (device_id, event_time, event_serial), para el merge por conjuntos.
+     */
+    public static function cursorCte(string $source): string
+    {
+        return "device_cursor AS (
+                UPDATE cida_devices d
+                SET last_event_time = GREATEST(d.last_event_time, m.last_event_time),
+                    last_serial = GREATEST(d.last_serial, m.last_serial)
+                FROM (
+                    SELECT device_id, max(event_time) AS last_event_time,
+                           max(event_serial) AS last_serial
+                    FROM $source
+                    GROUP BY device_id
+                ) m
+                WHERE d.id = m.device_id
+            )";
+    }
+
+    /**
+     * Expresión SQL con el instante desde el que debe reenviar el dispositivo
+     * de la fila $alias de cida_devices: un segundo antes del primer evento
+     * del lote asíncrono fallido más antiguo cuyas filas aún no llegaron por
+     * otra vía, o NULL si no hay ninguno.
+     */
+    public static function resendFromSql(string $alias): string
+    {
+        return "(SELECT MIN(f.first_event_time) - interval '1 second'
+                 FROM cida_ingest_batches f
+                 WHERE f.device_serial = $alias.serial
+                   AND f.status = 'failed'
+                   AND NOT EXISTS (
+                       SELECT 1 FROM cida_attendance_events a
+                       WHERE a.device_id = $alias.id AND a.event_time = f.first_event_time
+                   ))";
+    }
+
+    private static function pgTextArray(array $values): string
+    {
+        $items = array_map(
+            // Las claves numéricas de PHP llegan como int.
+            fn ($value): string => '"' . addcslashes((string) $value, '"\\') . '"',
+            $values
+        );
+        return '{' . implode(',', $items) . '}';
+    }
+}
@@ -0,0 +1,308 @@
+<?php
+declare(strict_types=1);
+
+// export_attendance.php: lectura paginada de asistencias (CSV o NDJSON).
+//
+// GET export_attendance.php?from=2024-05-01&to=2024-06-01&device_serial=...&employee_id=...
+//     &format=csv|ndjson&limit=10000&order=time|ingest&cursor=...
+//
+// Paginación por clave, sin OFFSET: cada página continúa después del cursor
+// recibido, que es el de la última fila de la página anterior. Va en la línea
+// final del NDJSON y en la cabecera X-Cursor del CSV.
+//
+// - order=time (por defecto): orden (event_time, id), cursor
+//   "<event_time>,<id>". Para recorrer un rango de fechas.
+// - order=ingest: orden de llegada (id), cursor "<id>". Para consumidores
+//   incrementales: los eventos que llegan tarde (equipos sin conexión, merge
+//   asíncrono) tienen un event_time antiguo pero un id nuevo, así que no
+//   quedan detrás del cursor.
+//
+// Un cursor de llegada enviado en If-None-Match implica order=ingest; si no
+// hay filas nuevas la respuesta es 304 sin cuerpo. Con ?cursor= una página
+// vacía es un 200.
+
+require_once __DIR__ . '/bootstrap.php';
+
+class AttendanceExport
+{
+    private const CONTENT_TYPE_CSV = 'text/csv';
+    private const CONTENT_TYPE_NDJSON = 'application/x-ndjson';
+    private const DEFAULT_LIMIT = 10000;
+    private const MAX_LIMIT = 500000;
+    private const FETCH_SIZE = 1000;
+    private const CSV_MAX_MEMORY = 8 * 1024 * 1024;
+    private const COLUMNS = [
+        'id',
+        'event_time',
+        'employee_id',
+        'event_type',
+        'event_minor',
+        'device_serial',
+        'device_model',
+        'device_name',
+    ];
+
+    public function __construct()
+    {
+        DotEnv::load();
+    }
+
+    public function run(): void
+    {
+        try {
+            BearerAuth::check();
+
+            if (($_SERVER['REQUEST_METHOD'] ?? 'GET') !== 'GET') {
+                $this->sendError(405, 'Method not allowed');
+            }
+
+            $this->export();
+        } catch (PDOException $e) {
+            error_log('Database Error: ' . $e->getMessage());
+            $this->sendError(500, 'Database connection error');
+        } catch (Exception $e) {
+            $code = $e->getCode();
+            $status = ($code >= 400 && $code < 600) ? $code : 500;
+            $this->sendError($status, $e->getMessage());
+        }
+    }
+
+    private function export(): void
+    {
+        $format = $this->chooseFormat();
+        $limit = $this->parseLimit($_GET['limit'] ?? null);
+        $conditional = !isset($_GET['cursor']) && isset($_SERVER['HTTP_IF_NONE_MATCH']);
+        $ingestOrder = $conditional || $this->parseOrder($_GET['order'] ?? null);
+        $cursor = $this->parseCursor($_GET['cursor'] ?? $_SERVER['HTTP_IF_NONE_MATCH'] ?? null, $ingestOrder);
+
+        $conditions = [];
+        $params = [];
+
+        if (is_string($_GET['device_serial'] ?? null) && $_GET['device_serial'] !== '') {
+            $conditions[] = 'd.serial = :device_serial';
+            $params[':device_serial'] = $_GET['device_serial'];
+        }
+        if (is_string($_GET['employee_id'] ?? null) && $_GET['employee_id'] !== '') {
+            $conditions[] = 'e.code = :employee_id';
+            $params[':employee_id'] = $_GET['employee_id'];
+        }
+        if (isset($_GET['from'])) {
+            $conditions[] = 'a.event_time >= :from';
+            $params[':from'] = $this->parseTime($_GET['from'], 'from');
+        }
+        if (isset($_GET['to'])) {
+            $conditions[] = 'a.event_time < :to';
+            $params[':to'] = $this->parseTime($_GET['to'], 'to');
+        }
+        if ($cursor !== null && $ingestOrder) {
+            $conditions[] = 'a.id > CAST(:cursor_id AS bigint)';
+            $params[':cursor_id'] = $cursor[1];
+        } elseif ($cursor !== null) {
+            $conditions[] = '(a.event_time, a.id) > (CAST(:cursor_time AS timestamp), CAST(:cursor_id AS bigint))';
+            $params[':cursor_time'] = $cursor[0];
+            $params[':cursor_id'] = $cursor[1];
+        }
+
+        $sql = 'SELECT a.id, a.event_time, e.code AS employee_id, a.event_type, a.event_minor,
+                       d.serial AS device_serial, d.model AS device_model, d.name AS device_name
+                FROM cida_attendance_events a
+                JOIN cida_devices d ON d.id = a.device_id
+                JOIN cida_employees e ON e.id = a.employee_id'
+            . ($conditions ? ' WHERE ' . implode(' AND ', $conditions) : '')
+            . ($ingestOrder ? ' ORDER BY a.id' : ' ORDER BY a.event_time, a.id')
+            . ' LIMIT ' . $limit;
+
+        $pdo = Database::connect();
+        $pdo->beginTransaction();
+        $pdo->exec('SET TRANSACTION READ ONLY');
+
+        // pdo_pgsql carga el resultado completo en memoria: un cursor de
+        // servidor con FETCH por bloques mantiene constante la memoria de PHP.
+        // DECLARE no admite parámetros del protocolo, así que aquí se emulan.
+        $pdo->prepare(
+            'DECLARE attendance_export NO SCROLL CURSOR FOR ' . $sql,
+            [PDO::ATTR_EMULATE_PREPARES => true]
+        )->execute($params);
+        $fetch = $pdo->prepare('FETCH ' . self::FETCH_SIZE . ' FROM attendance_export');
+
+        $fetch->execute();
+        $rows = $fetch->fetchAll();
+        $next = $cursor !== null ? $this->formatCursor($cursor, $ingestOrder) : null;
+
+        if (!$rows && $conditional) {
+            $pdo->rollBack();
+            http_response_code(304);
+            header('X-Cursor: ' . $next);
+            exit;
+        }
+
+        http_response_code(200);
+        header('Content-Type: ' . $format . '; charset=utf-8');
+        header('Cache-Control: no-store');
+
+        // NDJSON se transmite y lleva el cursor en la línea final. El CSV no
+        // tiene dónde ponerlo: se arma en php://temp (a disco pasado el
+        // límite de memoria) y el cursor sale en X-Cursor antes del cuerpo.
+        if ($format === self::CONTENT_TYPE_CSV) {
+            $out = fopen('php://temp/maxmemory:' . self::CSV_MAX_MEMORY, 'w+b');
+            fputcsv($out, self::COLUMNS);
+        } else {
+            header('X-Accel-Buffering: no');
+            while (ob_get_level() > 0) {
+                ob_end_flush();
+            }
+            $out = fopen('php://output', 'wb');
+        }
+
+        $count = 0;
+        while ($rows) {
+            foreach ($rows as $row) {
+                if ($format === self::CONTENT_TYPE_CSV) {
+                    fputcsv($out, $row);
+                } else {
+                    $row['id'] = (int) $row['id'];
+                    $row['event_type'] = (int) $row['event_type'];
+                    $row['event_minor'] = (int) $row['event_minor'];
+                    fwrite($out, json_encode($row, JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES) . "\n");
+                }
+            }
+            $count += count($rows);
+            $next = $this->formatCursor([end($rows)['event_time'], end($rows)['id']], $ingestOrder);
+            if ($format === self::CONTENT_TYPE_NDJSON) {
+                flush();
+            }
+
+            $fetch->execute();
+            $rows = $fetch->fetchAll();
+        }
+
+        $pdo->exec('CLOSE attendance_export');
+        $pdo->commit();
+
+        if ($format === self::CONTENT_TYPE_CSV) {
+            if ($next !== null) {
+                header('X-Cursor: ' . $next);
+            }
+            header('Content-Length: ' . ftell($out));
+            rewind($out);
+            fpassthru($out);
+        } else {
+            fwrite($out, json_encode([
+                'end' => true,
+                'count' => $count,
+                'cursor' => $next,
+                'more' => $count >= $limit,
+            ]) . "\n");
+        }
+        fclose($out);
+        exit;
+    }
+
+    private function parseOrder($value): bool
+    {
+        if ($value === null || $value === 'time') {
+            return false;
+        }
+        if ($value === 'ingest') {
+            return true;
+        }
+        throw new Exception('Unsupported order', 400);
+    }
+
+    private function formatCursor(array $cursor, bool $ingestOrder): string
+    {
+        return $ingestOrder ? (string) $cursor[1] : $cursor[0] . ',' . $cursor[1];
+    }
+
+    private function chooseFormat(): string
+    {
+        $format = $_GET['format'] ?? null;
+        if ($format === 'csv') {
+            return self::CONTENT_TYPE_CSV;
+        }
+        if ($format === 'ndjson') {
+            return self::CONTENT_TYPE_NDJSON;
+        }
+        if ($format !== null) {
+            throw new Exception('Unsupported format', 400);
+        }
+
+        $accept = $_SERVER['HTTP_ACCEPT'] ?? '';
+        return stripos($accept, self::CONTENT_TYPE_CSV) !== false
+            ? self::CONTENT_TYPE_CSV
+            : self::CONTENT_TYPE_NDJSON;
+    }
+
+    private function parseLimit($value): int
+    {
+        if ($value === null) {
+            return self::DEFAULT_LIMIT;
+        }
+        if (!is_string($value) || !ctype_digit($value) || (int) $value < 1) {
+            throw new Exception('Invalid limit', 400);
+        }
+        return min((int) $value, self::MAX_LIMIT);
+    }
+
+    /**
+     * "<event_time>,<id>"; If-None-Match puede traerlo entre comillas.
+     */
+    /**
+     * [event_time, id]; en orden de llegada el cursor es sólo "<id>" y
+     * event_time queda en null.
+     */
+    private function parseCursor($value, bool $ingestOrder): ?array
+    {
+        if ($value === null || $value === '') {
+            return null;
+        }
+        if (!is_string($value)) {
+            throw new Exception('Invalid cursor', 400);
+        }
+
+        $value = trim($value, " \t\"");
+        if ($ingestOrder) {
+            if (!ctype_digit($value)) {
+                throw new Exception('Invalid cursor for order=ingest', 400);
+            }
+            return [null, $value];
+        }
+
+        $pos = strrpos($value, ',');
+        if ($pos === false) {
+            throw new Exception('Invalid cursor', 400);
+        }
+
+        $id = substr($value, $pos + 1);
+        if (!ctype_digit($id)) {
+            throw new Exception('Invalid cursor', 400);
+        }
+        return [$this->parseTime(substr($value, 0, $pos), 'cursor'), $id];
+    }
+
+    /**
+     * event_time es hora local del dispositivo sin zona: se conserva la hora
+     * de pared tal como llegó, igual que en la ingesta.
+     */
+    private function parseTime($value, string $name): string
+    {
+        if (!is_string($value) || $value === '') {
+            throw new Exception("Invalid $name", 400);
+        }
+        try {
+            return (new DateTime($value))->format('Y-m-d H:i:s.u');
+        } catch (Exception $e) {
+            throw new Exception("Invalid $name", 400);
+        }
+    }
+
+    private function sendError(int $statusCode, string $message): void
+    {
+        http_response_code($statusCode);
+        header('Content-Type: application/json; charset=utf-8');
+        echo json_encode(['error' => $message], JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES);
+        exit;
+    }
+}
+
+(new AttendanceExport())->run();
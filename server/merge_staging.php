@@ -0,0 +1,45 @@
+<?php
+declare(strict_types=1);
+
+// merge_staging.php: mueve los lotes aceptados en staging a cida_attendance.
+//
+// Uso:
+//   php merge_staging.php                 # fusiona lo pendiente y termina (cron)
+//   php merge_staging.php --loop=2        # worker: repite cada 2 segundos
+//   php merge_staging.php --limit=200     # lotes por transacción
+
+require_once __DIR__ . '/bootstrap.php';
+require_once __DIR__ . '/staging.php';
+
+if (PHP_SAPI !== 'cli') {
+    http_response_code(404);
+    exit;
+}
+
+DotEnv::load();
+
+$options = getopt('', ['loop::', 'limit::']);
+$limit = max(1, (int) ($options['limit'] ?? 100));
+$loop = isset($options['loop']) ? max(0.1, (float) ($options['loop'] ?: 1)) : null;
+
+$pdo = Database::connect();
+$staging = new StagingStore($pdo);
+
+do {
+    do {
+        $results = $staging->mergePending($limit);
+        if ($results) {
+            fprintf(
+                STDOUT,
+                "[%s] merged %d batch(es), %d new row(s)\n",
+                date('c'),
+                count($results),
+                array_sum($results)
+            );
+        }
+    } while (count($results) >= $limit);
+
+    if ($loop !== null) {
+        usleep((int) ($loop * 1000000));
+    }
+} while ($loop !== null);
@@ -0,0 +1,42 @@
+-- 001: ingesta asíncrona (staging + lotes) y deduplicación.
+BEGIN;
+
+-- Elimina duplicados existentes antes de crear el índice único.
+DELETE FROM cida_attendance a
+USING cida_attendance b
+WHERE a.id > b.id
+  AND a.device_serial = b.device_serial
+  AND a.event_user_id = b.event_user_id
+  AND a.event_time = b.event_time
+  AND a.event_minor = b.event_minor;
+
+CREATE UNIQUE INDEX cida_attendance_dedupe_idx
+    ON cida_attendance (device_serial, event_user_id, event_time, event_minor);
+
+CREATE TABLE cida_ingest_batches (
+    id BIGSERIAL PRIMARY KEY,
+    device_serial VARCHAR(100) NOT NULL,
+    device_model VARCHAR(100) NOT NULL,
+    device_name VARCHAR(100),
+    record_count INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    inserted INTEGER,
+    error TEXT,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    merged_at TIMESTAMPTZ
+);
+
+CREATE INDEX cida_ingest_batches_pending_idx
+    ON cida_ingest_batches (id) WHERE status = 'pending';
+
+CREATE UNLOGGED TABLE cida_attendance_staging (
+    batch_id BIGINT NOT NULL,
+    event_user_id VARCHAR(100) NOT NULL,
+    event_time TIMESTAMP NOT NULL,
+    event_type INTEGER NOT NULL,
+    event_minor INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX cida_attendance_staging_batch_idx ON cida_attendance_staging (batch_id);
+
+COMMIT;
@@ -0,0 +1,88 @@
+-- 002: cida_attendance particionada por mes (event_time) con índices BRIN/btree.
+--
+-- Copia la tabla existente a la nueva estructura dentro de una transacción y
+-- deja la original como cida_attendance_legacy. Tras verificar los conteos:
+--   DROP TABLE cida_attendance_legacy;
+BEGIN;
+
+ALTER TABLE cida_attendance RENAME TO cida_attendance_legacy;
+ALTER TABLE cida_attendance_legacy RENAME CONSTRAINT cida_attendance_pkey TO cida_attendance_legacy_pkey;
+ALTER INDEX cida_attendance_dedupe_idx RENAME TO cida_attendance_legacy_dedupe_idx;
+ALTER SEQUENCE cida_attendance_id_seq RENAME TO cida_attendance_legacy_id_seq;
+
+CREATE TABLE cida_attendance (
+    id BIGSERIAL,
+    event_user_id VARCHAR(100) NOT NULL,
+    event_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    event_type INTEGER NOT NULL,
+    device_model VARCHAR(100) NOT NULL,
+    device_serial VARCHAR(100) NOT NULL,
+    device_name VARCHAR(100),
+    event_minor INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id, event_time)
+) PARTITION BY RANGE (event_time);
+
+-- Crea (si falta) la partición mensual que contiene p_time. Se crea como tabla
+-- suelta y luego se adjunta: ATTACH PARTITION sólo toma SHARE UPDATE EXCLUSIVE
+-- sobre cida_attendance, así que no bloquea las ingestas en curso.
+CREATE OR REPLACE FUNCTION cida_attendance_ensure_partition(p_time TIMESTAMP)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_from DATE := date_trunc('month', p_time)::date;
+    v_to DATE := (date_trunc('month', p_time) + INTERVAL '1 month')::date;
+    v_name TEXT := 'cida_attendance_p' || to_char(p_time, 'YYYYMM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    -- Serializa la creación concurrente desde varias ingestas.
+    PERFORM pg_advisory_xact_lock(hashtext('cida_attendance_partitions'));
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE cida_attendance INCLUDING DEFAULTS)', v_name);
+    EXECUTE format(
+        'ALTER TABLE cida_attendance ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_from, v_to);
+
+    RETURN v_name;
+END;
+$$;
+
+SELECT cida_attendance_ensure_partition(m)
+FROM (
+    SELECT DISTINCT date_trunc('month', event_time) AS m FROM cida_attendance_legacy
+    UNION
+    SELECT date_trunc('month', CAST(now() AS TIMESTAMP))
+    UNION
+    SELECT date_trunc('month', CAST(now() + INTERVAL '1 month' AS TIMESTAMP))
+) months;
+
+-- Carga antes de indexar: construir los índices al final es mucho más rápido.
+INSERT INTO cida_attendance
+    (id, event_user_id, event_time, event_type, device_model, device_serial, device_name, event_minor)
+SELECT id, event_user_id, event_time, event_type, device_model, device_serial, device_name, event_minor
+FROM cida_attendance_legacy;
+
+SELECT setval(
+    pg_get_serial_sequence('cida_attendance', 'id'),
+    COALESCE((SELECT MAX(id) FROM cida_attendance_legacy), 0) + 1,
+    false
+);
+
+CREATE UNIQUE INDEX cida_attendance_dedupe_idx
+    ON cida_attendance (device_serial, event_user_id, event_time, event_minor);
+CREATE INDEX cida_attendance_event_time_brin
+    ON cida_attendance USING BRIN (event_time) WITH (pages_per_range = 32);
+CREATE INDEX cida_attendance_device_time_idx
+    ON cida_attendance (device_serial, event_time);
+CREATE INDEX cida_attendance_user_time_idx
+    ON cida_attendance (event_user_id, event_time);
+
+COMMIT;
+
+ANALYZE cida_attendance;
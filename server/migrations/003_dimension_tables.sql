@@ -0,0 +1,120 @@
+-- 003: dimensiones cida_devices/cida_employees y tabla de hechos compacta.
+--
+-- Los eventos pasan a cida_attendance_events con claves enteras y
+-- cida_attendance queda como vista con las columnas originales. La tabla
+-- anterior se conserva como cida_attendance_wide; tras verificar los conteos:
+--   DROP TABLE cida_attendance_wide;
+BEGIN;
+
+ALTER TABLE cida_attendance RENAME TO cida_attendance_wide;
+
+CREATE TABLE cida_devices (
+    id SERIAL PRIMARY KEY,
+    serial VARCHAR(100) NOT NULL UNIQUE,
+    model VARCHAR(100) NOT NULL,
+    name VARCHAR(100)
+);
+
+CREATE TABLE cida_employees (
+    id SERIAL PRIMARY KEY,
+    code VARCHAR(100) NOT NULL UNIQUE
+);
+
+INSERT INTO cida_devices (serial, model, name)
+SELECT DISTINCT ON (device_serial) device_serial, device_model, device_name
+FROM cida_attendance_wide
+ORDER BY device_serial, event_time DESC;
+
+INSERT INTO cida_employees (code)
+SELECT DISTINCT event_user_id FROM cida_attendance_wide;
+
+CREATE TABLE cida_attendance_events (
+    id BIGSERIAL,
+    event_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    device_id INTEGER NOT NULL REFERENCES cida_devices (id),
+    employee_id INTEGER NOT NULL REFERENCES cida_employees (id),
+    event_type INTEGER NOT NULL,
+    event_minor INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id, event_time)
+) PARTITION BY RANGE (event_time);
+
+-- Crea (si falta) la partición mensual que contiene p_time. Se crea como tabla
+-- suelta y luego se adjunta: ATTACH PARTITION sólo toma SHARE UPDATE EXCLUSIVE
+-- sobre cida_attendance_events, así que no bloquea las ingestas en curso.
+CREATE OR REPLACE FUNCTION cida_attendance_ensure_partition(p_time TIMESTAMP)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_from DATE := date_trunc('month', p_time)::date;
+    v_to DATE := (date_trunc('month', p_time) + INTERVAL '1 month')::date;
+    v_name TEXT := 'cida_attendance_events_p' || to_char(p_time, 'YYYYMM');
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    -- Serializa la creación concurrente desde varias ingestas.
+    PERFORM pg_advisory_xact_lock(hashtext('cida_attendance_partitions'));
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE cida_attendance_events INCLUDING DEFAULTS)', v_name);
+    EXECUTE format(
+        'ALTER TABLE cida_attendance_events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_from, v_to);
+
+    RETURN v_name;
+END;
+$$;
+
+SELECT cida_attendance_ensure_partition(m)
+FROM (
+    SELECT DISTINCT date_trunc('month', event_time) AS m FROM cida_attendance_wide
+    UNION
+    SELECT date_trunc('month', CAST(now() AS TIMESTAMP))
+    UNION
+    SELECT date_trunc('month', CAST(now() + INTERVAL '1 month' AS TIMESTAMP))
+) months;
+
+INSERT INTO cida_attendance_events (id, event_time, device_id, employee_id, event_type, event_minor)
+SELECT w.id, w.event_time, d.id, e.id, w.event_type, w.event_minor
+FROM cida_attendance_wide w
+JOIN cida_devices d ON d.serial = w.device_serial
+JOIN cida_employees e ON e.code = w.event_user_id;
+
+SELECT setval(
+    pg_get_serial_sequence('cida_attendance_events', 'id'),
+    COALESCE((SELECT MAX(id) FROM cida_attendance_wide), 0) + 1,
+    false
+);
+
+CREATE UNIQUE INDEX cida_attendance_events_dedupe_idx
+    ON cida_attendance_events (device_id, employee_id, event_time, event_minor);
+
+CREATE INDEX cida_attendance_events_time_brin
+    ON cida_attendance_events USING BRIN (event_time) WITH (pages_per_range = 32);
+CREATE INDEX cida_attendance_events_device_time_idx
+    ON cida_attendance_events (device_id, event_time);
+CREATE INDEX cida_attendance_events_employee_time_idx
+    ON cida_attendance_events (employee_id, event_time);
+
+CREATE VIEW cida_attendance AS
+SELECT a.id,
+       e.code AS event_user_id,
+       a.event_time,
+       a.event_type,
+       d.model AS device_model,
+       d.serial AS device_serial,
+       d.name AS device_name,
+       a.event_minor
+FROM cida_attendance_events a
+JOIN cida_devices d ON d.id = a.device_id
+JOIN cida_employees e ON e.id = a.employee_id;
+
+COMMIT;
+
+ANALYZE cida_devices;
+ANALYZE cida_employees;
+ANALYZE cida_attendance_events;
@@ -0,0 +1,5 @@
+-- 004: índice para la paginación por clave (event_time, id) de export_attendance.php.
+-- En una tabla particionada no existe CREATE INDEX CONCURRENTLY: con tablas
+-- grandes conviene crearlo por partición y adjuntarlo (ALTER INDEX ... ATTACH).
+CREATE INDEX cida_attendance_events_time_id_idx
+    ON cida_attendance_events (event_time, id);
@@ -0,0 +1,34 @@
+-- 005: resumen diario por empleado. Tras aplicarla, cargar el histórico con:
+--   php rebuild_daily.php
+BEGIN;
+
+-- Resumen diario por empleado, mantenido por la ingesta (ver daily_summary.php).
+CREATE TABLE cida_daily_attendance (
+    employee_id INTEGER NOT NULL REFERENCES cida_employees (id),
+    day DATE NOT NULL,
+    first_event TIMESTAMP NOT NULL,
+    last_event TIMESTAMP NOT NULL,
+    event_count INTEGER NOT NULL,
+    type_counts JSONB NOT NULL DEFAULT '{}',
+    PRIMARY KEY (employee_id, day)
+);
+
+CREATE INDEX cida_daily_attendance_day_idx ON cida_daily_attendance (day);
+
+-- Suma dos objetos {"event_type": conteo}.
+CREATE OR REPLACE FUNCTION cida_add_counts(a JSONB, b JSONB)
+RETURNS JSONB
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+    FROM (
+        SELECT key, sum(CAST(value AS bigint)) AS total
+        FROM (
+            SELECT * FROM jsonb_each_text(a)
+            UNION ALL
+            SELECT * FROM jsonb_each_text(b)
+        ) kv
+        GROUP BY key
+    ) totals
+$$;
+
+COMMIT;
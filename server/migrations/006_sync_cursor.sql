@@ -0,0 +1,30 @@
+-- 006: número de serie del evento y cursor de sincronización por dispositivo.
+BEGIN;
+
+ALTER TABLE cida_attendance_events ADD COLUMN event_serial BIGINT;
+ALTER TABLE cida_attendance_staging ADD COLUMN event_serial BIGINT;
+
+ALTER TABLE cida_devices
+    ADD COLUMN last_event_time TIMESTAMP,
+    ADD COLUMN last_serial BIGINT;
+
+UPDATE cida_devices d
+SET last_event_time = (
+    SELECT MAX(a.event_time) FROM cida_attendance_events a WHERE a.device_id = d.id
+);
+
+CREATE OR REPLACE VIEW cida_attendance AS
+SELECT a.id,
+       e.code AS event_user_id,
+       a.event_time,
+       a.event_type,
+       d.model AS device_model,
+       d.serial AS device_serial,
+       d.name AS device_name,
+       a.event_minor,
+       a.event_serial
+FROM cida_attendance_events a
+JOIN cida_devices d ON d.id = a.device_id
+JOIN cida_employees e ON e.id = a.employee_id;
+
+COMMIT;
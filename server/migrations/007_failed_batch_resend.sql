@@ -0,0 +1,10 @@
+-- 007: primer evento de cada lote, para que el cursor no pase por encima de
+-- un lote asíncrono que falló en el merge.
+BEGIN;
+
+ALTER TABLE cida_ingest_batches ADD COLUMN first_event_time TIMESTAMP;
+
+CREATE INDEX cida_ingest_batches_failed_idx
+    ON cida_ingest_batches (device_serial) WHERE status = 'failed';
+
+COMMIT;
@@ -0,0 +1,139 @@
+<?php
+declare(strict_types=1);
+
+// partitions.php: particiones mensuales de cida_attendance_events (creación y retención).
+
+/**
+ * cida_attendance_events está particionada por mes sobre event_time. Las
+ * ingestas llaman a ensureForRecords() antes de insertar para que un lote con
+ * eventos de un mes sin partición (p.ej. una carga histórica) no falle;
+ * retention.php crea los meses siguientes por adelantado y separa los antiguos.
+ */
+class AttendancePartitions
+{
+    private const NAME_PATTERN = '/^cida_attendance_events_p(\d{4})(\d{2})$/';
+
+    private PDO $pdo;
+    private ?PDOStatement $ensureStmt = null;
+
+    /** @var array<string, true> meses ya asegurados en esta petición */
+    private array $known = [];
+
+    public function __construct(PDO $pdo)
+    {
+        $this->pdo = $pdo;
+    }
+
+    public function ensureForRecords(array $records): void
+    {
+        $months = [];
+        foreach ($records as $rec) {
+            $month = self::monthOf($rec['timestamp']);
+            if (!isset($this->known[$month])) {
+                $months[$month] = true;
+            }
+        }
+
+        foreach (array_keys($months) as $month) {
+            $this->ensureMonth($month);
+        }
+    }
+
+    /**
+     * Asegura la partición del mes "YYYY-MM" y devuelve su nombre.
+     */
+    public function ensureMonth(string $month): string
+    {
+        if ($this->ensureStmt === null) {
+            $this->ensureStmt = $this->pdo->prepare(
+                'SELECT cida_attendance_ensure_partition(CAST(? AS timestamp))'
+            );
+        }
+        $this->ensureStmt->execute([$month . '-01']);
+        $this->known[$month] = true;
+
+        return (string) $this->ensureStmt->fetchColumn();
+    }
+
+    /**
+     * Particiones adjuntas a cida_attendance_events como [nombre => primer día del mes].
+     */
+    public function listPartitions(): array
+    {
+        $stmt = $this->pdo->query(
+            "SELECT c.relname
+             FROM pg_inherits i
+             JOIN pg_class c ON c.oid = i.inhrelid
+             WHERE i.inhparent = 'cida_attendance_events'::regclass
+             ORDER BY c.relname"
+        );
+
+        $partitions = [];
+        foreach ($stmt->fetchAll(PDO::FETCH_COLUMN) as $name) {
+            if (preg_match(self::NAME_PATTERN, $name, $m)) {
+                $partitions[$name] = new DateTimeImmutable("{$m[1]}-{$m[2]}-01");
+            }
+        }
+        return $partitions;
+    }
+
+    /**
+     * Separa las particiones cuyo mes termina antes de $cutoff. Con
+     * $archiveSchema se mueven a ese esquema (siguen consultables); con $drop
+     * se eliminan. Devuelve los nombres afectados.
+     */
+    public function detachOlderThan(
+        DateTimeImmutable $cutoff,
+        ?string $archiveSchema,
+        bool $drop = false,
+        bool $concurrently = false,
+        bool $dryRun = false
+    ): array {
+        $detached = [];
+        foreach ($this->listPartitions() as $name => $month) {
+            if ($month->modify('+1 month') > $cutoff) {
+                continue;
+            }
+            $detached[] = $name;
+            if ($dryRun) {
+                continue;
+            }
+
+            // CONCURRENTLY no bloquea las lecturas, pero no admite transacción.
+            $this->pdo->exec(sprintf(
+                'ALTER TABLE cida_attendance_events DETACH PARTITION %s%s',
+                self::quoteIdent($name),
+                $concurrently ? ' CONCURRENTLY' : ''
+            ));
+
+            if ($drop) {
+                $this->pdo->exec('DROP TABLE ' . self::quoteIdent($name));
+            } elseif ($archiveSchema !== null) {
+                $this->pdo->exec('CREATE SCHEMA IF NOT EXISTS ' . self::quoteIdent($archiveSchema));
+                $this->pdo->exec(sprintf(
+                    'ALTER TABLE %s SET SCHEMA %s',
+                    self::quoteIdent($name),
+                    self::quoteIdent($archiveSchema)
+                ));
+            }
+        }
+        return $detached;
+    }
+
+    /**
+     * Mes local ("YYYY-MM") de un timestamp ISO 8601. Postgres descarta el
+     * offset al convertir a TIMESTAMP, así que el mes es el de la hora local.
+     */
+    private static function monthOf(string $timestamp): string
+    {
+        if (preg_match('/^(\d{4})-(\d{2})/', $timestamp, $m)) {
+            return "{$m[1]}-{$m[2]}";
+        }
+        return (new DateTime($timestamp))->format('Y-m');
+    }
+
+    private static function quoteIdent(string $name): string
+    {
+        return '"' . str_replace('"', '""', $name) . '"';
+    }
+}
@@ -0,0 +1,17 @@
+<?php
+declare(strict_types=1);
+
+// preload.php: opcache.preload. Compila las clases compartidas una sola vez al
+// arrancar el servidor; los workers las encuentran ya enlazadas en memoria.
+// Los scripts de entrada (sync_attendance.php, export_attendance.php) no se
+// precargan porque ejecutan código al incluirse.
+
+foreach ([
+    'bootstrap.php',
+    'daily_summary.php',
+    'dimensions.php',
+    'partitions.php',
+    'staging.php',
+] as $file) {
+    opcache_compile_file(__DIR__ . '/' . $file);
+}
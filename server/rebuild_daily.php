@@ -0,0 +1,46 @@
+<?php
+declare(strict_types=1);
+
+// rebuild_daily.php: recalcula cida_daily_attendance desde los eventos.
+//
+// Uso (tras cargas masivas, correcciones manuales o la migración inicial):
+//   php rebuild_daily.php                                 # todo el histórico
+//   php rebuild_daily.php --from=2024-01-01 --to=2024-07-01
+//
+// Procesa un mes por transacción para no bloquear la ingesta durante horas.
+
+require_once __DIR__ . '/bootstrap.php';
+require_once __DIR__ . '/daily_summary.php';
+
+if (PHP_SAPI !== 'cli') {
+    http_response_code(404);
+    exit;
+}
+
+DotEnv::load();
+
+$options = getopt('', ['from::', 'to::']);
+
+$pdo = Database::connect();
+
+if (!empty($options['from'])) {
+    $from = new DateTimeImmutable($options['from']);
+} else {
+    $first = $pdo->query('SELECT MIN(event_time) FROM cida_attendance_events')->fetchColumn();
+    if ($first === null || $first === false) {
+        fwrite(STDOUT, "no events\n");
+        exit;
+    }
+    $from = new DateTimeImmutable(substr((string) $first, 0, 10));
+}
+$to = new DateTimeImmutable(!empty($options['to']) ? $options['to'] : 'tomorrow');
+
+$from = $from->setTime(0, 0);
+$to = $to->setTime(0, 0);
+
+while ($from < $to) {
+    $next = min($from->modify('first day of next month'), $to);
+    $rows = DailySummary::rebuild($pdo, $from->format('Y-m-d'), $next->format('Y-m-d'));
+    fprintf(STDOUT, "%s .. %s: %d row(s)\n", $from->format('Y-m-d'), $next->format('Y-m-d'), $rows);
+    $from = $next;
+}
@@ -0,0 +1,61 @@
+<?php
+declare(strict_types=1);
+
+// retention.php: mantenimiento de particiones mensuales de cida_attendance_events.
+//
+// Uso (cron diario o mensual):
+//   php retention.php                           # crea 2 meses por adelantado, conserva 24
+//   php retention.php --keep-months=36          # o RETENTION_MONTHS en .env
+//   php retention.php --archive-schema=archivo  # esquema destino (por defecto cida_archive)
+//   php retention.php --drop                    # elimina en lugar de archivar
+//   php retention.php --concurrently            # DETACH ... CONCURRENTLY (Postgres 14+)
+//   php retention.php --dry-run                 # sólo lista lo que haría
+
+require_once __DIR__ . '/bootstrap.php';
+require_once __DIR__ . '/partitions.php';
+
+if (PHP_SAPI !== 'cli') {
+    http_response_code(404);
+    exit;
+}
+
+DotEnv::load();
+
+$options = getopt('', ['keep-months::', 'premake::', 'archive-schema::', 'drop', 'concurrently', 'dry-run']);
+$keepMonths = max(1, (int) ($options['keep-months'] ?? (getenv('RETENTION_MONTHS') ?: 24)));
+$premake = max(0, (int) ($options['premake'] ?? 2));
+$archiveSchema = ($options['archive-schema'] ?? '') ?: 'cida_archive';
+$drop = isset($options['drop']);
+$dryRun = isset($options['dry-run']);
+
+$pdo = Database::connect();
+$partitions = new AttendancePartitions($pdo);
+
+$thisMonth = new DateTimeImmutable('first day of this month 00:00');
+
+for ($i = 0; $i <= $premake; $i++) {
+    $month = $thisMonth->modify("+$i month")->format('Y-m');
+    if ($dryRun) {
+        fprintf(STDOUT, "would ensure partition for %s\n", $month);
+        continue;
+    }
+    fprintf(STDOUT, "ensured %s\n", $partitions->ensureMonth($month));
+}
+
+$cutoff = $thisMonth->modify("-$keepMonths month");
+$detached = $partitions->detachOlderThan(
+    $cutoff,
+    $archiveSchema,
+    $drop,
+    isset($options['concurrently']),
+    $dryRun
+);
+
+foreach ($detached as $name) {
+    fprintf(
+        STDOUT,
+        "%s %s\n",
+        $dryRun ? 'would detach' : ($drop ? 'dropped' : "archived to $archiveSchema:"),
+        $name
+    );
+}
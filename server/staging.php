@@ -0,0 +1,270 @@
+<?php
+declare(strict_types=1);
+
+// staging.php: ingesta asíncrona (tabla de staging UNLOGGED + merge en segundo plano).
+
+require_once __DIR__ . '/daily_summary.php';
+require_once __DIR__ . '/dimensions.php';
+
+/**
+ * Los POST asíncronos copian el lote crudo a cida_attendance_staging con COPY y
+ * responden 202 con un batch_id. merge_staging.php mueve después los lotes a
+ * cida_attendance_events con sentencias por conjuntos, deduplicando.
+ */
+class StagingStore
+{
+    public const STATUS_RECEIVING = 'receiving';
+    public const STATUS_PENDING = 'pending';
+    public const STATUS_MERGED = 'merged';
+    public const STATUS_FAILED = 'failed';
+
+    private PDO $pdo;
+
+    public function __construct(PDO $pdo)
+    {
+        $this->pdo = $pdo;
+    }
+
+    public function createBatch(array $device, ?int $recordCount = null): int
+    {
+        $stmt = $this->pdo->prepare(
+            'INSERT INTO cida_ingest_batches (device_serial, device_model, device_name, record_count, status)
+             VALUES (:device_serial, :device_model, :device_name, :record_count, :status)
+             RETURNING id'
+        );
+        $stmt->execute([
+            ':device_serial' => $device['device_id'],
+            ':device_model' => $device['device_model'],
+            ':device_name' => $device['device_name'],
+            ':record_count' => $recordCount ?? 0,
+            ':status' => $recordCount === null ? self::STATUS_RECEIVING : self::STATUS_PENDING,
+        ]);
+
+        return (int) $stmt->fetchColumn();
+    }
+
+    public function stageRecords(int $batchId, array $records): void
+    {
+        if (!$records) {
+            return;
+        }
+
+        $rows = [];
+        foreach ($records as $rec) {
+            $rows[] = implode("\t", [
+                $batchId,
+                self::escapeCopy($rec['employee_id']),
+                self::escapeCopy($rec['timestamp']),
+                (int) $rec['event_type'],
+                (int) $rec['event_minor'],
+                $rec['serial_no'] ?? '\\N',
+            ]);
+        }
+
+        $ok = $this->pdo->pgsqlCopyFromArray(
+            'cida_attendance_staging',
+            $rows,
+            "\t",
+            '\\N',
+            'batch_id,event_user_id,event_time,event_type,event_minor,event_serial'
+        );
+        if (!$ok) {
+            throw new RuntimeException('COPY into staging failed');
+        }
+
+        // Si el merge pierde el lote, el cursor del dispositivo no pasa de aquí.
+        $this->pdo->prepare(
+            'UPDATE cida_ingest_batches
+             SET first_event_time = LEAST(first_event_time, CAST(:first_event_time AS timestamp))
+             WHERE id = :id'
+        )->execute([
+            ':first_event_time' => min(array_column($records, 'timestamp')),
+            ':id' => $batchId,
+        ]);
+    }
+
+    public function finishBatch(int $batchId, int $recordCount): void
+    {
+        $stmt = $this->pdo->prepare(
+            'UPDATE cida_ingest_batches SET status = :status, record_count = :record_count WHERE id = :id'
+        );
+        $stmt->execute([
+            ':status' => self::STATUS_PENDING,
+            ':record_count' => $recordCount,
+            ':id' => $batchId,
+        ]);
+    }
+
+    public function getBatch(int $batchId): ?array
+    {
+        $stmt = $this->pdo->prepare(
+            'SELECT id AS batch_id, device_serial, status, record_count, inserted, error,
+                    received_at, merged_at, first_event_time
+             FROM cida_ingest_batches WHERE id = :id'
+        );
+        $stmt->execute([':id' => $batchId]);
+        $row = $stmt->fetch();
+
+        return $row ?: null;
+    }
+
+    /**
+     * Fusiona hasta $limit lotes pendientes en una sola transacción y devuelve
+     * [batch_id => insertados]. Los lotes con filas perdidas (p.ej. staging
+     * vaciado por un crash, al ser UNLOGGED) se marcan como fallidos; hasta
+     * que sus eventos lleguen de nuevo, el cursor del dispositivo se queda
+     * antes de su primer evento (Dimensions::resendFromSql) y el cliente los reenvía.
+     */
+    public function mergePending(int $limit = 100): array
+    {
+        $pdo = $this->pdo;
+        $pdo->beginTransaction();
+
+        try {
+            $stmt = $pdo->prepare(
+                'SELECT b.id, b.record_count,
+                        (SELECT count(*) FROM cida_attendance_staging s WHERE s.batch_id = b.id) AS staged
+                 FROM cida_ingest_batches b
+                 WHERE b.status = :status
+                 ORDER BY b.id
+                 LIMIT :limit
+                 FOR UPDATE SKIP LOCKED'
+            );
+            $stmt->bindValue(':status', self::STATUS_PENDING);
+            $stmt->bindValue(':limit', $limit, PDO::PARAM_INT);
+            $stmt->execute();
+
+            $ids = [];
+            $failed = [];
+            foreach ($stmt->fetchAll() as $row) {
+                if ((int) $row['staged'] !== (int) $row['record_count']) {
+                    $failed[] = (int) $row['id'];
+                } else {
+                    $ids[] = (int) $row['id'];
+                }
+            }
+
+            $results = $ids ? $this->mergeBatches($ids) : [];
+
+            if ($ids) {
+                $this->markBatches($ids, self::STATUS_MERGED, null, $results);
+            }
+            if ($failed) {
+                $this->markBatches($failed, self::STATUS_FAILED, 'Staged rows lost before merge');
+            }
+
+            $all = array_merge($ids, $failed);
+            if ($all) {
+                $pdo->prepare('DELETE FROM cida_attendance_staging WHERE batch_id = ANY(CAST(:ids AS bigint[]))')
+                    ->execute([':ids' => self::pgArray($all)]);
+            }
+
+            $pdo->commit();
+        } catch (Throwable $e) {
+            if ($pdo->inTransaction()) {
+                $pdo->rollBack();
+            }
+            throw $e;
+        }
+
+        foreach ($ids as $id) {
+            $results[$id] = $results[$id] ?? 0;
+        }
+        return $results;
+    }
+
+    private function mergeBatches(array $ids): array
+    {
+        $pdo = $this->pdo;
+        $params = [':ids' => self::pgArray($ids)];
+
+        $pdo->prepare(
+            "SELECT cida_attendance_ensure_partition(m)
+             FROM (
+                SELECT DISTINCT date_trunc('month', event_time) AS m
+                FROM cida_attendance_staging
+                WHERE batch_id = ANY(CAST(:ids AS bigint[]))
+             ) months"
+        )->execute($params);
+
+        // Dimensiones primero, en sentencias aparte para que el merge vea
+        // también las filas creadas por ingestas concurrentes.
+        $pdo->prepare(
+            'INSERT INTO cida_devices (serial, model, name)
+             SELECT DISTINCT ON (device_serial) device_serial, device_model, device_name
+             FROM cida_ingest_batches
+             WHERE id = ANY(CAST(:ids AS bigint[]))
+             ORDER BY device_serial, id DESC
+             ON CONFLICT (serial) DO UPDATE SET model = EXCLUDED.model, name = EXCLUDED.name
+             WHERE (cida_devices.model, cida_devices.name) IS DISTINCT FROM (EXCLUDED.model, EXCLUDED.name)'
+        )->execute($params);
+        $pdo->prepare(
+            'INSERT INTO cida_employees (code)
+             SELECT DISTINCT event_user_id FROM cida_attendance_staging
+             WHERE batch_id = ANY(CAST(:ids AS bigint[]))
+             ON CONFLICT (code) DO NOTHING'
+        )->execute($params);
+
+        // DISTINCT ON deduplica dentro del conjunto; ON CONFLICT contra lo ya cargado.
+        $stmt = $pdo->prepare(
+            'WITH candidates AS (
+                SELECT DISTINCT ON (d.id, e.id, s.event_time, s.event_minor)
+                       b.id AS batch_id, d.id AS device_id, e.id AS employee_id,
+                       s.event_time, s.event_type, s.event_minor, s.event_serial
+                FROM cida_attendance_staging s
+                JOIN cida_ingest_batches b ON b.id = s.batch_id
+                JOIN cida_devices d ON d.serial = b.device_serial
+                JOIN cida_employees e ON e.code = s.event_user_id
+                WHERE s.batch_id = ANY(CAST(:ids AS bigint[]))
+                ORDER BY d.id, e.id, s.event_time, s.event_minor, b.id DESC
+            ),
+            inserted AS (
+                INSERT INTO cida_attendance_events
+                    (device_id, employee_id, event_time, event_type, event_minor, event_serial)
+                SELECT device_id, employee_id, event_time, event_type, event_minor, event_serial
+                FROM candidates
+                ON CONFLICT DO NOTHING
+                RETURNING device_id, employee_id, event_time, event_minor, event_type, event_serial
+            ), ' . DailySummary::upsertCtes('inserted') . ',
+            ' . Dimensions::cursorCte('inserted') . '
+            SELECT c.batch_id, count(*) AS inserted
+            FROM inserted i
+            JOIN candidates c USING (device_id, employee_id, event_time, event_minor)
+            GROUP BY c.batch_id'
+        );
+        $stmt->execute($params);
+
+        $results = [];
+        foreach ($stmt->fetchAll() as $row) {
+            $results[(int) $row['batch_id']] = (int) $row['inserted'];
+        }
+        return $results;
+    }
+
+    private function markBatches(array $ids, string $status, ?string $error, array $inserted = []): void
+    {
+        $stmt = $this->pdo->prepare(
+            'UPDATE cida_ingest_batches
+             SET status = :status, error = :error, inserted = :inserted, merged_at = now()
+             WHERE id = :id'
+        );
+        foreach ($ids as $id) {
+            $stmt->execute([
+                ':status' => $status,
+                ':error' => $error,
+                ':inserted' => $inserted[$id] ?? 0,
+                ':id' => $id,
+            ]);
+        }
+    }
+
+    private static function pgArray(array $ids): string
+    {
+        return '{' . implode(',', array_map('intval', $ids)) . '}';
+    }
+
+    private static function escapeCopy(string $value): string
+    {
+        return strtr($value, ["\\" => '\\\\', "\t" => '\\t', "\n" => '\\n', "\r" => '\\r']);
+    }
+}
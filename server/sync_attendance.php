@@ -3,76 +3,46 @@ declare(strict_types=1);
 
 // sync_attendance.php
 
-/**
- * Carga variables de entorno desde un archivo .env simple.
- */
-class DotEnv
-{
-    public static function load(string $path = __DIR__ . '/.env', int $maxBytes = 1048576): void
-    {
-        if (!is_readable($path) || (@filesize($path) ?: 0) > $maxBytes) {
-            return;
-        }
-
-        $lines = @file($path, FILE_IGNORE_NEW_LINES | FILE_SKIP_EMPTY_LINES);
-        if ($lines === false) {
-            return;
-        }
-
-        foreach ($lines as $raw) {
-            $line = trim($raw);
-            if ($line === '' || $line[0] === '#') {
-                continue;
-            }
-
-            if (stripos($line, 'export ') === 0) {
-                $line = trim(substr($line, 7));
-            }
+require_once __DIR__ . '/bootstrap.php';
+require_once __DIR__ . '/daily_summary.php';
+require_once __DIR__ . '/dimensions.php';
+require_once __DIR__ . '/partitions.php';
+require_once __DIR__ . '/staging.php';
 
-            $pos = strpos($line, '=');
-            if ($pos === false) {
-                continue;
-            }
-
-            $name = trim(substr($line, 0, $pos));
-            $value = trim(substr($line, $pos + 1));
-
-            if ($name === '') {
-                continue;
-            }
-
-            if (strlen($value) >= 2) {
-                $first = $value[0];
-                $last = $value[strlen($value) - 1];
-                if (($first === '"' && $last === '"') || ($first === "'" && $last === "'")) {
-                    $value = substr($value, 1, -1);
-                    if ($first === '"') {
-                        $value = str_replace(
-                            ["\\n", "\\r", "\\t", "\\\"", "\\\\", "\\'"],
-                            ["\n", "\r", "\t", "\"", "\\", "'"],
-                            $value
-                        );
-                    }
-                } else {
-                    $hashPos = strpos($value, ' #');
-                    if ($hashPos !== false) {
-                        $value = trim(substr($value, 0, $hashPos));
-                    }
-                }
-            }
+class IngestBusyException extends Exception
+{
+    public int $retryAfter;
 
-            if (getenv($name) === false) {
-                @putenv("$name=$value");
-            }
-            $_ENV[$name] = $value;
-            $_SERVER[$name] = $value;
-        }
+    public function __construct(int $retryAfter)
+    {
+        parent::__construct('Too many concurrent uploads', 429);
+        $this->retryAfter = $retryAfter;
     }
 }
 
 class AttendanceSync
 {
+    private const CONTENT_TYPE_JSON = 'application/json';
+    private const CONTENT_TYPE_COLUMNAR = 'application/vnd.cida.attendance.columnar+json';
+    private const CONTENT_TYPE_BINARY = 'application/vnd.cida.attendance.columnar';
+    private const CONTENT_TYPE_NDJSON = 'application/x-ndjson';
+    private const CONTENT_TYPE_ENVELOPE = 'application/vnd.cida.attendance.envelope+json';
+    private const ENVELOPE_MAX_BATCHES = 200;
+    private const INSERT_CHUNK_SIZE = 500;
+    private const STAGE_CHUNK_SIZE = 5000;
+    private const WIRE_VERSION = 1;
+    private const BINARY_FLAG_SERIAL = 0x01;
+    private const INGEST_LOCK_NAMESPACE = 0x43494441; // "CIDA"
+
     private ?PDO $pdo = null;
+    private ?AttendancePartitions $partitions = null;
+    private ?Dimensions $dimensions = null;
+
+    /** @var array<int, PDOStatement> INSERT preparados por número de filas */
+    private array $insertStatements = [];
+
+    /** @var array<string, array> máximos insertados por dispositivo en esta transacción */
+    private array $insertedMax = [];
 
     public function __construct()
     {
@@ -82,7 +52,7 @@ class AttendanceSync
     public function run(): void
     {
         try {
-            $this->authenticate();
+            BearerAuth::check();
 
             $method = $_SERVER['REQUEST_METHOD'] ?? 'GET';
 
@@ -98,6 +68,12 @@ class AttendanceSync
                     break;
             }
 
+        } catch (IngestBusyException $e) {
+            header('Retry-After: ' . $e->retryAfter);
+            $this->sendResponse(429, [
+                'error' => $e->getMessage(),
+                'retry_after' => $e->retryAfter,
+            ]);
         } catch (PDOException $e) {
             error_log('Database Error: ' . $e->getMessage());
             $this->sendResponse(500, ['error' => 'Database connection error']);
@@ -110,123 +86,672 @@ class AttendanceSync
         }
     }
 
-    private function authenticate(): void
+    private function getDb(): PDO
     {
-        $authHeader = $_SERVER['HTTP_AUTHORIZATION'] ?? getallheaders()['Authorization'] ?? '';
-        $token = '';
-
-        if (stripos($authHeader, 'Bearer ') === 0) {
-            $token = trim(substr($authHeader, 7));
-        }
-
-        $expectedToken = getenv('AUTH_TOKEN');
-        if (!$expectedToken) {
-            $expectedToken = 'CAMBIA_ESTE_TOKEN_POR_UNO_MUY_LARGO_Y_ALEATORIO';
+        if ($this->pdo === null) {
+            $this->pdo = Database::connect();
         }
+        return $this->pdo;
+    }
 
-        if (!hash_equals($expectedToken, $token)) {
-            throw new Exception('Unauthorized', 401);
+    private function getDimensions(): Dimensions
+    {
+        if ($this->dimensions === null) {
+            $this->dimensions = new Dimensions($this->getDb());
         }
+        return $this->dimensions;
     }
 
-    private function getDb(): PDO
+    private function getPartitions(): AttendancePartitions
     {
-        if ($this->pdo === null) {
-            $uri = getenv('DB_URI');
-            $dsn = 'pgsql:host=localhost;port=5432;dbname=cida_attendance';
-            $user = 'tu_usuario';
-            $pass = '';
-
-            if (is_string($uri) && $uri !== '') {
-                $parts = parse_url($uri);
-                if ($parts && ($parts['scheme'] ?? '') === 'postgres') {
-                    $host = $parts['host'] ?? 'localhost';
-                    $port = $parts['port'] ?? 5432;
-                    $user = $parts['user'] ?? '';
-                    $pass = $parts['pass'] ?? '';
-                    $dbname = ltrim($parts['path'] ?? '', '/') ?: 'cida_attendance';
-                    $dsn = sprintf('pgsql:host=%s;port=%d;dbname=%s', $host, (int) $port, $dbname);
-                }
-            }
-
-            $this->pdo = new PDO($dsn, $user, $pass, [
-                PDO::ATTR_ERRMODE => PDO::ERRMODE_EXCEPTION,
-                PDO::ATTR_DEFAULT_FETCH_MODE => PDO::FETCH_ASSOC,
-                PDO::ATTR_EMULATE_PREPARES => false,
-            ]);
+        if ($this->partitions === null) {
+            $this->partitions = new AttendancePartitions($this->getDb());
         }
-        return $this->pdo;
+        return $this->partitions;
     }
 
     private function handleGet(): void
     {
         $pdo = $this->getDb();
+
+        if (isset($_GET['batch_id'])) {
+            $this->handleBatchStatus($pdo, $_GET['batch_id']);
+            return;
+        }
         $deviceSerial = $_GET['device_serial'] ?? null;
         $deviceModel = $_GET['device_model'] ?? null;
 
+        $conditions = [];
         $queryParams = [];
-        $query = 'SELECT MAX(event_time) as last_sync FROM cida_attendance';
 
         if (!empty($deviceSerial) && is_string($deviceSerial)) {
+            $conditions[] = 'd.serial = :device_serial';
             $queryParams['device_serial'] = $deviceSerial;
         }
 
         if (!empty($deviceModel) && is_string($deviceModel)) {
+            $conditions[] = 'd.model = :device_model';
             $queryParams['device_model'] = $deviceModel;
         }
 
-        if (count($queryParams) > 0) {
-            $conditions = [];
-            foreach ($queryParams as $key => $value) {
-                $conditions[] = "$key = :$key";
-            }
-            $query .= " WHERE " . implode(' AND ', $conditions);
-
-            $stmt = $pdo->prepare($query);
-            $stmt->execute($queryParams);
-        } else {
-            $stmt = $pdo->query($query);
+        // MAX por dispositivo en una subconsulta LATERAL: cada una se resuelve
+        // con un único salto en el índice (device_id, event_time).
+        // Un lote asíncrono fallido retiene el cursor hasta que se reenvíe.
+        $query = 'SELECT MAX(LEAST(last.event_time, ' . Dimensions::resendFromSql('d') . ')) AS last_sync
+                  FROM cida_devices d
+                  CROSS JOIN LATERAL (
+                      SELECT MAX(a.event_time) AS event_time
+                      FROM cida_attendance_events a
+                      WHERE a.device_id = d.id
+                  ) last';
+        if ($conditions) {
+            $query .= ' WHERE ' . implode(' AND ', $conditions);
         }
 
+        $stmt = $pdo->prepare($query);
+        $stmt->execute($queryParams);
+
         $row = $stmt->fetch();
-        $this->sendResponse(200, ['last_sync' => $row['last_sync'] ?? null]);
+        $this->sendResponse(200, [
+            'last_sync' => $row['last_sync'] ?? null,
+            'formats' => [
+                self::CONTENT_TYPE_ENVELOPE,
+                self::CONTENT_TYPE_NDJSON,
+                self::CONTENT_TYPE_BINARY,
+                self::CONTENT_TYPE_COLUMNAR,
+                self::CONTENT_TYPE_JSON,
+            ],
+        ]);
+    }
+
+    private function handleBatchStatus(PDO $pdo, $batchId): void
+    {
+        if (!is_string($batchId) || !ctype_digit($batchId)) {
+            throw new Exception('Invalid batch_id', 400);
+        }
+
+        $batch = (new StagingStore($pdo))->getBatch((int) $batchId);
+        if ($batch === null) {
+            throw new Exception('Batch not found', 404);
+        }
+
+        $this->sendResponse(200, $batch);
+    }
+
+    /**
+     * INGEST_MODE: "sync" (por defecto), "async" (siempre staging) o "prefer"
+     * (staging sólo si el cliente envía Prefer: respond-async).
+     */
+    private function useAsyncIngest(): bool
+    {
+        $mode = strtolower((string) (getenv('INGEST_MODE') ?: 'sync'));
+        if ($mode === 'async') {
+            return true;
+        }
+        if ($mode !== 'prefer') {
+            return false;
+        }
+
+        $prefer = $_SERVER['HTTP_PREFER'] ?? '';
+        return stripos($prefer, 'respond-async') !== false;
+    }
+
+    /**
+     * Limita las transacciones de ingesta simultáneas a INGEST_CONCURRENCY
+     * (0 = sin límite). Cada ingesta toma uno de N advisory locks de
+     * transacción y lo libera al confirmar o deshacer; sin ninguno libre se
+     * responde 429 con Retry-After en lugar de sumar otra transacción que
+     * compita por Postgres.
+     */
+    private function acquireIngestSlot(PDO $pdo): void
+    {
+        $slots = (int) (getenv('INGEST_CONCURRENCY') ?: 8);
+        if ($slots <= 0) {
+            return;
+        }
+
+        $stmt = $pdo->prepare(
+            'SELECT slot FROM generate_series(1, CAST(:slots AS integer)) AS slot
+             WHERE pg_try_advisory_xact_lock(CAST(:namespace AS integer), slot)
+             LIMIT 1'
+        );
+        $stmt->execute([':slots' => $slots, ':namespace' => self::INGEST_LOCK_NAMESPACE]);
+
+        if ($stmt->fetchColumn() === false) {
+            // Reparte los reintentos para que no vuelvan todos a la vez.
+            $retryAfter = max(1, (int) (getenv('INGEST_RETRY_AFTER') ?: 2));
+            throw new IngestBusyException(random_int($retryAfter, 2 * $retryAfter));
+        }
+    }
+
+    private function stagePayload(array $payload): void
+    {
+        $pdo = $this->getDb();
+        $staging = new StagingStore($pdo);
+
+        try {
+            $pdo->beginTransaction();
+            $this->acquireIngestSlot($pdo);
+            $batchId = $staging->createBatch($payload, count($payload['records']));
+            foreach (array_chunk($payload['records'], self::STAGE_CHUNK_SIZE) as $chunk) {
+                $staging->stageRecords($batchId, $chunk);
+            }
+            $pdo->commit();
+        } catch (Throwable $e) {
+            if ($pdo->inTransaction()) {
+                $pdo->rollBack();
+            }
+            if ($e instanceof IngestBusyException) {
+                throw $e;
+            }
+            error_log('Staging Error: ' . $e->getMessage());
+            throw new Exception('Failed to store data', 500);
+        }
+
+        $this->sendAccepted($batchId, count($payload['records']));
+    }
+
+    private function sendAccepted(int $batchId, int $records): void
+    {
+        header('Preference-Applied: respond-async');
+        header('Location: ?batch_id=' . $batchId);
+        $this->sendResponse(202, [
+            'status' => 'accepted',
+            'batch_id' => $batchId,
+            'records' => $records,
+        ]);
     }
 
     private function handlePost(): void
     {
         $contentType = $_SERVER['CONTENT_TYPE'] ?? $_SERVER['HTTP_CONTENT_TYPE'] ?? '';
-        if (stripos($contentType, 'application/json') !== 0) {
-            throw new Exception('Content-Type must be application/json', 400);
+        $mediaType = strtolower(trim(explode(';', $contentType, 2)[0]));
+
+        if ($mediaType === self::CONTENT_TYPE_NDJSON) {
+            $this->handleNdjsonPost();
+            return;
+        }
+        if ($mediaType === self::CONTENT_TYPE_ENVELOPE) {
+            $this->handleEnvelopePost();
+            return;
         }
 
-        $rawBody = $this->getRawBody();
-        $data = json_decode($rawBody, true, 512, JSON_THROW_ON_ERROR);
+        switch ($mediaType) {
+            case self::CONTENT_TYPE_JSON:
+                $payload = $this->validatePayload($this->decodeJsonBody());
+                break;
+            case self::CONTENT_TYPE_COLUMNAR:
+                $payload = $this->decodeColumnar($this->decodeJsonBody());
+                break;
+            case self::CONTENT_TYPE_BINARY:
+                $payload = $this->decodeBinary($this->getRawBody());
+                break;
+            default:
+                throw new Exception('Unsupported Content-Type', 415);
+        }
 
-        if (!is_array($data)) {
-            throw new Exception('Invalid JSON structure', 400);
+        if ($this->useAsyncIngest()) {
+            $this->stagePayload($payload);
+            return;
         }
 
-        $payload = $this->validatePayload($data);
         $pdo = $this->getDb();
 
         try {
             $pdo->beginTransaction();
+            $this->acquireIngestSlot($pdo);
             $inserted = $this->insertRecords($pdo, $payload);
+            $this->applyDailySummary($pdo);
+            $cursor = $this->advanceCursor($payload);
+            $pdo->commit();
+        } catch (Throwable $e) {
+            if ($pdo->inTransaction()) {
+                $pdo->rollBack();
+            }
+            if ($e instanceof IngestBusyException) {
+                throw $e;
+            }
+            error_log('Insert Error: ' . $e->getMessage());
+            throw new Exception('Failed to store data', 500);
+        }
+
+        $this->sendResponse(200, [
+            'status' => 'ok',
+            'inserted' => $inserted,
+            'cursor' => $cursor,
+        ]);
+    }
+
+    /**
+     * Sobre multi-dispositivo: {"v": 1, "batches": [...]}, donde cada lote usa
+     * el formato JSON original o el columnar. Todos los lotes entran en una
+     * sola transacción y la respuesta trae un resultado por lote, en orden.
+     */
+    private function handleEnvelopePost(): void
+    {
+        $data = $this->decodeJsonBody();
+        if (($data['v'] ?? null) !== self::WIRE_VERSION) {
+            throw new Exception('Unsupported envelope version', 415);
+        }
+
+        $batches = $data['batches'] ?? null;
+        if (!is_array($batches) || !$batches) {
+            throw new Exception('Invalid or missing batches', 400);
+        }
+        if (count($batches) > self::ENVELOPE_MAX_BATCHES) {
+            throw new Exception('Too many batches in envelope', 413);
+        }
+
+        // Un lote inválido se informa en su posición de `results`; los demás
+        // se guardan igual.
+        $payloads = [];
+        $results = [];
+        foreach (array_values($batches) as $i => $batch) {
+            try {
+                if (!is_array($batch)) {
+                    throw new Exception("Batch $i must be an object", 400);
+                }
+                $payloads[$i] = isset($batch['v']) ? $this->decodeColumnar($batch) : $this->validatePayload($batch);
+            } catch (Exception $e) {
+                $results[$i] = [
+                    'device_id' => is_array($batch) ? ($batch['device_id'] ?? null) : null,
+                    'status' => 'error',
+                    'code' => $e->getCode() ?: 400,
+                    'error' => $e->getMessage(),
+                ];
+            }
+        }
+        if (!$payloads) {
+            ksort($results);
+            $this->sendResponse(400, ['error' => 'No valid batches', 'results' => array_values($results)]);
+        }
+
+        $pdo = $this->getDb();
+        $async = $this->useAsyncIngest();
+        $staging = new StagingStore($pdo);
+
+        try {
+            $pdo->beginTransaction();
+            $this->acquireIngestSlot($pdo);
+
+            foreach ($payloads as $i => $payload) {
+                if ($async) {
+                    $batchId = $staging->createBatch($payload, count($payload['records']));
+                    foreach (array_chunk($payload['records'], self::STAGE_CHUNK_SIZE) as $chunk) {
+                        $staging->stageRecords($batchId, $chunk);
+                    }
+                    $results[$i] = [
+                        'device_id' => $payload['device_id'],
+                        'status' => 'accepted',
+                        'batch_id' => $batchId,
+                        'records' => count($payload['records']),
+                    ];
+                } else {
+                    $results[$i] = [
+                        'device_id' => $payload['device_id'],
+                        'status' => 'ok',
+                        'inserted' => $this->insertRecords($pdo, $payload),
+                    ];
+                }
+            }
+
+            if (!$async) {
+                $this->applyDailySummary($pdo);
+
+                // Orden fijo de bloqueo de cida_devices entre sobres concurrentes.
+                $devices = [];
+                foreach ($payloads as $payload) {
+                    $devices[(string) $payload['device_id']] = $payload;
+                }
+                ksort($devices, SORT_STRING);
+
+                $cursors = [];
+                foreach ($devices as $serial => $payload) {
+                    $cursors[(string) $serial] = $this->advanceCursor($payload);
+                }
+                foreach ($payloads as $i => $payload) {
+                    $results[$i]['cursor'] = $cursors[(string) $payload['device_id']];
+                }
+            }
+
+            $pdo->commit();
+        } catch (Throwable $e) {
+            if ($pdo->inTransaction()) {
+                $pdo->rollBack();
+            }
+            if ($e instanceof IngestBusyException) {
+                throw $e;
+            }
+            error_log('Envelope Error: ' . $e->getMessage());
+            throw new Exception('Failed to store data', 500);
+        }
+
+        ksort($results);
+        $results = array_values($results);
+        $partial = count($payloads) < count($results);
+
+        if ($async) {
+            header('Preference-Applied: respond-async');
+            $this->sendResponse(202, ['status' => $partial ? 'partial' : 'accepted', 'results' => $results]);
+        }
+
+        $this->sendResponse(200, ['status' => $partial ? 'partial' : 'ok', 'results' => $results]);
+    }
+
+    /**
+     * Ingesta NDJSON: la primera línea describe el dispositivo, cada línea
+     * siguiente es un registro y la última es {"end": true, "count": N}. El cuerpo (normalmente con
+     * Transfer-Encoding: chunked) se lee línea a línea y se inserta por
+     * bloques, sin límite de tamaño total ni carga completa en memoria.
+     */
+    private function handleNdjsonPost(): void
+    {
+        $maxLineBytes = (int) (getenv('MAX_LINE_BYTES') ?: 65536);
+        $input = fopen('php://input', 'rb');
+        if ($input === false) {
+            throw new Exception('Unable to read request body', 400);
+        }
+
+        $readLine = function () use ($input, $maxLineBytes): ?string {
+            while (($line = fgets($input, $maxLineBytes + 2)) !== false) {
+                if (strlen($line) > $maxLineBytes && substr($line, -1) !== "\n") {
+                    throw new Exception('NDJSON line too long', 413);
+                }
+                $line = trim($line);
+                if ($line !== '') {
+                    return $line;
+                }
+            }
+            return null;
+        };
+
+        $header = $readLine();
+        if ($header === null) {
+            throw new Exception('Empty body', 400);
+        }
+        $headerData = json_decode($header, true, 16, JSON_THROW_ON_ERROR);
+        if (!is_array($headerData)) {
+            throw new Exception('Invalid JSON structure', 400);
+        }
+        $device = $this->validateDevice($headerData);
+
+        $pdo = $this->getDb();
+        $async = $this->useAsyncIngest();
+        $staging = new StagingStore($pdo);
+        $batchId = null;
+        $inserted = 0;
+        $idx = 0;
+        $chunk = [];
+
+        $flush = function (array $records) use ($pdo, $device, $async, $staging, &$batchId): int {
+            if ($async) {
+                $staging->stageRecords($batchId, $records);
+                return count($records);
+            }
+            return $this->insertChunk($pdo, $device, $records);
+        };
+
+        try {
+            $pdo->beginTransaction();
+            $this->acquireIngestSlot($pdo);
+            if ($async) {
+                $batchId = $staging->createBatch($device);
+            }
+
+            $complete = false;
+            while (($line = $readLine()) !== null) {
+                $rec = json_decode($line, true, 16, JSON_THROW_ON_ERROR);
+
+                if (is_array($rec) && ($rec['end'] ?? false) === true) {
+                    if (($rec['count'] ?? null) !== $idx) {
+                        throw new Exception('NDJSON record count mismatch', 400);
+                    }
+                    $complete = true;
+                    break;
+                }
+
+                $chunk[] = $this->validateRecord($idx++, $rec);
+
+                if (count($chunk) >= ($async ? self::STAGE_CHUNK_SIZE : self::INSERT_CHUNK_SIZE)) {
+                    $inserted += $flush($chunk);
+                    $chunk = [];
+                }
+            }
+
+            // Un corte de conexión a mitad de stream no debe confirmar datos parciales.
+            if (!$complete) {
+                throw new Exception('Incomplete NDJSON stream', 400);
+            }
+            if ($idx === 0) {
+                throw new Exception('Invalid or missing records', 400);
+            }
+
+            $inserted += $flush($chunk);
+            if ($async) {
+                $staging->finishBatch($batchId, $idx);
+            } else {
+                $this->applyDailySummary($pdo);
+                $cursor = $this->advanceCursor($device);
+            }
             $pdo->commit();
         } catch (Throwable $e) {
             if ($pdo->inTransaction()) {
                 $pdo->rollBack();
             }
+            $clientError = !($e instanceof PDOException) && is_int($e->getCode())
+                && $e->getCode() >= 400 && $e->getCode() < 500;
+            if ($e instanceof JsonException || $clientError) {
+                throw $e;
+            }
             error_log('Insert Error: ' . $e->getMessage());
             throw new Exception('Failed to store data', 500);
+        } finally {
+            fclose($input);
+        }
+
+        if ($async) {
+            $this->sendAccepted($batchId, $idx);
         }
 
         $this->sendResponse(200, [
             'status' => 'ok',
             'inserted' => $inserted,
+            'cursor' => $cursor,
         ]);
     }
 
+    private function decodeJsonBody(): array
+    {
+        $data = json_decode($this->getRawBody(), true, 512, JSON_THROW_ON_ERROR);
+
+        if (!is_array($data)) {
+            throw new Exception('Invalid JSON structure', 400);
+        }
+
+        return $data;
+    }
+
+    /**
+     * Decodifica el formato columnar (JSON): arreglos paralelos, diccionario de
+     * empleados y tiempos epoch con un único offset por lote.
+     */
+    private function decodeColumnar(array $data): array
+    {
+        if (($data['v'] ?? null) !== self::WIRE_VERSION) {
+            throw new Exception('Unsupported columnar version', 415);
+        }
+        if (empty($data['device_id']) || !is_string($data['device_id'])) {
+            throw new Exception('Invalid or missing device_id', 400);
+        }
+
+        $employees = $data['employees'] ?? null;
+        $columns = [];
+        foreach (['employee', 'time', 'type', 'minor'] as $name) {
+            if (!isset($data[$name]) || !is_array($data[$name])) {
+                throw new Exception("Invalid or missing column $name", 400);
+            }
+            $columns[$name] = $data[$name];
+        }
+        if (isset($data['serial']) && !is_array($data['serial'])) {
+            throw new Exception('Invalid column serial', 400);
+        }
+        if (!is_array($employees)) {
+            throw new Exception('Invalid or missing employees', 400);
+        }
+        foreach ($employees as $idx => $employeeId) {
+            if (!is_string($employeeId) || $employeeId === '') {
+                throw new Exception("Employee $idx: invalid employee_id", 400);
+            }
+        }
+
+        $tzOffset = $data['tz_offset'] ?? 0;
+        if (!is_int($tzOffset)) {
+            throw new Exception('Invalid tz_offset', 400);
+        }
+
+        return $this->buildColumnarPayload(
+            $data['device_id'],
+            is_string($data['device_model'] ?? null) ? $data['device_model'] : 'Unknown',
+            is_string($data['device_name'] ?? null) ? $data['device_name'] : null,
+            $tzOffset,
+            array_values($employees),
+            $columns['employee'],
+            $columns['time'],
+            $columns['type'],
+            $columns['minor'],
+            isset($data['serial']) ? array_values($data['serial']) : null
+        );
+    }
+
+    /**
+     * Decodifica el framing binario del formato columnar (little-endian):
+     * cabecera "CIDA", cadenas con prefijo u16 y columnas u32/i64/u16/u32.
+     */
+    private function decodeBinary(string $body): array
+    {
+        if (strlen($body) < 18 || substr($body, 0, 4) !== 'CIDA') {
+            throw new Exception('Invalid binary payload', 400);
+        }
+
+        $header = unpack('Cversion/Cflags/Vtz/Vcount/Vemployees', $body, 4);
+        if ($header['version'] !== self::WIRE_VERSION) {
+            throw new Exception('Unsupported binary version', 415);
+        }
+
+        $tzOffset = $header['tz'] >= 0x80000000 ? $header['tz'] - 0x100000000 : $header['tz'];
+        $count = $header['count'];
+        $offset = 18;
+
+        $strings = [];
+        for ($i = 0; $i < 3 + $header['employees']; $i++) {
+            if ($offset + 2 > strlen($body)) {
+                throw new Exception('Truncated binary payload', 400);
+            }
+            $length = unpack('v', $body, $offset)[1];
+            $offset += 2;
+            $strings[] = (string) substr($body, $offset, $length);
+            $offset += $length;
+        }
+
+        $hasSerials = ($header['flags'] & self::BINARY_FLAG_SERIAL) !== 0;
+        $expected = $offset + $count * (4 + 8 + 2 + 4 + ($hasSerials ? 4 : 0));
+        if ($expected !== strlen($body)) {
+            throw new Exception('Binary payload length mismatch', 400);
+        }
+        if ($strings[0] === '') {
+            throw new Exception('Invalid or missing device_id', 400);
+        }
+        foreach (array_slice($strings, 3) as $idx => $employeeId) {
+            if ($employeeId === '') {
+                throw new Exception("Employee $idx: invalid employee_id", 400);
+            }
+        }
+
+        $employeeIdx = $count ? array_values(unpack("V$count", $body, $offset)) : [];
+        $offset += 4 * $count;
+        $times = $count ? array_values(unpack("P$count", $body, $offset)) : [];
+        $offset += 8 * $count;
+        $types = $count ? array_values(unpack("v$count", $body, $offset)) : [];
+        $offset += 2 * $count;
+        $minors = $count ? array_values(unpack("V$count", $body, $offset)) : [];
+        $offset += 4 * $count;
+        $serials = $hasSerials && $count ? array_values(unpack("V$count", $body, $offset)) : null;
+
+        return $this->buildColumnarPayload(
+            $strings[0],
+            $strings[1] !== '' ? $strings[1] : 'Unknown',
+            $strings[2] !== '' ? $strings[2] : null,
+            $tzOffset,
+            array_slice($strings, 3),
+            $employeeIdx,
+            $times,
+            $types,
+            $minors,
+            $serials
+        );
+    }
+
+    private function buildColumnarPayload(
+        string $deviceId,
+        string $deviceModel,
+        ?string $deviceName,
+        int $tzOffset,
+        array $employees,
+        array $employeeIdx,
+        array $times,
+        array $types,
+        array $minors,
+        ?array $serials = null
+    ): array {
+        $count = count($times);
+        if ($count === 0) {
+            throw new Exception('Invalid or missing records', 400);
+        }
+        if (count($employeeIdx) !== $count || count($types) !== $count || count($minors) !== $count
+            || ($serials !== null && count($serials) !== $count)) {
+            throw new Exception('Column lengths do not match', 400);
+        }
+        if ($tzOffset < -86400 || $tzOffset > 86400) {
+            throw new Exception('Invalid tz_offset', 400);
+        }
+
+        $employeeCount = count($employees);
+        $cleanRecords = [];
+        for ($i = 0; $i < $count; $i++) {
+            $idx = $employeeIdx[$i];
+            $time = $times[$i];
+            if (!is_int($idx) || $idx < 0 || $idx >= $employeeCount) {
+                throw new Exception("Record $i: invalid employee index", 400);
+            }
+            if (!is_int($time) || $time < 0) {
+                throw new Exception("Record $i: invalid timestamp", 400);
+            }
+            if (!is_int($types[$i]) || $types[$i] < 0 || !is_int($minors[$i]) || $minors[$i] < 0) {
+                throw new Exception("Record $i: invalid event type", 400);
+            }
+            $serial = $serials[$i] ?? 0;
+            if (!is_int($serial) || $serial < 0) {
+                throw new Exception("Record $i: invalid serial_no", 400);
+            }
+
+            $cleanRecords[] = [
+                'employee_id' => $employees[$idx],
+                // Hora local del dispositivo, igual a la que deja el formato ISO-8601.
+                'timestamp' => gmdate('Y-m-d H:i:s', $time + $tzOffset),
+                'event_type' => $types[$i],
+                'event_minor' => $minors[$i],
+                'serial_no' => $serial ?: null,
+            ];
+        }
+
+        return [
+            'device_id' => $deviceId,
+            'device_model' => $deviceModel,
+            'device_name' => $deviceName,
+            'records' => $cleanRecords,
+        ];
+    }
+
     private function getRawBody(): string
     {
         $maxBytes = (int) (getenv('MAX_BODY_BYTES') ?: 1048576);
@@ -253,12 +778,7 @@ class AttendanceSync
 
     private function validatePayload(array $data): array
     {
-        if (empty($data['device_id']) || !is_string($data['device_id'])) {
-            throw new Exception('Invalid or missing device_id', 400);
-        }
-
-        $deviceModel = $data['device_model'] ?? 'Unknown';
-        $deviceName = $data['device_name'] ?? null;
+        $device = $this->validateDevice($data);
 
         if (empty($data['records']) || !is_array($data['records'])) {
             throw new Exception('Invalid or missing records', 400);
@@ -266,41 +786,60 @@ class AttendanceSync
 
         $cleanRecords = [];
         foreach ($data['records'] as $idx => $rec) {
-            if (!is_array($rec)) {
-                throw new Exception("Record $idx must be an object", 400);
-            }
-
-            $employeeId = $rec['employee_id'] ?? '';
-            $timestamp = $rec['timestamp'] ?? '';
-            $eventType = $rec['event_type'] ?? '';
-            $eventMinor = $rec['event_minor'] ?? 0;
+            $cleanRecords[] = $this->validateRecord($idx, $rec);
+        }
 
-            if (!is_string($employeeId) || $employeeId === '') {
-                throw new Exception("Record $idx: invalid employee_id", 400);
-            }
-            if (!$this->validateIso8601($timestamp)) {
-                throw new Exception("Record $idx: invalid timestamp", 400);
-            }
-            if (!is_int($eventType) && !ctype_digit($eventType)) {
-                throw new Exception("Record $idx: invalid event_type", 400);
-            }
-            if (!is_int($eventMinor) && !ctype_digit($eventMinor)) {
-                throw new Exception("Record $idx: invalid event_minor", 400);
-            }
+        $device['records'] = $cleanRecords;
+        return $device;
+    }
 
-            $cleanRecords[] = [
-                'employee_id' => $employeeId,
-                'timestamp' => $timestamp,
-                'event_type' => (int) $eventType,
-                'event_minor' => (int) $eventMinor,
-            ];
+    private function validateDevice(array $data): array
+    {
+        if (empty($data['device_id']) || !is_string($data['device_id'])) {
+            throw new Exception('Invalid or missing device_id', 400);
         }
 
         return [
             'device_id' => $data['device_id'],
-            'device_model' => $deviceModel,
-            'device_name' => $deviceName,
-            'records' => $cleanRecords,
+            'device_model' => $data['device_model'] ?? 'Unknown',
+            'device_name' => $data['device_name'] ?? null,
+        ];
+    }
+
+    private function validateRecord($idx, $rec): array
+    {
+        if (!is_array($rec)) {
+            throw new Exception("Record $idx must be an object", 400);
+        }
+
+        $employeeId = $rec['employee_id'] ?? '';
+        $timestamp = $rec['timestamp'] ?? '';
+        $eventType = $rec['event_type'] ?? '';
+        $eventMinor = $rec['event_minor'] ?? 0;
+        $serialNo = $rec['serial_no'] ?? null;
+
+        if (!is_string($employeeId) || $employeeId === '') {
+            throw new Exception("Record $idx: invalid employee_id", 400);
+        }
+        if (!$this->validateIso8601($timestamp)) {
+            throw new Exception("Record $idx: invalid timestamp", 400);
+        }
+        if (!is_int($eventType) && !ctype_digit($eventType)) {
+            throw new Exception("Record $idx: invalid event_type", 400);
+        }
+        if (!is_int($eventMinor) && !ctype_digit($eventMinor)) {
+            throw new Exception("Record $idx: invalid event_minor", 400);
+        }
+        if ($serialNo !== null && (!is_int($serialNo) || $serialNo < 0)) {
+            throw new Exception("Record $idx: invalid serial_no", 400);
+        }
+
+        return [
+            'employee_id' => $employeeId,
+            'timestamp' => $timestamp,
+            'event_type' => (int) $eventType,
+            'event_minor' => (int) $eventMinor,
+            'serial_no' => $serialNo ?: null,
         ];
     }
 
@@ -318,30 +857,106 @@ class AttendanceSync
 
     private function insertRecords(PDO $pdo, array $payload): int
     {
-        $sql = 'INSERT INTO cida_attendance
-                (event_user_id, event_time, event_type, device_model, device_serial, device_name, event_minor)
-                VALUES (:event_user_id, :event_time, :event_type, :device_model, :device_serial, :device_name, :event_minor)';
-
-        $stmt = $pdo->prepare($sql);
         $inserted = 0;
-
-        foreach ($payload['records'] as $rec) {
-            $ok = $stmt->execute([
-                ':event_user_id' => $rec['employee_id'],
-                ':event_time' => $rec['timestamp'],
-                ':event_type' => (int) $rec['event_type'],
-                ':device_model' => $payload['device_model'],
-                ':device_serial' => $payload['device_id'],
-                ':device_name' => $payload['device_name'],
-                ':event_minor' => (int) $rec['event_minor'],
-            ]);
-            if ($ok)
-                $inserted++;
+        foreach (array_chunk($payload['records'], self::INSERT_CHUNK_SIZE) as $chunk) {
+            $inserted += $this->insertChunk($pdo, $payload, $chunk);
         }
 
         return $inserted;
     }
 
+    /**
+     * Inserta un bloque de registros con un único INSERT multi-fila y deja los
+     * insertados pendientes para cida_daily_attendance (applyPending).
+     */
+    private function insertChunk(PDO $pdo, array $device, array $records): int
+    {
+        if (!$records) {
+            return 0;
+        }
+
+        $this->getPartitions()->ensureForRecords($records);
+
+        $dimensions = $this->getDimensions();
+        $deviceId = $dimensions->deviceId($device);
+        $employeeIds = $dimensions->employeeIds(array_column($records, 'employee_id'));
+
+        $params = [];
+        foreach ($records as $rec) {
+            array_push(
+                $params,
+                $deviceId,
+                $employeeIds[$rec['employee_id']],
+                $rec['timestamp'],
+                (int) $rec['event_type'],
+                (int) $rec['event_minor'],
+                $rec['serial_no'] ?? null
+            );
+        }
+
+        // Los bloques completos comparten la misma sentencia preparada.
+        $rowCount = count($records);
+        if (!$this->insertStatements) {
+            DailySummary::preparePending($pdo);
+        }
+        $stmt = $this->insertStatements[$rowCount] ??= $pdo->prepare($this->buildInsertSql($rowCount));
+        $stmt->execute($params);
+        $row = $stmt->fetch();
+
+        $max = $this->insertedMax[$device['device_id']] ?? ['last_event_time' => null, 'last_serial' => null];
+        // El texto de TIMESTAMP de Postgres ordena igual que el tiempo.
+        if ($row['last_event_time'] !== null && $row['last_event_time'] > (string) $max['last_event_time']) {
+            $max['last_event_time'] = $row['last_event_time'];
+        }
+        if ($row['last_serial'] !== null && (int) $row['last_serial'] > (int) $max['last_serial']) {
+            $max['last_serial'] = (int) $row['last_serial'];
+        }
+        $this->insertedMax[$device['device_id']] = $max;
+
+        return (int) $row['inserted'];
+    }
+
+    /** Suma al resumen diario lo insertado en la transacción, antes del commit. */
+    private function applyDailySummary(PDO $pdo): void
+    {
+        if ($this->insertStatements) {
+            DailySummary::applyPending($pdo);
+        }
+    }
+
+    /**
+     * Avanza el cursor del dispositivo con lo insertado en la transacción y
+     * devuelve el valor que quedará confirmado (last_sync, last_serial). Se
+     * llama justo antes del commit para que el cliente pueda omitir el GET.
+     */
+    private function advanceCursor(array $device): array
+    {
+        $max = $this->insertedMax[$device['device_id']] ?? ['last_event_time' => null, 'last_serial' => null];
+
+        return $this->getDimensions()->advanceCursor(
+            $this->getDimensions()->deviceId($device),
+            $max['last_event_time'],
+            $max['last_serial']
+        );
+    }
+
+    private function buildInsertSql(int $rowCount): string
+    {
+        $rows = implode(', ', array_fill(0, $rowCount, '(?, ?, ?, ?, ?, CAST(? AS bigint))'));
+
+        // Lo insertado queda pendiente para el resumen diario (applyPending).
+        return 'WITH inserted AS (
+                    INSERT INTO cida_attendance_events
+                    (device_id, employee_id, event_time, event_type, event_minor, event_serial)
+                    VALUES ' . $rows . '
+                    ON CONFLICT DO NOTHING
+                    RETURNING employee_id, event_time, event_type, event_serial
+                ), ' . DailySummary::pendingCte('inserted') . '
+                SELECT count(*) AS inserted, max(event_time) AS last_event_time,
+                       max(event_serial) AS last_serial
+                FROM inserted';
+    }
+
     private function sendResponse(int $statusCode, array $data): void
     {
         http_response_code($statusCode);
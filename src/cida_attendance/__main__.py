@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 
 from cida_attendance import cli
@@ -32,5 +33,7 @@ def _attach_parent_console_if_present():
 
 
 if __name__ == "__main__":
+    # Worker processes are spawned from the frozen executable too.
+    multiprocessing.freeze_support()
     _attach_parent_console_if_present()
     cli.app()
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import os
 import re
@@ -5,10 +6,12 @@ import time
 from typing import Annotated
 
 import typer
-from scheduler import Scheduler
 
 from cida_attendance.config import check_config, save_config
-from cida_attendance.core.tasks import check_device, check_server, synchronize
+
+# Commands import the SDK, scheduler and HTTP layers lazily: `sync`, `check`
+# and `status` are usually answered by a running daemon over its control
+# socket and should not pay for them.
 
 app = typer.Typer()
 
@@ -28,29 +31,145 @@ def server(
     interval: Annotated[str, typer.Argument(callback=parse_iso8601_duration)] = "PT1H",
     config: str = None,
     wait: float = 0.5,
+    workers: Annotated[
+        int, typer.Option(help="Shard devices across this many worker processes")
+    ] = 0,
+    http_port: Annotated[
+        int, typer.Option(help="Receive ISAPI notifications POSTed on this port")
+    ] = 0,
+    http_host: Annotated[
+        str, typer.Option(help="Address for ISAPI notifications")
+    ] = "0.0.0.0",
 ):
-    scheduler = Scheduler()
-    scheduler.cyclic(interval, synchronize)
+    from scheduler import Scheduler
+
+    from cida_attendance.core.control import ControlServer, DaemonControl
 
     if config is not None:
         os.environ["CONFIG_FILE"] = config
 
+    receiver = None
+    if http_port:
+        from cida_attendance.config import load_config, load_devices
+        from cida_attendance.core.client import HttpClient, HttpClientError
+        from cida_attendance.core.uploader import BatchUploader
+        from cida_attendance.isapi.receiver import NotificationReceiver
+
+        settings = load_config()
+        client = HttpClient(auth_token=settings["api_key"], url=settings["url"])
+        try:
+            server_formats = (client.get() or {}).get("formats")
+        except HttpClientError:
+            # Negotiated on the first upload instead.
+            server_formats = None
+        receiver = NotificationReceiver(
+            BatchUploader(client, server_formats, preferred=settings["upload_format"]),
+            load_devices(),
+            host=http_host,
+            port=http_port,
+        )
+        receiver.start()
+
+    scheduler = Scheduler()
+    pool = None
+    if workers > 0:
+        from cida_attendance.core.workers import WorkerPool
+
+        pool = WorkerPool(workers, interval.total_seconds())
+        pool.start()
+        scheduler.cyclic(datetime.timedelta(seconds=wait), pool.poll)
+
+    daemon = DaemonControl(pool, receiver)
+    if pool is None:
+        scheduler.cyclic(interval, daemon.run_sync)
+    control = ControlServer(daemon.handlers())
+    control.start()
+
     typer.echo("Server started")
 
-    if with_icon:
-        from cida_attendance.ui.app import App
+    try:
+        if with_icon:
+            from cida_attendance.ui.app import App
 
-        app = App()
-        app.timer.timeout.connect(lambda: scheduler.exec_jobs())
-        app.timer.start(int(wait * 1000))
-        app.run()
-    else:
-        try:
+            app = App()
+            app.timer.timeout.connect(lambda: scheduler.exec_jobs())
+            app.timer.start(int(wait * 1000))
+            app.run()
+        else:
             while True:
                 scheduler.exec_jobs()
                 time.sleep(wait)
+    except KeyboardInterrupt:
+        typer.echo("Server stopped")
+    finally:
+        control.close()
+        if pool is not None:
+            pool.stop()
+        if receiver is not None:
+            receiver.stop()
+            receiver.batcher.uploader.close()
+
+
+@app.command()
+def listen(
+    host: Annotated[
+        str, typer.Option(help="Local address for device pushes")
+    ] = "0.0.0.0",
+    port: Annotated[int, typer.Option(help="Port the terminals report to")] = 7200,
+    flush: Annotated[float, typer.Option(help="Seconds between uploads")] = 5.0,
+    alert_stream: Annotated[
+        bool, typer.Option(help="Read each terminal's ISAPI alertStream instead")
+    ] = False,
+    spool: Annotated[str, typer.Option(help="Directory for event snapshots")] = None,
+    config: str = None,
+):
+    """Receive events pushed by terminals instead of polling them."""
+
+    from cida_attendance.config import load_config
+    from cida_attendance.core.client import HttpClient, HttpClientError
+    from cida_attendance.core.listener import AlarmListener
+    from cida_attendance.core.uploader import BatchUploader
+
+    if config is not None:
+        os.environ["CONFIG_FILE"] = config
+
+    settings = load_config()
+    client = HttpClient(auth_token=settings["api_key"], url=settings["url"])
+    try:
+        server_formats = (client.get() or {}).get("formats")
+    except HttpClientError as e:
+        typer.echo(f"Server not available: {e}")
+        raise typer.Abort()
+
+    if alert_stream:
+        from cida_attendance.config import load_devices
+        from cida_attendance.isapi.alertstream import AlertStreamHub
+
+        with BatchUploader(
+            client, server_formats, preferred=settings["upload_format"]
+        ) as uploader:
+            hub = AlertStreamHub(
+                uploader, load_devices(), spool_dir=spool, flush_s=flush
+            )
+            typer.echo(f"Streaming events from {len(hub.streams)} devices")
+            try:
+                asyncio.run(hub.run())
+            except KeyboardInterrupt:
+                typer.echo(f"Streams stopped: {hub.stats}")
+        return
+
+    with (
+        BatchUploader(
+            client, server_formats, preferred=settings["upload_format"]
+        ) as uploader,
+        AlarmListener(uploader, host=host, port=port, flush_s=flush) as listener,
+    ):
+        typer.echo(f"Listening on {host}:{port}")
+        try:
+            while True:
+                time.sleep(1.0)
         except KeyboardInterrupt:
-            typer.echo("Server stopped")
+            typer.echo(f"Listener stopped: {listener.stats}")
 
 
 @app.command()
@@ -102,12 +221,39 @@ def configure(
     typer.echo("Configuration saved")
 
 
+def _ask_daemon(cmd: str, **args) -> dict | None:
+    """The daemon's answer, or None when no daemon is running."""
+
+    from cida_attendance.core.control import (
+        ControlClient,
+        ControlError,
+        ControlUnavailable,
+    )
+
+    try:
+        return ControlClient().request(cmd, **args)
+    except ControlUnavailable:
+        return None
+    except ControlError as e:
+        typer.echo(str(e))
+        raise typer.Exit(1) from e
+
+
 @app.command()
 def check():
     if not check_config():
         typer.echo("Configuration not set up")
         raise typer.Abort()
 
+    if (response := _ask_daemon("check")) is not None:
+        if not response["ok"]:
+            typer.echo(response.get("error", "Check failed"))
+            raise typer.Abort()
+        typer.echo("Device checked")
+        return
+
+    from cida_attendance.core.tasks import check_device, check_server
+
     if not check_server():
         typer.echo("Server not available")
         raise typer.Abort()
@@ -120,20 +266,93 @@ def check():
 
 
 @app.command()
-def sync():
+def sync(
+    device: Annotated[
+        str, typer.Option(help="Only this device (name, ip or ip:port)")
+    ] = None,
+):
     if not check_config():
         typer.echo("Configuration not set up")
         raise typer.Abort()
 
+    if (response := _ask_daemon("sync", device=device)) is not None:
+        if "error" in response:
+            typer.echo(response["error"])
+            raise typer.Abort()
+        typer.echo(
+            "Synchronization finished" if response["ok"] else "Synchronization failed"
+        )
+        return
+
+    from cida_attendance.core.tasks import check_server, synchronize_all
+
     if not check_server():
         typer.echo("Server not available")
         raise typer.Abort()
 
-    if synchronize():
+    if synchronize_all(device=device):
         typer.echo("Synchronization finished")
     else:
         typer.echo("Synchronization failed")
 
 
+@app.command()
+def status(
+    metrics: Annotated[bool, typer.Option(help="Show counters instead")] = False,
+):
+    response = _ask_daemon("metrics" if metrics else "status")
+    if response is None:
+        typer.echo("Server not running")
+        raise typer.Exit(1)
+
+    response.pop("ok", None)
+    for key, value in response.items():
+        typer.echo(f"{key}: {value}")
+
+
+@app.command()
+def roster(
+    device: Annotated[
+        str, typer.Option(help="Only this device (name, ip or ip:port)")
+    ] = None,
+):
+    """Download the users and cards enrolled on each terminal."""
+
+    if not check_config():
+        typer.echo("Configuration not set up")
+        raise typer.Abort()
+
+    from cida_attendance.core.tasks import snapshot_roster
+
+    ok = True
+    for label, diffs in snapshot_roster(device=device).items():
+        for kind, diff in diffs.items():
+            if diff is None:
+                ok = False
+                typer.echo(f"{label}: {kind} not available")
+                continue
+            typer.echo(
+                f"{label}: {kind} +{diff.added} ~{diff.changed} "
+                f"={diff.unchanged} -{diff.removed}"
+            )
+    if not ok:
+        raise typer.Exit(1)
+
+
+@app.command()
+def replay(
+    path: str,
+    speed: Annotated[
+        float, typer.Option(help="1.0 = original pacing, 0 = as fast as possible")
+    ] = 0.0,
+):
+    from cida_attendance.core.tasks import replay_capture
+
+    count, batch, elapsed = replay_capture(path, speed=speed or None)
+    typer.echo(
+        f"Replayed {count} callbacks, decoded {len(batch)} records in {elapsed:.3f}s"
+    )
+
+
 if __name__ == "__main__":
     app()
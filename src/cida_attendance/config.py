@@ -1,8 +1,20 @@
 import os
+import threading
 from configparser import ConfigParser
 from pathlib import Path
 
-import keyring
+# Process-wide caches. The INI is re-parsed only when its path, mtime or size
+# changes; secrets are memoized until `refresh_secrets()` because every keyring
+# lookup can be a D-Bus round trip to the Secret Service.
+_lock = threading.RLock()
+_parsed: tuple[tuple, ConfigParser] | None = None
+_secrets: dict[tuple[str, str], str | None] = {}
+
+
+def _keyring():
+    import keyring
+
+    return keyring
 
 
 def get_filename() -> str:
@@ -19,6 +31,14 @@ def get_filename() -> str:
     return config_file
 
 
+def get_state_dir() -> str:
+    state_dir = os.getenv("CIDA_ATTENDANCE_STATE_DIR") or os.path.dirname(
+        os.path.abspath(get_filename())
+    )
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
 def get_name_app() -> str:
     return os.getenv("NAME_APP", "CidaAttendance")
 
@@ -27,15 +47,59 @@ def exists_config() -> bool:
     return os.path.exists(get_filename())
 
 
-def load_config() -> dict[str, str | int]:
-    config = ConfigParser()
-    config.read(get_filename())
+def _file_signature(filename: str) -> tuple:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return (filename, None, None)
+    return (filename, stat.st_mtime_ns, stat.st_size)
 
-    if "DEFAULT" not in config:
-        config["DEFAULT"] = {}
 
-    if "DEVICE" not in config:
-        config["DEVICE"] = {}
+def _read_config() -> ConfigParser:
+    global _parsed
+
+    filename = get_filename()
+    signature = _file_signature(filename)
+
+    with _lock:
+        if _parsed is not None and _parsed[0] == signature:
+            return _parsed[1]
+
+        config = ConfigParser()
+        config.read(filename)
+        _parsed = (signature, config)
+        return config
+
+
+def invalidate_config() -> None:
+    global _parsed
+
+    with _lock:
+        _parsed = None
+
+
+def get_password(user: str, refresh: bool = False) -> str | None:
+    key = (get_name_app(), user)
+
+    with _lock:
+        if not refresh and key in _secrets:
+            return _secrets[key]
+
+    password = _keyring().get_password(*key)
+
+    with _lock:
+        _secrets[key] = password
+    return password
+
+
+def refresh_secrets() -> None:
+    with _lock:
+        _secrets.clear()
+
+
+def load_config() -> dict[str, str | int]:
+    # The parser is shared through the cache: read it, never mutate it here.
+    config = _read_config()
 
     data = {}
 
@@ -49,6 +113,11 @@ def load_config() -> dict[str, str | int]:
     else:
         data["api_key"] = ""
 
+    if config.has_option("DEFAULT", "upload_format"):
+        data["upload_format"] = config["DEFAULT"]["upload_format"]
+    else:
+        data["upload_format"] = "auto"
+
     if config.has_option("DEVICE", "user"):
         data["user"] = config["DEVICE"]["user"]
     else:
@@ -69,11 +138,61 @@ def load_config() -> dict[str, str | int]:
     else:
         data["name"] = ""
 
-    data["password"] = keyring.get_password(get_name_app(), data["user"]) or ""
+    data.update(_backend_options(config, "DEVICE"))
+
+    data["password"] = get_password(data["user"]) or ""
 
     return data
 
 
+def _backend_options(config: ConfigParser, section: str) -> dict[str, str | int | bool]:
+    # `backend = isapi` talks HTTP to the terminal instead of using HCNetSDK.
+    if not config.has_section(section):
+        return {"backend": "sdk", "isapi_port": 80, "isapi_https": False}
+    options = config[section]
+    return {
+        "backend": options.get("backend", "sdk"),
+        "isapi_port": options.getint("isapi_port", 80),
+        "isapi_https": options.getboolean("isapi_https", False),
+    }
+
+
+def load_devices() -> list[dict[str, str | int]]:
+    """One config dict per terminal: the `DEVICE` section plus `DEVICE:<name>`.
+
+    Every entry shares the server settings; a password stored for
+    `user@ip` takes precedence over the one stored for the bare user.
+    """
+
+    config = _read_config()
+    base = load_config()
+    devices = [base] if base["ip"] else []
+
+    for section in config.sections():
+        if not section.startswith("DEVICE:"):
+            continue
+        options = config[section]
+        user = options.get("user", "")
+        ip = options.get("ip", "")
+        if not ip:
+            continue
+        devices.append(
+            {
+                "url": base["url"],
+                "api_key": base["api_key"],
+                "upload_format": base["upload_format"],
+                "user": user,
+                "ip": ip,
+                "port": options.getint("port", 8000),
+                "name": options.get("name", section.split(":", 1)[1]),
+                "password": get_password(f"{user}@{ip}") or get_password(user) or "",
+                **_backend_options(config, section),
+            }
+        )
+
+    return devices
+
+
 def save_config(
     url: str,
     api_key: str,
@@ -103,12 +222,15 @@ def save_config(
     with open(get_filename(), "w") as f:
         config.write(f)
 
-    keyring.set_password(get_name_app(), user, password)
+    invalidate_config()
+    _keyring().set_password(get_name_app(), user, password)
+
+    with _lock:
+        _secrets[(get_name_app(), user)] = password
 
 
 def check_config() -> bool:
-    config = ConfigParser()
-    config.read(get_filename())
+    config = _read_config()
 
     return all(
         [
@@ -121,7 +243,7 @@ def check_config() -> bool:
             config.has_option("DEVICE", "port"),
             (
                 config.has_option("DEVICE", "user")
-                and keyring.get_password(get_name_app(), config["DEVICE"]["user"])
+                and get_password(config["DEVICE"]["user"])
             ),
         ]
     )
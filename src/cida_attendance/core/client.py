@@ -1,7 +1,18 @@
+import email.utils
+import http.client
 import json
+import random
+import threading
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
+from typing import Callable, Iterable
+
+# Overload and transient upstream failures worth retrying. Uploads are safe to
+# replay: the server discards duplicate events.
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+MAX_RETRY_AFTER_S = 300.0
 
 
 class HttpClientError(Exception):
@@ -10,44 +21,241 @@ class HttpClientError(Exception):
         message: str,
         code: int | None = None,
         data: dict | None = None,
+        retry_after: float | None = None,
     ):
         super().__init__(message)
         self.code = code
         self.data = data
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(HttpClientError):
+    pass
+
+
+class InvalidResponseError(HttpClientError):
+    """A success status with a body that is not JSON. The request went
+    through, so it is neither retried nor counted against the breaker."""
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a `Retry-After` header given in seconds or as an HTTP date."""
+
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = when.timestamp() - time.time()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_S)
+
+
+class CircuitBreaker:
+    """Stop calling an endpoint after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast for `reset_timeout` seconds; then a single trial call is let
+    through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """Shared breaker per endpoint (scheme, host and path; query ignored)."""
+
+    parts = urllib.parse.urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}{parts.path}"
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker()
+        return breaker
+
+
+def _decode_body(raw: bytes) -> dict | None:
+    # Proxies answer 502/503 with HTML; keep the status code, drop the body.
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
 
 
 class HttpClient:
-    def __init__(self, auth_token: str, url: str):
+    def __init__(
+        self,
+        auth_token: str,
+        url: str,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
         self.auth_token = auth_token
         self.url = url.strip().rstrip("?")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = get_circuit_breaker(self.url)
+        self._sleep = sleep
 
-    def __send(
+    def __send_once(
         self,
         request: urllib.request.Request,
-        success_code: int = 200,
+        success_codes: tuple[int, ...] = (200,),
     ) -> dict | None:
         try:
             with urllib.request.urlopen(request) as response:
                 status_code = response.getcode()
-                response_text = response.read().decode("utf-8")
-                data = json.loads(response_text)
+                raw = response.read()
 
-                if status_code != success_code:
+                if status_code not in success_codes:
                     raise HttpClientError(
                         f"HTTP error: {status_code}",
                         code=status_code,
-                        data=data,
+                        data=_decode_body(raw),
                     )
 
-                return data
+                try:
+                    return json.loads(raw.decode("utf-8"))
+                except (UnicodeDecodeError, ValueError) as e:
+                    raise InvalidResponseError(
+                        f"Invalid response: {e}", code=status_code
+                    ) from e
         except urllib.error.HTTPError as e:
             raise HttpClientError(
                 f"HTTP error: {e.code}",
                 code=e.code,
-                data=json.loads(e.read().decode("utf-8")),
+                data=_decode_body(e.read()),
+                retry_after=parse_retry_after(e.headers.get("Retry-After")),
             ) from e
         except urllib.error.URLError as e:
             raise HttpClientError(f"URL error: {e.reason}") from e
+        except (OSError, http.client.HTTPException) as e:
+            # Dropped connections and timeouts while reading the response.
+            raise HttpClientError(f"Connection error: {e!r}") from e
+        except ValueError as e:
+            raise HttpClientError(f"Invalid response: {e}") from e
+
+    def _backoff(self, attempt: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            # Small jitter so clients told the same delay do not return together.
+            return retry_after + random.uniform(0, self.backoff_base)
+        # Full jitter: uniform over [0, min(max, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def __send(
+        self,
+        request: urllib.request.Request,
+        success_codes: tuple[int, ...] = (200,),
+        retries: int | None = None,
+    ) -> dict | None:
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    f"Circuit open for {self.url}",
+                    retry_after=self.breaker.retry_in(),
+                )
+
+            try:
+                data = self.__send_once(request, success_codes)
+            except HttpClientError as e:
+                # Busy (429) is not a failure of the endpoint; errors and 5xx are.
+                if e.code is None or e.code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+
+                retryable = e.code is None or e.code in RETRY_STATUS_CODES
+                if not retryable or attempt >= retries:
+                    raise
+                self._sleep(self._backoff(attempt, e.retry_after))
+                attempt += 1
+                continue
+            except BaseException:
+                # Whatever happened, a half-open trial slot must be released.
+                self.breaker.record_failure()
+                raise
+
+            self.breaker.record_success()
+            return data
+
+    def __get_upload_headers(self, content_type: str) -> dict:
+        return {
+            **self.__get_default_headers(),
+            "Content-Type": content_type,
+            # Servers with asynchronous ingest answer 202 right after staging.
+            "Prefer": "respond-async",
+        }
 
     def __get_default_headers(self) -> dict:
         return {
@@ -65,16 +273,33 @@ class HttpClient:
         )
         return self.__send(req)
 
-    def post(self, data: dict):
-        json_data = json.dumps(data).encode("utf-8")
+    def post(self, data: dict | bytes, content_type: str = "application/json"):
+        if isinstance(data, bytes):
+            body = data
+        else:
+            body = json.dumps(data).encode("utf-8")
         req = urllib.request.Request(
             self.url,
-            data=json_data,
+            data=body,
+            headers=self.__get_upload_headers(content_type),
+            method="POST",
+        )
+
+        return self.__send(req, success_codes=(200, 202))
+
+    def post_stream(self, chunks: Iterable[bytes], content_type: str):
+        """POST an iterable of byte chunks with chunked transfer encoding.
+
+        The chunks are consumed by the first attempt, so streams are not retried.
+        """
+        req = urllib.request.Request(
+            self.url,
+            data=iter(chunks),
             headers={
-                **self.__get_default_headers(),
-                "Content-Type": "application/json",
+                **self.__get_upload_headers(content_type),
+                "Transfer-Encoding": "chunked",
             },
             method="POST",
         )
 
-        return self.__send(req)
+        return self.__send(req, success_codes=(200, 202), retries=0)
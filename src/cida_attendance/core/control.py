@@ -0,0 +1,246 @@
+"""Local control socket for a running `server`.
+
+The daemon listens on a Unix-domain socket in the state directory; `sync`,
+`check` and `status` connect to it first and only fall back to doing the work
+in-process when no daemon is listening. A daemon that accepts the connection
+but does not answer is reported as an error instead: it may still be running
+the same sync. Requests and responses are one JSON object
+per line:
+
+    {"cmd": "sync", "device": "10.0.0.5"}  ->  {"ok": true, ...}
+
+Commands: `ping`, `status`, `metrics`, `check` and `sync` (optionally limited
+to one device by name, ip or ip:port). Syncs triggered here and by the
+scheduler share a lock, so a device is never read by two sessions at once.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from logging import getLogger
+from typing import Any, Callable
+
+from cida_attendance.config import get_state_dir
+
+logger = getLogger(__name__)
+
+CONTROL_TIMEOUT_S = 600.0
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+class ControlError(Exception):
+    pass
+
+
+class ControlUnavailable(ControlError):
+    pass
+
+
+def socket_path() -> str:
+    return os.getenv("CIDA_ATTENDANCE_CONTROL_SOCKET") or os.path.join(
+        get_state_dir(), "control.sock"
+    )
+
+
+class ControlClient:
+    def __init__(self, path: str | None = None, timeout: float = CONTROL_TIMEOUT_S):
+        self.path = path or socket_path()
+        self.timeout = timeout
+
+    def request(self, cmd: str, **args) -> dict[str, Any]:
+        if not hasattr(socket, "AF_UNIX"):
+            raise ControlUnavailable("Unix sockets are not available")
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                try:
+                    sock.connect(self.path)
+                except (FileNotFoundError, ConnectionRefusedError) as e:
+                    # Missing or stale: callers fall back to running in-process.
+                    raise ControlUnavailable(str(e)) from e
+                sock.sendall(json.dumps({"cmd": cmd, **args}).encode("utf-8") + b"\n")
+                with sock.makefile("rb") as f:
+                    line = f.readline()
+        except ControlUnavailable:
+            raise
+        except OSError as e:
+            # Busy, hung or not ours: running in-process could duplicate its work.
+            raise ControlError(f"Daemon did not answer: {e}") from e
+
+        if not line:
+            raise ControlError("Daemon closed the connection")
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise ControlError(f"Invalid daemon response: {e}") from e
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline(MAX_REQUEST_BYTES)
+        try:
+            request = json.loads(line)
+            handler = self.server.handlers[request.pop("cmd")]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            response = {"ok": False, "error": "Invalid request"}
+        else:
+            try:
+                response = handler(**request)
+            except TypeError as e:
+                response = {"ok": False, "error": str(e)}
+            except Exception as e:
+                logger.error("Control command failed: %s", e, exc_info=e)
+                response = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+
+
+class ControlServer:
+    def __init__(
+        self, handlers: dict[str, Callable[..., dict]], path: str | None = None
+    ):
+        self.handlers = handlers
+        self.path = path or socket_path()
+        self._server: socketserver.BaseServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> bool:
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            logger.warning("Control socket not available on this platform")
+            return False
+
+        if os.path.exists(self.path):
+            try:
+                ControlClient(self.path, timeout=1.0).request("ping")
+            except ControlError:
+                os.unlink(self.path)
+            else:
+                logger.warning("Another daemon is listening on %s", self.path)
+                return False
+
+        # Created 0600 from the start, not chmod-ed after bind.
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        server.handlers = self.handlers
+
+        self._server = server
+        self._thread = threading.Thread(
+            target=server.serve_forever, name="control-socket", daemon=True
+        )
+        self._thread.start()
+        logger.info("Control socket listening on %s", self.path)
+        return True
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class DaemonControl:
+    """State and command handlers of the `server` process."""
+
+    def __init__(self, pool=None, receiver=None):
+        self.pool = pool
+        self.receiver = receiver
+        self.started_at = time.time()
+        self.sync_lock = threading.Lock()
+        self.metrics = {
+            "syncs_total": 0,
+            "sync_failures_total": 0,
+            "checks_total": 0,
+            "control_requests_total": 0,
+        }
+        self.last_sync: dict[str, Any] | None = None
+
+    def handlers(self) -> dict[str, Callable[..., dict]]:
+        return {
+            "ping": self.ping,
+            "status": self.status,
+            "metrics": self.get_metrics,
+            "check": self.check,
+            "sync": self.sync,
+        }
+
+    def run_sync(self, device: str | None = None) -> bool:
+        from cida_attendance.core.tasks import synchronize_all
+
+        started = time.monotonic()
+        with self.sync_lock:
+            try:
+                ok = synchronize_all(device=device)
+            except Exception as e:
+                logger.error("Synchronization failed: %s", e, exc_info=e)
+                ok = False
+
+        self.metrics["syncs_total"] += 1
+        if not ok:
+            self.metrics["sync_failures_total"] += 1
+        self.last_sync = {
+            "at": time.time(),
+            "device": device,
+            "ok": ok,
+            "duration_s": round(time.monotonic() - started, 3),
+        }
+        return ok
+
+    def ping(self) -> dict:
+        return {"ok": True, "pid": os.getpid()}
+
+    def status(self) -> dict:
+        self.metrics["control_requests_total"] += 1
+        status = {
+            "ok": True,
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "syncing": self.sync_lock.locked(),
+            "last_sync": self.last_sync,
+        }
+        if self.pool is not None:
+            status["workers"] = self.pool.assignment()
+        return status
+
+    def get_metrics(self) -> dict:
+        self.metrics["control_requests_total"] += 1
+        metrics = {"ok": True, **self.metrics}
+        if self.receiver is not None:
+            stats = {**self.receiver.stats, **self.receiver.batcher.stats}
+            metrics.update({f"receiver_{k}_total": v for k, v in stats.items()})
+        return metrics
+
+    def check(self) -> dict:
+        from cida_attendance.core.tasks import check_device, check_server
+
+        self.metrics["control_requests_total"] += 1
+        self.metrics["checks_total"] += 1
+        if not check_server():
+            return {"ok": False, "error": "Server not available"}
+        with self.sync_lock:
+            if not check_device():
+                return {"ok": False, "error": "Device not available"}
+        return {"ok": True}
+
+    def sync(self, device: str | None = None) -> dict:
+        self.metrics["control_requests_total"] += 1
+        if self.pool is not None:
+            # Devices belong to the worker processes, which sync on their own.
+            return {
+                "ok": False,
+                "error": "Sync on demand is not available with --workers",
+            }
+        return {"ok": self.run_sync(device)}
@@ -0,0 +1,280 @@
+"""Per-device metadata cache and device clock tracking.
+
+Model, serial and firmware never change between cycles and the device clock
+only drifts slowly, so neither needs an ISAPI round trip per sync. Metadata is
+persisted with a TTL; the device clock is anchored once (device time vs.
+`time.monotonic`) and computed locally until the anchor expires or the host
+clock is seen to jump.
+
+The sync cursor returned by the server after each upload is kept here too, so
+the next cycle can start downloading without asking the server where it left
+off.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import threading
+import time
+from logging import getLogger
+from typing import Any
+
+from cida_attendance.config import get_state_dir
+
+logger = getLogger(__name__)
+
+METADATA_TTL_S = 24 * 3600.0
+CLOCK_REANCHOR_S = 6 * 3600.0
+CLOCK_DRIFT_THRESHOLD_S = 2.0
+
+
+def device_key(config: dict) -> str:
+    return f"{config['ip']}:{config['port']}"
+
+
+def _timezone_to_json(tz: datetime.tzinfo) -> dict[str, Any]:
+    offset = tz.utcoffset(None) or datetime.timedelta(0)
+    return {"offset_s": offset.total_seconds(), "name": tz.tzname(None)}
+
+
+def _timezone_from_json(data: dict[str, Any]) -> datetime.timezone:
+    offset = datetime.timedelta(seconds=float(data.get("offset_s", 0)))
+    name = data.get("name")
+    if offset == datetime.timedelta(0) and name in (None, "UTC"):
+        return datetime.timezone.utc
+    return datetime.timezone(offset, name=name) if name else datetime.timezone(offset)
+
+
+class DeviceClock:
+    """Device wall clock derived from a single ISAPI `localTime` reading."""
+
+    def __init__(
+        self,
+        tz: datetime.tzinfo,
+        device_epoch: float,
+        anchored_wall: float,
+        anchored_mono: float | None = None,
+    ):
+        self.tz = tz
+        self.device_epoch = device_epoch
+        self.anchored_wall = anchored_wall
+        self.anchored_mono = anchored_mono
+
+    @classmethod
+    def anchor(cls, local_time: datetime.datetime, tz: datetime.tzinfo) -> DeviceClock:
+        return cls(tz, local_time.timestamp(), time.time(), time.monotonic())
+
+    @property
+    def offset_s(self) -> float:
+        """Device clock minus host clock, in seconds."""
+        return self.device_epoch - self.anchored_wall
+
+    def elapsed(self) -> float:
+        if self.anchored_mono is not None:
+            return time.monotonic() - self.anchored_mono
+        return time.time() - self.anchored_wall
+
+    def host_clock_jump(self) -> float:
+        if self.anchored_mono is None:
+            return 0.0
+        wall = time.time() - self.anchored_wall
+        return abs(wall - (time.monotonic() - self.anchored_mono))
+
+    def now(self) -> datetime.datetime:
+        epoch = self.device_epoch + self.elapsed()
+        return datetime.datetime.fromtimestamp(int(epoch), tz=self.tz)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "tz": _timezone_to_json(self.tz),
+            "device_epoch": self.device_epoch,
+            "anchored_wall": self.anchored_wall,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> DeviceClock:
+        # Monotonic anchors do not survive a restart: fall back to the wall
+        # clock and the persisted offset.
+        return cls(
+            _timezone_from_json(data["tz"]),
+            float(data["device_epoch"]),
+            float(data["anchored_wall"]),
+        )
+
+
+class DeviceMetadataCache:
+    def __init__(
+        self,
+        path: str | None = None,
+        *,
+        ttl_s: float = METADATA_TTL_S,
+        reanchor_s: float = CLOCK_REANCHOR_S,
+        drift_threshold_s: float = CLOCK_DRIFT_THRESHOLD_S,
+    ):
+        self.path = path or os.path.join(get_state_dir(), "device_cache.json")
+        self.ttl_s = ttl_s
+        self.reanchor_s = reanchor_s
+        self.drift_threshold_s = drift_threshold_s
+        self._lock = threading.RLock()
+        self._entries: dict[str, dict[str, Any]] | None = None
+        self._clocks: dict[str, DeviceClock] = {}
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                self._entries = {}
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring unreadable device cache %s: %s", self.path, e)
+                self._entries = {}
+        return self._entries
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries or {}, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning("Could not persist device cache %s: %s", self.path, e)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            entries = self._load()
+            self._clocks.pop(key, None)
+            if entries.pop(key, None) is not None:
+                self._save()
+
+    def get_metadata(self, key: str, session, refresh: bool = False) -> dict[str, Any]:
+        with self._lock:
+            entry = self._load().get(key) or {}
+            metadata = entry.get("metadata")
+            fresh = (
+                metadata is not None
+                and time.time() - float(entry.get("fetched_at", 0)) < self.ttl_s
+                # The login already told us the serial: a swapped terminal on
+                # the same address must not reuse the old metadata.
+                and (
+                    session.serial_number is None
+                    or session.serial_number == metadata.get("serial")
+                )
+            )
+            if fresh and not refresh:
+                return metadata
+
+        metadata = session.get_device_metadata()
+        try:
+            metadata["capabilities"] = session.get_capabilities()
+        except Exception as e:
+            logger.debug("Capabilities not available for %s: %s", key, e)
+            metadata["capabilities"] = {}
+
+        with self._lock:
+            entries = self._load()
+            entry = entries.setdefault(key, {})
+            if (entry.get("metadata") or {}).get("serial") != metadata.get("serial"):
+                entry.pop("clock", None)
+                self._clocks.pop(key, None)
+            entry["metadata"] = metadata
+            entry["fetched_at"] = time.time()
+            self._save()
+        return metadata
+
+    def find_by_serial(self, serial: str) -> dict[str, Any] | None:
+        """Cached metadata of the terminal with this serial, if it was seen."""
+
+        with self._lock:
+            for entry in self._load().values():
+                metadata = entry.get("metadata") or {}
+                if metadata.get("serial") == serial:
+                    return metadata
+        return None
+
+    def _stale(self, clock: DeviceClock) -> bool:
+        if clock.elapsed() >= self.reanchor_s:
+            return True
+        if clock.host_clock_jump() > self.drift_threshold_s:
+            logger.info("Host clock jumped, re-anchoring device clock")
+            return True
+        return False
+
+    def get_device_time(
+        self,
+        key: str,
+        session,
+        refresh: bool = False,
+    ) -> tuple[datetime.datetime, datetime.tzinfo]:
+        with self._lock:
+            clock = self._clocks.get(key)
+            if clock is None and (data := self._load().get(key, {}).get("clock")):
+                try:
+                    clock = DeviceClock.from_json(data)
+                except (KeyError, TypeError, ValueError):
+                    clock = None
+
+            if clock is not None and not refresh and not self._stale(clock):
+                self._clocks[key] = clock
+                return clock.now(), clock.tz
+
+        local_time, tz = session.get_device_time()
+        anchored = DeviceClock.anchor(local_time, tz)
+
+        if clock is not None:
+            drift = anchored.device_epoch - (clock.device_epoch + clock.elapsed())
+            if abs(drift) > self.drift_threshold_s:
+                logger.warning(
+                    "Device clock %s drifted %.1fs since last anchor", key, drift
+                )
+
+        with self._lock:
+            self._clocks[key] = anchored
+            self._load().setdefault(key, {})["clock"] = anchored.to_json()
+            self._save()
+        return local_time, tz
+
+    def get_sync_cursor(self, key: str, serial: str, url: str) -> dict[str, Any] | None:
+        """Stored cursor, unless it belongs to another terminal or server."""
+
+        with self._lock:
+            cursor = self._load().get(key, {}).get("sync_cursor")
+        if not cursor or cursor.get("serial") != serial or cursor.get("url") != url:
+            return None
+        return cursor
+
+    def set_sync_cursor(
+        self,
+        key: str,
+        serial: str,
+        url: str,
+        cursor: dict[str, Any],
+        formats: list[str] | None,
+    ) -> None:
+        with self._lock:
+            self._load().setdefault(key, {})["sync_cursor"] = {
+                "serial": serial,
+                "url": url,
+                "last_sync": cursor.get("last_sync"),
+                "last_serial": cursor.get("last_serial"),
+                "formats": formats,
+            }
+            self._save()
+
+    def clear_sync_cursor(self, key: str) -> None:
+        with self._lock:
+            entry = self._load().get(key)
+            if entry and entry.pop("sync_cursor", None) is not None:
+                self._save()
+
+
+_default_cache: DeviceMetadataCache | None = None
+
+
+def get_device_cache() -> DeviceMetadataCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DeviceMetadataCache()
+    return _default_cache
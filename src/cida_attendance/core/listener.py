@@ -0,0 +1,328 @@
+"""Receive attendance events pushed by terminals (listen mode).
+
+Instead of logging into and arming every terminal, the terminals are
+configured to report alarms to this host; one NET_DVR_StartListen_V30 port
+takes pushes from all of them. ACS events are decoded in the SDK callback
+into one `AttendanceBatch` per device serial by an `EventBatcher`, whose
+flush thread hands the batches to a `BatchUploader` every few seconds, so a
+busy site still costs a handful of requests per interval.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import datetime
+import threading
+import time
+from logging import getLogger
+from typing import Callable
+
+from cida_attendance import sdk
+from cida_attendance.core.client import HttpClientError
+from cida_attendance.core.device_cache import DeviceMetadataCache, get_device_cache
+from cida_attendance.core.uploader import BatchUploader
+from cida_attendance.core.wire import AttendanceBatch
+from cida_attendance.sdk.alarm import alarmer_serial, get_alarm_dispatcher
+from cida_attendance.sdk.bindings import (
+    build_datetime_from_net_dvr_time,
+    cleanup_dll,
+    init_dll,
+)
+
+logger = getLogger(__name__)
+
+LISTEN_PORT = 7200
+FLUSH_INTERVAL_S = 5.0
+MAX_BATCH_RECORDS = 5000
+MAX_PENDING_RECORDS = 100_000
+MAX_RETRY_DELAY_S = 300.0
+MAJOR_EVENT = 0x5
+TIME_TYPE_UTC = 1
+
+
+def decode_acs_alarm(info, local_tz: datetime.tzinfo) -> tuple | None:
+    """(employee_no, when, event_type, event_minor, serial_no) of an access
+    event, or None when it is not an attendance mark."""
+
+    if info.dwMajor != MAJOR_EVENT:
+        return None
+
+    employee_no = ""
+    attendance_status = 0
+    # The generated binding types the pointer as a C string: read the address.
+    extend_ptr = ctypes.c_void_p.from_buffer(
+        info, type(info).pAcsEventInfoExtend.offset
+    ).value
+    if info.byAcsEventInfoExtend and extend_ptr:
+        extend = sdk.NET_DVR_ACS_EVENT_INFO_EXTEND.from_address(extend_ptr)
+        employee_no = (
+            bytes(extend.byEmployeeNo).split(b"\x00", 1)[0].decode("ascii", "ignore")
+        )
+        attendance_status = extend.byAttendanceStatus
+    if not employee_no and info.struAcsEventInfo.dwEmployeeNo:
+        employee_no = str(info.struAcsEventInfo.dwEmployeeNo)
+    if not employee_no:
+        return None
+
+    if info.byTimeType == TIME_TYPE_UTC:
+        when = build_datetime_from_net_dvr_time(info.struTime, tz=datetime.timezone.utc)
+        when = when.astimezone(local_tz)
+    else:
+        when = build_datetime_from_net_dvr_time(info.struTime, tz=local_tz)
+
+    return (
+        employee_no,
+        when,
+        attendance_status,
+        info.dwMinor,
+        info.struAcsEventInfo.dwSerialNo,
+    )
+
+
+class EventBatcher:
+    """Collects pushed events into one `AttendanceBatch` per device serial and
+    hands them to a `BatchUploader` every `flush_s` seconds (or as soon as a
+    batch reaches `max_records`). Failed uploads are merged back and their
+    device waits before the next attempt: the server's `retry_after` if it
+    gave one, else `flush_s` doubling per consecutive failure up to
+    `MAX_RETRY_DELAY_S`. The server discards duplicates. At most
+    `max_pending` records are held, queued or in flight: past that `add`
+    refuses events, so a server that stays down cannot grow memory without
+    bound."""
+
+    def __init__(
+        self,
+        uploader: BatchUploader,
+        *,
+        flush_s: float = FLUSH_INTERVAL_S,
+        max_records: int = MAX_BATCH_RECORDS,
+        max_pending: int = MAX_PENDING_RECORDS,
+        cache: DeviceMetadataCache | None = None,
+        tz: datetime.tzinfo | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.uploader = uploader
+        self.flush_s = flush_s
+        self.max_records = max_records
+        self.max_pending = max_pending
+        self.cache = cache or get_device_cache()
+        # Pushed alarms carry device wall time; the server keeps it as is.
+        self.tz = tz or datetime.datetime.now().astimezone().tzinfo
+
+        self._lock = threading.Lock()
+        self._batches: dict[str, AttendanceBatch] = {}
+        self._pending = 0
+        self._clock = clock
+        # serial -> (consecutive failures, clock time of the next attempt)
+        self._retry: dict[str, tuple[int, float]] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.stats = {
+            "received": 0,
+            "ignored": 0,
+            "uploaded": 0,
+            "failed": 0,
+            "dropped": 0,
+        }
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="event-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Flush what is pending and stop the flush thread."""
+
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _new_batch(
+        self, serial: str, model: str | None, name: str | None
+    ) -> AttendanceBatch:
+        metadata = self.cache.find_by_serial(serial) or {}
+        return AttendanceBatch(
+            serial,
+            model or metadata.get("model") or "Unknown",
+            metadata.get("name") or name or None,
+            self.tz,
+        )
+
+    @property
+    def pending(self) -> int:
+        """Records added and not uploaded yet."""
+
+        return self._pending
+
+    def add(
+        self,
+        serial: str,
+        record: tuple,
+        model: str | None = None,
+        name: str | None = None,
+    ) -> bool:
+        """False, and the event is dropped, when `max_pending` is reached."""
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["dropped"] += 1
+                return False
+            self._pending += 1
+            batch = self._batches.get(serial)
+            if batch is None:
+                batch = self._batches[serial] = self._new_batch(serial, model, name)
+            batch.append(*record)
+            full = len(batch) >= self.max_records
+        self.stats["received"] += 1
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self, force: bool = False) -> int:
+        """Submit the pending batches of devices not waiting to retry (all of
+        them with `force`)."""
+
+        now = self._clock()
+        with self._lock:
+            if force:
+                batches, self._batches = self._batches, {}
+            else:
+                batches = {
+                    serial: batch
+                    for serial, batch in self._batches.items()
+                    if self._retry.get(serial, (0, now))[1] <= now
+                }
+                for serial in batches:
+                    del self._batches[serial]
+        for batch in batches.values():
+            self.uploader.submit(batch).add_done_callback(
+                lambda future, batch=batch: self._uploaded(batch, future)
+            )
+        return len(batches)
+
+    def _uploaded(self, batch: AttendanceBatch, future) -> None:
+        try:
+            future.result()
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            logger.error(
+                "Upload of %d pushed events from %s failed: %s",
+                len(batch),
+                batch.device_id,
+                e,
+            )
+            self._requeue(batch, e)
+            return
+        with self._lock:
+            self._pending -= len(batch)
+            self._retry.pop(batch.device_id, None)
+        self.stats["uploaded"] += len(batch)
+
+    def _requeue(self, batch: AttendanceBatch, error: Exception) -> None:
+        with self._lock:
+            failures = self._retry.get(batch.device_id, (0, 0.0))[0] + 1
+            delay = error.retry_after if isinstance(error, HttpClientError) else None
+            if delay is None:
+                delay = min(MAX_RETRY_DELAY_S, self.flush_s * 2 ** (failures - 1))
+            self._retry[batch.device_id] = (failures, self._clock() + delay)
+
+            pending = self._batches.get(batch.device_id)
+            if pending is not None:
+                batch.extend(pending)
+            self._batches[batch.device_id] = batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_s)
+            self._wake.clear()
+            self.flush()
+        self.flush(force=True)
+
+
+class AlarmListener:
+    def __init__(
+        self,
+        uploader: BatchUploader,
+        *,
+        host: str = "0.0.0.0",
+        port: int = LISTEN_PORT,
+        flush_s: float = FLUSH_INTERVAL_S,
+        max_records: int = MAX_BATCH_RECORDS,
+        max_pending: int = MAX_PENDING_RECORDS,
+        cache: DeviceMetadataCache | None = None,
+        tz: datetime.tzinfo | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.batcher = EventBatcher(
+            uploader,
+            flush_s=flush_s,
+            max_records=max_records,
+            max_pending=max_pending,
+            cache=cache,
+            tz=tz,
+        )
+        self._handle: int | None = None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return self.batcher.stats
+
+    def start(self) -> None:
+        init_dll()
+        dispatcher = get_alarm_dispatcher()
+        dispatcher.set_fallback(self.on_alarm)
+        try:
+            self._handle = dispatcher.start_listen(self.host, self.port)
+        except BaseException:
+            dispatcher.set_fallback(None)
+            cleanup_dll()
+            raise
+
+        self.batcher.start()
+        logger.info("Listening for device pushes on %s:%d", self.host, self.port)
+
+    def stop(self) -> None:
+        if self._handle is None:
+            return
+        dispatcher = get_alarm_dispatcher()
+        dispatcher.stop_listen(self._handle)
+        dispatcher.set_fallback(None)
+        self._handle = None
+
+        self.batcher.stop()
+        cleanup_dll()
+
+    def flush(self, force: bool = False) -> int:
+        return self.batcher.flush(force)
+
+    def __enter__(self) -> AlarmListener:
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def on_alarm(self, lCommand, pAlarmer, pAlarmInfo, dwBufLen, pUser) -> None:
+        if int(lCommand) != sdk.COMM_ALARM_ACS or not pAlarmer or not pAlarmInfo:
+            self.stats["ignored"] += 1
+            return
+        if int(dwBufLen) < ctypes.sizeof(sdk.NET_DVR_ACS_ALARM_INFO):
+            self.stats["ignored"] += 1
+            return
+
+        alarmer = pAlarmer.contents
+        serial = alarmer_serial(alarmer)
+        info = ctypes.cast(pAlarmInfo, sdk.LPNET_DVR_ACS_ALARM_INFO).contents
+        record = decode_acs_alarm(info, self.batcher.tz) if serial else None
+        if record is None:
+            self.stats["ignored"] += 1
+            return
+
+        name = bytes(alarmer.sDeviceName).split(b"\x00", 1)[0].decode("utf-8", "ignore")
+        self.batcher.add(serial, record, name=name)
@@ -0,0 +1,245 @@
+"""Local snapshot of the users and cards enrolled on each terminal.
+
+`RosterSnapshot` keeps one row per user (keyed by employee number) and per
+card (keyed by card number) and terminal serial in SQLite, indexed by
+employee number so the roster can be reconciled against HR across
+terminals. Every row carries a content hash. `update` consumes a record
+stream in chunks: rows whose hash did not change are only marked as seen,
+changed ones are rewritten and tagged with the run that changed them, and
+rows the terminal no longer reports are removed at the end. A run that fails
+halfway rolls back, so a partial download never reports users as removed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import time
+from logging import getLogger
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+from cida_attendance.config import get_state_dir
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    device TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    added INTEGER,
+    changed INTEGER,
+    unchanged INTEGER,
+    removed INTEGER
+);
+"""
+
+_TABLE = """
+CREATE TABLE IF NOT EXISTS {kind} (
+    device TEXT NOT NULL,
+    key TEXT NOT NULL,
+    employee_no TEXT,
+    name TEXT,
+    hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    seen_run INTEGER NOT NULL,
+    changed_run INTEGER NOT NULL,
+    PRIMARY KEY (device, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS {kind}_employee_no ON {kind} (employee_no);
+CREATE INDEX IF NOT EXISTS {kind}_changed_run ON {kind} (device, changed_run);
+"""
+
+# kind -> (key field, employee number field, name field) of the ISAPI records.
+KINDS = {
+    "users": ("employeeNo", "employeeNo", "name"),
+    "cards": ("cardNo", "employeeNo", "name"),
+}
+
+
+class RosterDiff(NamedTuple):
+    run: int
+    added: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+
+
+def _check_kind(kind: str) -> None:
+    # Kinds name tables in the SQL below.
+    if kind not in KINDS:
+        raise ValueError(f"Unknown roster kind {kind!r}")
+
+
+def content_hash(record: dict[str, Any]) -> str:
+    data = json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _chunks(
+    records: Iterable[dict[str, Any]], size: int
+) -> Iterator[list[dict[str, Any]]]:
+    iterator = iter(records)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+class RosterSnapshot:
+    def __init__(self, path: str | None = None):
+        self.path = path or os.path.join(get_state_dir(), "roster.sqlite3")
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            _SCHEMA + "".join(_TABLE.format(kind=kind) for kind in KINDS)
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> RosterSnapshot:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def update(
+        self,
+        kind: str,
+        device: str,
+        records: Iterable[dict[str, Any]],
+        *,
+        chunk_size: int = CHUNK_SIZE,
+        on_chunk: Callable[[RosterDiff], None] | None = None,
+    ) -> RosterDiff:
+        """Replace what `device` has of `kind` ("users" or "cards") with
+        `records`, touching only rows whose content changed."""
+
+        _check_kind(kind)
+        key_field, employee_field, name_field = KINDS[kind]
+        conn = self._conn
+        added = changed = unchanged = 0
+
+        with conn:
+            run = conn.execute(
+                "INSERT INTO runs (device, kind, started_at) VALUES (?, ?, ?)",
+                (device, kind, time.time()),
+            ).lastrowid
+
+            for chunk in _chunks(records, chunk_size):
+                keyed = {}
+                for record in chunk:
+                    key = record.get(key_field)
+                    if key:
+                        keyed[str(key)] = record
+                if not keyed:
+                    continue
+
+                placeholders = ",".join("?" * len(keyed))
+                existing = dict(
+                    conn.execute(
+                        f"SELECT key, hash FROM {kind} "
+                        f"WHERE device = ? AND key IN ({placeholders})",
+                        (device, *keyed),
+                    )
+                )
+
+                seen, rows = [], []
+                for key, record in keyed.items():
+                    digest = content_hash(record)
+                    if existing.get(key) == digest:
+                        seen.append((run, device, key))
+                        continue
+                    if key in existing:
+                        changed += 1
+                    else:
+                        added += 1
+                    employee_no = record.get(employee_field)
+                    rows.append(
+                        (
+                            device,
+                            key,
+                            str(employee_no) if employee_no is not None else None,
+                            record.get(name_field),
+                            digest,
+                            json.dumps(
+                                record, separators=(",", ":"), ensure_ascii=False
+                            ),
+                            run,
+                            run,
+                        )
+                    )
+                unchanged += len(seen)
+
+                conn.executemany(
+                    f"UPDATE {kind} SET seen_run = ? WHERE device = ? AND key = ?", seen
+                )
+                conn.executemany(
+                    f"""INSERT INTO {kind}
+                        (device, key, employee_no, name, hash, data,
+                         seen_run, changed_run)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (device, key) DO UPDATE SET
+                            employee_no = excluded.employee_no,
+                            name = excluded.name,
+                            hash = excluded.hash,
+                            data = excluded.data,
+                            seen_run = excluded.seen_run,
+                            changed_run = excluded.changed_run""",
+                    rows,
+                )
+                if on_chunk is not None:
+                    on_chunk(RosterDiff(run, added, changed, unchanged))
+
+            removed = conn.execute(
+                f"DELETE FROM {kind} WHERE device = ? AND seen_run <> ?", (device, run)
+            ).rowcount
+            conn.execute(
+                """UPDATE runs SET finished_at = ?, added = ?, changed = ?,
+                    unchanged = ?, removed = ? WHERE id = ?""",
+                (time.time(), added, changed, unchanged, removed, run),
+            )
+
+        diff = RosterDiff(run, added, changed, unchanged, removed)
+        logger.info("Roster %s of %s: %s", kind, device, diff)
+        return diff
+
+    def changes(self, kind: str, device: str, run: int) -> Iterator[dict[str, Any]]:
+        """Records of `device` added or changed by `run`."""
+
+        _check_kind(kind)
+        for (data,) in self._conn.execute(
+            f"SELECT data FROM {kind} "
+            "WHERE device = ? AND changed_run = ? ORDER BY key",
+            (device, run),
+        ):
+            yield json.loads(data)
+
+    def find_employee(self, employee_no: str) -> dict[str, list[dict[str, Any]]]:
+        """What every terminal has for one employee."""
+
+        found: dict[str, list[dict[str, Any]]] = {}
+        for kind in KINDS:
+            found[kind] = [
+                {"device": device, **json.loads(data)}
+                for device, data in self._conn.execute(
+                    f"SELECT device, data FROM {kind} "
+                    "WHERE employee_no = ? ORDER BY device",
+                    (employee_no,),
+                )
+            ]
+        return found
+
+    def count(self, kind: str, device: str | None = None) -> int:
+        _check_kind(kind)
+        if device is None:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {kind}").fetchone()[0]
+        return self._conn.execute(
+            f"SELECT COUNT(*) FROM {kind} WHERE device = ?", (device,)
+        ).fetchone()[0]
@@ -1,13 +1,198 @@
 import datetime
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from logging import getLogger
 
+from cida_attendance.config import load_config, load_devices, refresh_secrets
 from cida_attendance.core.client import HttpClient, HttpClientError
-from cida_attendance.config import load_config
+from cida_attendance.core.device_cache import (
+    DeviceMetadataCache,
+    device_key,
+    get_device_cache,
+)
+from cida_attendance.core.roster import RosterDiff, RosterSnapshot
+from cida_attendance.core.uploader import BatchUploader, upload_batch
+from cida_attendance.core.wire import (
+    NDJSON_CONTENT_TYPE,
+    AttendanceBatch,
+    choose_format,
+    iter_chunks,
+    ndjson_header,
+    ndjson_line,
+    ndjson_trailer,
+)
+from cida_attendance.sdk.bindings import cleanup_dll, init_dll
+from cida_attendance.sdk.capture import CaptureWriter
+from cida_attendance.sdk.login import LoginResult, login_many
 from cida_attendance.sdk.session import Session
 
 logger = getLogger(__name__)
 
 
+def open_capture() -> CaptureWriter | None:
+    """Capture raw SDK callbacks when `CIDA_ATTENDANCE_CAPTURE` names a file."""
+
+    path = os.getenv("CIDA_ATTENDANCE_CAPTURE")
+    if not path:
+        return None
+
+    logger.info("Capturing SDK callbacks to %s", path)
+    return CaptureWriter(path)
+
+
+def build_acs_event_handler(batch: AttendanceBatch, tz: datetime.tzinfo | None):
+    from cida_attendance.sdk.bindings import build_datetime_from_net_dvr_time
+
+    def on_data(data):
+        by_employee_no = (
+            bytes(data.struAcsEventInfo.byEmployeeNo).decode("ascii").rstrip("\x00")
+        )
+        if by_employee_no:
+            batch.append(
+                by_employee_no,
+                build_datetime_from_net_dvr_time(data.struTime, tz=tz),
+                data.struAcsEventInfo.byAttendanceStatus,
+                data.dwMinor,
+                data.struAcsEventInfo.dwSerialNo,
+            )
+
+    return on_data
+
+
+_STREAM_END = object()
+
+
+class NdjsonUploadStream:
+    """Uploads records as NDJSON while they are still being downloaded.
+
+    `append` has the same signature as `AttendanceBatch.append`, so it can be
+    fed by `build_acs_event_handler`. Lines go through a bounded queue to a
+    thread doing a chunked POST; a slow server blocks the SDK callback thread
+    instead of growing memory.
+    """
+
+    def __init__(
+        self,
+        client: HttpClient,
+        device_id: str,
+        device_model: str,
+        device_name: str | None = None,
+        queue_size: int = 4096,
+    ):
+        self.count = 0
+        self.max_serial: int | None = None
+        self._lines: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._header = ndjson_header(device_id, device_model, device_name)
+        self._response: dict | None = None
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(
+            target=self._upload, args=(client,), name="ndjson-upload", daemon=True
+        )
+        self._thread.start()
+
+    def _iter_lines(self):
+        yield self._header
+        while (line := self._lines.get()) is not _STREAM_END:
+            yield line
+
+    def _upload(self, client: HttpClient) -> None:
+        try:
+            self._response = client.post_stream(
+                iter_chunks(self._iter_lines()), NDJSON_CONTENT_TYPE
+            )
+        except BaseException as e:
+            self._error = e
+
+    def _put(self, line) -> None:
+        while True:
+            if not self._thread.is_alive():
+                raise self._error or HttpClientError("NDJSON upload stopped")
+            try:
+                self._lines.put(line, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def append(
+        self,
+        employee_id: str,
+        when: datetime.datetime,
+        event_type: int,
+        event_minor: int = 0,
+        serial_no: int = 0,
+    ) -> None:
+        record = {
+            "employee_id": employee_id,
+            "timestamp": when.isoformat(),
+            "event_type": int(event_type),
+            "event_minor": int(event_minor),
+        }
+        if serial_no:
+            record["serial_no"] = int(serial_no)
+            self.max_serial = max(self.max_serial or 0, int(serial_no))
+        self._put(ndjson_line(record))
+        self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def finish(self) -> dict | None:
+        self._put(ndjson_trailer(self.count))
+        self._put(_STREAM_END)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._response
+
+    def abort(self) -> None:
+        # Without the trailer the server rolls the whole stream back.
+        if self._thread.is_alive():
+            try:
+                self._put(_STREAM_END)
+            except BaseException:
+                pass
+        self._thread.join(timeout=5.0)
+
+
+def update_sync_cursor(
+    cache,
+    key: str,
+    serial: str,
+    url: str,
+    batch: AttendanceBatch | NdjsonUploadStream,
+    response: dict | None,
+    server_formats: list[str] | None,
+) -> bool:
+    """Keep the post-commit cursor from the upload response, if it is usable.
+
+    Asynchronous (202) answers, older servers and cursors behind what was just
+    uploaded are dropped so the next cycle asks the server with a GET.
+    """
+
+    cursor = (response or {}).get("cursor")
+    last_sync = cursor.get("last_sync") if isinstance(cursor, dict) else None
+    if not last_sync:
+        cache.clear_sync_cursor(key)
+        return False
+
+    uploaded_until = (
+        batch.max_timestamp() if isinstance(batch, AttendanceBatch) else None
+    )
+    if uploaded_until is not None:
+        # The server keeps device-local wall time without an offset.
+        server_until = datetime.datetime.fromisoformat(last_sync).replace(tzinfo=None)
+        if server_until < uploaded_until.replace(tzinfo=None, microsecond=0):
+            logger.warning("Server cursor %s is behind the uploaded events", last_sync)
+            cache.clear_sync_cursor(key)
+            return False
+
+    cache.set_sync_cursor(key, serial, url, cursor, server_formats)
+    return True
+
+
 def check_server() -> bool:
     logger.info("Checking server...")
     config = load_config()
@@ -30,79 +215,289 @@ def check_device():
 
     with Session() as session:
         if not session.login(**config):
+            # The password may have been rotated outside this process.
+            refresh_secrets()
             return False
 
     logger.info("Device checked")
     return session.logout()
 
 
-def synchronize():
+def synchronize(
+    config: dict | None = None,
+    uploader: BatchUploader | None = None,
+    cache: DeviceMetadataCache | None = None,
+    login: LoginResult | None = None,
+) -> bool | Future:
+    """Download new events from one device and upload them.
+
+    With an `uploader` the batch is only submitted: the returned future
+    resolves once the shared request completes and fails if the upload did.
+    """
+
     logger.info("Synchronizing...")
-    config = load_config()
+    config = config or load_config()
 
-    with Session() as session:
-        if not session.login(**config):
+    isapi = config.get("backend") == "isapi"
+    if isapi:
+        from cida_attendance.isapi import IsapiSession
+
+    with IsapiSession() if isapi else Session() as session:
+        if login is not None:
+            session.attach(login.user_id, login.serial_number)
+        elif not session.login(**config):
+            # The password may have been rotated outside this process.
+            refresh_secrets()
             return False
 
-        model, serial = session.get_device_info()
-        local_time, tz = session.get_device_time()
+        cache = cache or get_device_cache()
+        key = device_key(config)
+        metadata = cache.get_metadata(key, session)
+        model, serial = metadata["model"], metadata["serial"]
+        local_time, tz = cache.get_device_time(key, session)
         logger.info("Device model: %s", model)
 
-        client = HttpClient(auth_token=config["api_key"], url=config["url"])
+        client = (
+            uploader.client
+            if uploader
+            else HttpClient(auth_token=config["api_key"], url=config["url"])
+        )
         last_event_time = None
+        server_formats = None
 
-        try:
-            if (data := client.get(device_serial=serial, device_model=model)) and (
-                last_sync := data.get("last_sync")
-            ):
-                last_event_time = datetime.datetime.fromisoformat(last_sync)
-        except HttpClientError as e:
-            logger.error("HTTP error: %s", e)
-            return False
+        # The previous upload told us where the server stands; only ask again
+        # after a cold start or when that answer could not be trusted.
+        if cursor := cache.get_sync_cursor(key, serial, client.url):
+            server_formats = cursor.get("formats")
+            last_event_time = datetime.datetime.fromisoformat(cursor["last_sync"])
+        else:
+            try:
+                if data := client.get(device_serial=serial, device_model=model):
+                    server_formats = data.get("formats")
+                    if last_sync := data.get("last_sync"):
+                        last_event_time = datetime.datetime.fromisoformat(last_sync)
+            except HttpClientError as e:
+                logger.error("HTTP error: %s", e)
+                return False
+
+        if uploader is not None and uploader.server_formats is None:
+            uploader.server_formats = server_formats
 
         if last_event_time:
-            start_date = last_event_time.astimezone(local_time.tzinfo) + datetime.timedelta(
-                seconds=1
-            )
+            start_date = last_event_time.astimezone(local_time.tzinfo)
+            start_date += datetime.timedelta(seconds=1)
         else:
             start_date = datetime.datetime(2000, 1, 1, tzinfo=local_time.tzinfo)
 
-        device_data = {
-            "device_id": serial,
-            "device_model": model,
-            "device_name": config["name"],
-            "records": [],
-        }
+        # Cold starts may download years of events: stream them when possible.
+        # Only without an uploader (the GUI path); shared uploads, the CLI and
+        # the daemon always build an AttendanceBatch.
+        fmt = choose_format(
+            server_formats,
+            config.get("upload_format", "auto"),
+            streaming=last_event_time is None and uploader is None,
+        )
+        if fmt == "ndjson":
+            batch = NdjsonUploadStream(client, serial, model, config["name"])
+        else:
+            batch = AttendanceBatch(serial, model, config["name"], tz)
+
+        capture = None
+        try:
+            if isapi:
+                for event in session.iter_acs_events(start_date, local_time, major=0x5):
+                    batch.append(*event)
+            else:
+                on_data = build_acs_event_handler(batch, tz)
+                capture = session.capture = open_capture()
+                session.async_get_asc_event(start_date, local_time, on_data, major=0x5)
+        except BaseException:
+            if isinstance(batch, NdjsonUploadStream):
+                batch.abort()
+            raise
+        finally:
+            if capture is not None:
+                capture.close()
 
-        from cida_attendance.sdk.bindings import build_datetime_from_net_dvr_time
+    if not len(batch):
+        if isinstance(batch, NdjsonUploadStream):
+            batch.abort()
+        logger.info("No new events")
+        return session.logout()
 
-        def on_data(data):
-            by_employee_no = (
-                bytes(data.struAcsEventInfo.byEmployeeNo).decode("ascii").rstrip("\x00")
+    if uploader is not None:
+        # Sent together with other devices' batches; the cursor is stored
+        # once the shared request completes.
+        def on_uploaded(future):
+            try:
+                response = future.result()
+            except Exception as e:
+                cache.clear_sync_cursor(key)
+                logger.error("HTTP error for %s: %s", serial, e)
+                return
+            logger.info("Server response for %s: %s", serial, response)
+            update_sync_cursor(
+                cache, key, serial, client.url, batch, response, server_formats
             )
-            if by_employee_no:
-                dt = build_datetime_from_net_dvr_time(data.struTime, tz=tz)
-                device_data["records"].append(
-                    {
-                        "employee_id": by_employee_no,
-                        "timestamp": dt.isoformat(),
-                        "event_type": data.struAcsEventInfo.byAttendanceStatus,
-                        "event_minor": data.dwMinor,
-                    }
-                )
 
-        session.async_get_asc_event(start_date, local_time, on_data, major=0x5)
+        future = uploader.submit(batch)
+        future.add_done_callback(on_uploaded)
+        return future if session.logout() else False
 
     try:
-        response = client.post(device_data)
+        if isinstance(batch, NdjsonUploadStream):
+            response = batch.finish()
+        else:
+            response = upload_batch(
+                client, batch, server_formats, config.get("upload_format", "auto")
+            )
         logger.info("Server response: %s", response)
     except HttpClientError as e:
+        cache.clear_sync_cursor(key)
         logger.error("HTTP error: %s", e)
         return False
 
+    update_sync_cursor(cache, key, serial, client.url, batch, response, server_formats)
+
     logger.info("Events synchronized")
     return session.logout()
 
 
+def select_devices(device: str | None = None) -> list[dict]:
+    """Configured devices, or only the one with this name, ip or ip:port."""
+
+    devices = load_devices()
+    if device is not None:
+        devices = [c for c in devices if device in (c["name"], c["ip"], device_key(c))]
+        if not devices:
+            logger.error("No configured device matches %s", device)
+    return devices
+
+
+def synchronize_all(device: str | None = None) -> bool:
+    """Synchronize every configured device, sharing one upload per cycle.
+
+    Devices are read one after another (the SDK is initialized per session),
+    while their batches are coalesced by a `BatchUploader` per server.
+    `device` limits the run to the device with that name, ip or ip:port.
+    """
+
+    devices = select_devices(device)
+    if not devices:
+        return False
+
+    uploaders: dict[tuple[str, str], BatchUploader] = {}
+    uploads: list[Future] = []
+    ok = True
+
+    # One SDK initialization for the whole sweep keeps the logins valid.
+    init_dll()
+    try:
+        # Log into every device up front: unreachable ones time out together
+        # instead of one after another.
+        logins = {}
+        sdk_devices = [c for c in devices if c.get("backend", "sdk") == "sdk"]
+        if len(sdk_devices) > 1:
+            logins = {device_key(r.config): r for r in login_many(sdk_devices)}
+
+        for config in devices:
+            login = logins.get(device_key(config))
+            if login is not None and not login.ok:
+                # The password may have been rotated outside this process.
+                refresh_secrets()
+                ok = False
+                continue
+
+            server = (config["url"], config["api_key"])
+            if server not in uploaders:
+                client = HttpClient(auth_token=config["api_key"], url=config["url"])
+                uploaders[server] = BatchUploader(
+                    client, preferred=config.get("upload_format", "auto")
+                )
+            try:
+                result = synchronize(config, uploaders[server], login=login)
+            except Exception as e:
+                logger.error(
+                    "Failed to synchronize %s: %s", config["ip"], e, exc_info=e
+                )
+                ok = False
+                continue
+            if isinstance(result, Future):
+                uploads.append(result)
+            else:
+                ok = bool(result) and ok
+    finally:
+        for uploader in uploaders.values():
+            uploader.close()
+        cleanup_dll()
+
+    # Closing the uploaders sent everything: each future holds its outcome.
+    return all(future.exception() is None for future in uploads) and ok
+
+
+def snapshot_roster(
+    device: str | None = None,
+    snapshot: RosterSnapshot | None = None,
+) -> dict[str, dict[str, RosterDiff | None]]:
+    """Stream the users and cards of each device into the roster snapshot.
+
+    Returns the diff per device name (or ip) and kind; None marks a kind that
+    could not be read.
+    """
+
+    owned = snapshot is None
+    snapshot = snapshot or RosterSnapshot()
+    results: dict[str, dict[str, RosterDiff | None]] = {}
+    try:
+        for config in select_devices(device):
+            label = config["name"] or config["ip"]
+            results[label] = {"users": None, "cards": None}
+
+            isapi = config.get("backend") == "isapi"
+            if isapi:
+                from cida_attendance.isapi import IsapiSession
+
+            with IsapiSession() if isapi else Session() as session:
+                if not session.login(**config):
+                    refresh_secrets()
+                    continue
+                serial = session.serial_number or device_key(config)
+                for kind, records in (
+                    ("users", session.iter_users),
+                    ("cards", session.iter_cards),
+                ):
+                    try:
+                        results[label][kind] = snapshot.update(kind, serial, records())
+                    except Exception as e:
+                        logger.error(
+                            "Failed to read %s from %s: %s", kind, label, e, exc_info=e
+                        )
+    finally:
+        if owned:
+            snapshot.close()
+    return results
+
+
+def replay_capture(
+    path: str,
+    speed: float | None = None,
+    tz: datetime.tzinfo | None = None,
+) -> tuple[int, AttendanceBatch, float]:
+    """Decode a capture of `NET_DVR_GET_ACS_EVENT` callbacks like `synchronize`."""
+
+    from cida_attendance.sdk import NET_DVR_ACS_EVENT_CFG
+    from cida_attendance.sdk.bindings import replay_net_dvr_remoteconfig
+
+    batch = AttendanceBatch("replay", "replay", tz=tz)
+    start = time.perf_counter()
+    count = replay_net_dvr_remoteconfig(
+        path,
+        on_data=build_acs_event_handler(batch, tz),
+        data_cls=NET_DVR_ACS_EVENT_CFG,
+        speed=speed,
+    )
+    return count, batch, time.perf_counter() - start
+
+
 if __name__ == "__main__":
     synchronize()
@@ -0,0 +1,213 @@
+"""Coalesce per-device attendance batches into multi-device uploads.
+
+During a sweep every terminal produces a small batch a few seconds apart.
+`BatchUploader` holds submitted batches for a short window and sends them
+together in one envelope request (one auth check, one validation pass and one
+server transaction), resolving a future per batch with that device's result.
+Servers that do not advertise the envelope get one request per batch.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future
+from logging import getLogger
+
+from cida_attendance.core.client import HttpClient, HttpClientError
+from cida_attendance.core.wire import (
+    COLUMNAR_CONTENT_TYPE,
+    ENVELOPE_CONTENT_TYPE,
+    AttendanceBatch,
+    choose_format,
+    encode_envelope,
+)
+
+logger = getLogger(__name__)
+
+
+def upload_batch(
+    client: HttpClient,
+    batch: AttendanceBatch,
+    server_formats: list[str] | None = None,
+    preferred: str = "auto",
+) -> dict | None:
+    fmt = choose_format(server_formats, preferred)
+    body, content_type = batch.encode(fmt)
+
+    try:
+        return client.post(body, content_type=content_type)
+    except HttpClientError as e:
+        if e.code != 415 or fmt == "json":
+            raise
+        logger.warning("Server rejected %s uploads, falling back to JSON", fmt)
+
+    body, content_type = batch.encode("json")
+    return client.post(body, content_type=content_type)
+
+
+class BatchUploader:
+    def __init__(
+        self,
+        client: HttpClient,
+        server_formats: list[str] | None = None,
+        *,
+        preferred: str = "auto",
+        window_s: float = 2.0,
+        max_batches: int = 50,
+        max_records: int = 100_000,
+    ):
+        self.client = client
+        self.server_formats = server_formats
+        self.preferred = preferred
+        self.window_s = window_s
+        self.max_batches = max_batches
+        self.max_records = max_records
+        self.requests = 0
+
+        self._cond = threading.Condition()
+        self._pending: list[tuple[AttendanceBatch, Future]] = []
+        self._first_at = 0.0
+        self._closed = False
+        self._thread: threading.Thread | None = None
+
+    @property
+    def envelope_supported(self) -> bool:
+        return (
+            self.server_formats is not None
+            and ENVELOPE_CONTENT_TYPE in self.server_formats
+        )
+
+    def submit(self, batch: AttendanceBatch) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchUploader is closed")
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append((batch, future))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="batch-uploader", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def upload(self, batch: AttendanceBatch) -> dict | None:
+        return self.submit(batch).result()
+
+    def close(self) -> None:
+        """Send whatever is pending and stop the background thread."""
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def __enter__(self) -> BatchUploader:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _full(self) -> bool:
+        return (
+            len(self._pending) >= self.max_batches
+            or sum(len(batch) for batch, _ in self._pending) >= self.max_records
+        )
+
+    def _take(self) -> list[tuple[AttendanceBatch, Future]]:
+        group, records = [], 0
+        while self._pending and len(group) < self.max_batches:
+            size = len(self._pending[0][0])
+            if group and records + size > self.max_records:
+                break
+            group.append(self._pending.pop(0))
+            records += size
+        if self._pending:
+            self._first_at = time.monotonic()
+        return group
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                deadline = self._first_at + self.window_s
+                while not self._closed and not self._full():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                group = self._take()
+            try:
+                self._send(group)
+            except BaseException as e:
+                # Callers wait on these futures: never leave one unresolved.
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _send(self, group: list[tuple[AttendanceBatch, Future]]) -> None:
+        if len(group) > 1 and self.envelope_supported:
+            try:
+                self._send_envelope(group)
+                return
+            except HttpClientError as e:
+                if e.code != 415:
+                    for _, future in group:
+                        future.set_exception(e)
+                    return
+                logger.warning(
+                    "Server rejected envelope uploads, sending batches one by one"
+                )
+                self.server_formats = [
+                    f for f in self.server_formats or () if f != ENVELOPE_CONTENT_TYPE
+                ]
+
+        for batch, future in group:
+            try:
+                self.requests += 1
+                future.set_result(
+                    upload_batch(
+                        self.client, batch, self.server_formats, self.preferred
+                    )
+                )
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _send_envelope(self, group: list[tuple[AttendanceBatch, Future]]) -> None:
+        columnar = self.preferred != "json" and COLUMNAR_CONTENT_TYPE in (
+            self.server_formats or ()
+        )
+        body, content_type = encode_envelope((batch for batch, _ in group), columnar)
+
+        self.requests += 1
+        response = self.client.post(body, content_type=content_type) or {}
+        results = response.get("results")
+        if not isinstance(results, list) or len(results) != len(group):
+            error = HttpClientError(
+                "Envelope response does not match request", data=response
+            )
+            for _, future in group:
+                future.set_exception(error)
+            return
+
+        logger.info("Uploaded %d device batches in one request", len(group))
+        for (_, future), result in zip(group, results):
+            # The server stores the valid batches and reports the rest.
+            if isinstance(result, dict) and result.get("status") == "error":
+                future.set_exception(
+                    HttpClientError(
+                        f"Batch rejected: {result.get('error')}",
+                        code=result.get("code"),
+                        data=result,
+                    )
+                )
+            else:
+                future.set_result(result)
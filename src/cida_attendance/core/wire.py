@@ -0,0 +1,383 @@
+"""Wire formats for attendance uploads.
+
+`AttendanceBatch` accumulates the events of one device in columnar form
+(parallel arrays, a string dictionary for employee ids and epoch seconds with
+a single UTC offset per batch) and encodes them as:
+
+- `json`: the original `{"device_id": ..., "records": [{...}, ...]}` body.
+- `columnar`: the same columns as a versioned JSON document.
+- `binary`: the columns packed little-endian behind a small header::
+
+    b"CIDA" | version u8 | flags u8 | tz_offset i32 | count u32 | employees u32
+    | device_id, device_model, device_name, employee ids (u16 length + UTF-8)
+    | employee index u32[count] | timestamp i64[count]
+    | event_type u16[count] | event_minor u32[count]
+    | serial_no u32[count]  (only with flags & FLAG_SERIAL)
+
+- `ndjson`: one JSON document per line (device header first, then one
+  legacy record per line, then `{"end": true, "count": N}`), streamed with
+  chunked transfer encoding so neither side needs the whole batch in memory.
+  The server only commits once the end marker arrives with a matching count.
+
+Device event serial numbers are optional in every format: omitted when zero
+in JSON/NDJSON records, a `serial` column in the columnar document and a
+flagged trailing column in the binary framing.
+
+Batches from several devices can travel together in one envelope
+(`{"v": 1, "batches": [...]}`), each batch in the columnar or JSON shape.
+
+The format is negotiated through `Content-Type`; servers advertise the
+content types they accept in the `formats` field of the GET response.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+import struct
+from array import array
+from typing import Any, Iterable, Iterator
+
+WIRE_VERSION = 1
+
+JSON_CONTENT_TYPE = "application/json"
+COLUMNAR_CONTENT_TYPE = "application/vnd.cida.attendance.columnar+json"
+BINARY_CONTENT_TYPE = "application/vnd.cida.attendance.columnar"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+ENVELOPE_CONTENT_TYPE = "application/vnd.cida.attendance.envelope+json"
+
+FORMAT_CONTENT_TYPES = {
+    "json": JSON_CONTENT_TYPE,
+    "columnar": COLUMNAR_CONTENT_TYPE,
+    "binary": BINARY_CONTENT_TYPE,
+    "ndjson": NDJSON_CONTENT_TYPE,
+}
+
+# Most compact first. NDJSON is only chosen for streamed uploads.
+FORMAT_PREFERENCE = ("binary", "columnar", "json")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+BINARY_MAGIC = b"CIDA"
+FLAG_SERIAL = 0x01
+_BINARY_HEADER = struct.Struct("<4sBBiII")
+_STRING_LENGTH = struct.Struct("<H")
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def choose_format(
+    server_formats: Iterable[str] | None,
+    preferred: str = "auto",
+    streaming: bool = False,
+) -> str:
+    """Pick the most compact format both sides understand.
+
+    Servers that do not advertise formats only get the original JSON body.
+    With `streaming`, NDJSON wins whenever the server accepts it; without it
+    NDJSON is never returned, since only a stream can be sent that way.
+    """
+
+    accepted = {
+        name
+        for name, content_type in FORMAT_CONTENT_TYPES.items()
+        if content_type in set(server_formats or ())
+    }
+    accepted.add("json")
+
+    if preferred == "ndjson" and not streaming:
+        preferred = "auto"
+    if preferred != "auto":
+        return preferred if preferred in accepted else "json"
+
+    if streaming and "ndjson" in accepted:
+        return "ndjson"
+
+    for name in FORMAT_PREFERENCE:
+        if name in accepted:
+            return name
+    return "json"
+
+
+def ndjson_line(value: dict[str, Any]) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def ndjson_header(
+    device_id: str, device_model: str, device_name: str | None = None
+) -> bytes:
+    return ndjson_line(
+        {
+            "device_id": device_id,
+            "device_model": device_model,
+            "device_name": device_name,
+        }
+    )
+
+
+def ndjson_trailer(count: int) -> bytes:
+    return ndjson_line({"end": True, "count": count})
+
+
+def iter_chunks(
+    lines: Iterable[bytes], chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Group small lines into transfer chunks of roughly `chunk_size` bytes."""
+
+    buffer = bytearray()
+    for line in lines:
+        buffer += line
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def encode_envelope(
+    batches: Iterable[AttendanceBatch], columnar: bool = True
+) -> tuple[bytes, str]:
+    body = {
+        "v": WIRE_VERSION,
+        "batches": [
+            batch.to_columnar() if columnar else batch.to_json() for batch in batches
+        ],
+    }
+    return json.dumps(body, separators=(",", ":")).encode(
+        "utf-8"
+    ), ENVELOPE_CONTENT_TYPE
+
+
+def _utc_offset_s(tz: datetime.tzinfo | None) -> int:
+    if tz is None:
+        return 0
+    offset = tz.utcoffset(None)
+    return int(offset.total_seconds()) if offset is not None else 0
+
+
+def _pack_string(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if len(raw) > 0xFFFF:
+        raise WireFormatError("String too long for binary framing")
+    return _STRING_LENGTH.pack(len(raw)) + raw
+
+
+def _little_endian(values: array) -> bytes:
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class AttendanceBatch:
+    def __init__(
+        self,
+        device_id: str,
+        device_model: str,
+        device_name: str | None = None,
+        tz: datetime.tzinfo | None = None,
+    ):
+        self.device_id = device_id
+        self.device_model = device_model
+        self.device_name = device_name
+        self.tz_offset = _utc_offset_s(tz)
+        self.tz = datetime.timezone(datetime.timedelta(seconds=self.tz_offset))
+
+        self.employees: list[str] = []
+        self._employee_index: dict[str, int] = {}
+        self.employee_idx = array("I")
+        self.timestamps = array("q")
+        self.event_types = array("H")
+        self.event_minors = array("I")
+        self.serial_nos = array("I")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def append(
+        self,
+        employee_id: str,
+        when: datetime.datetime | int,
+        event_type: int,
+        event_minor: int = 0,
+        serial_no: int = 0,
+    ) -> None:
+        index = self._employee_index.get(employee_id)
+        if index is None:
+            index = self._employee_index[employee_id] = len(self.employees)
+            self.employees.append(employee_id)
+
+        if isinstance(when, datetime.datetime):
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=self.tz)
+            when = int(when.timestamp())
+
+        self.employee_idx.append(index)
+        self.timestamps.append(int(when))
+        self.event_types.append(int(event_type))
+        self.event_minors.append(int(event_minor))
+        self.serial_nos.append(int(serial_no))
+
+    def extend(self, other: AttendanceBatch) -> None:
+        employees = other.employees
+        for index, ts, event_type, event_minor, serial_no in zip(
+            other.employee_idx,
+            other.timestamps,
+            other.event_types,
+            other.event_minors,
+            other.serial_nos,
+        ):
+            self.append(employees[index], ts, event_type, event_minor, serial_no)
+
+    def has_serials(self) -> bool:
+        return any(self.serial_nos)
+
+    def max_serial(self) -> int | None:
+        return max(self.serial_nos) if self.has_serials() else None
+
+    def max_timestamp(self) -> datetime.datetime | None:
+        if not self.timestamps:
+            return None
+        return datetime.datetime.fromtimestamp(max(self.timestamps), tz=self.tz)
+
+    def records(self) -> Iterator[dict[str, Any]]:
+        tz = self.tz
+        employees = self.employees
+        for index, ts, event_type, event_minor, serial_no in zip(
+            self.employee_idx,
+            self.timestamps,
+            self.event_types,
+            self.event_minors,
+            self.serial_nos,
+        ):
+            record = {
+                "employee_id": employees[index],
+                "timestamp": datetime.datetime.fromtimestamp(ts, tz=tz).isoformat(),
+                "event_type": event_type,
+                "event_minor": event_minor,
+            }
+            if serial_no:
+                record["serial_no"] = serial_no
+            yield record
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "device_id": self.device_id,
+            "device_model": self.device_model,
+            "device_name": self.device_name,
+            "records": list(self.records()),
+        }
+
+    def iter_ndjson(self) -> Iterator[bytes]:
+        yield ndjson_header(self.device_id, self.device_model, self.device_name)
+        for record in self.records():
+            yield ndjson_line(record)
+        yield ndjson_trailer(len(self))
+
+    def to_columnar(self) -> dict[str, Any]:
+        columnar = {
+            "v": WIRE_VERSION,
+            "device_id": self.device_id,
+            "device_model": self.device_model,
+            "device_name": self.device_name,
+            "tz_offset": self.tz_offset,
+            "employees": self.employees,
+            "employee": self.employee_idx.tolist(),
+            "time": self.timestamps.tolist(),
+            "type": self.event_types.tolist(),
+            "minor": self.event_minors.tolist(),
+        }
+        if self.has_serials():
+            columnar["serial"] = self.serial_nos.tolist()
+        return columnar
+
+    def to_binary(self) -> bytes:
+        has_serials = self.has_serials()
+        parts = [
+            _BINARY_HEADER.pack(
+                BINARY_MAGIC,
+                WIRE_VERSION,
+                FLAG_SERIAL if has_serials else 0,
+                self.tz_offset,
+                len(self),
+                len(self.employees),
+            ),
+            _pack_string(self.device_id),
+            _pack_string(self.device_model),
+            _pack_string(self.device_name or ""),
+        ]
+        parts.extend(_pack_string(employee) for employee in self.employees)
+        parts.append(_little_endian(self.employee_idx))
+        parts.append(_little_endian(self.timestamps))
+        parts.append(_little_endian(self.event_types))
+        parts.append(_little_endian(self.event_minors))
+        if has_serials:
+            parts.append(_little_endian(self.serial_nos))
+        return b"".join(parts)
+
+    def encode(self, fmt: str = "json") -> tuple[bytes, str]:
+        if fmt == "ndjson":
+            return b"".join(self.iter_ndjson()), NDJSON_CONTENT_TYPE
+        if fmt == "binary":
+            return self.to_binary(), BINARY_CONTENT_TYPE
+        if fmt == "columnar":
+            body = self.to_columnar()
+        elif fmt == "json":
+            body = self.to_json()
+        else:
+            raise WireFormatError(f"Unknown wire format: {fmt}")
+        return (
+            json.dumps(body, separators=(",", ":")).encode("utf-8"),
+            FORMAT_CONTENT_TYPES[fmt],
+        )
+
+    @classmethod
+    def from_binary(cls, data: bytes) -> AttendanceBatch:
+        try:
+            magic, version, flags, tz_offset, count, n_employees = (
+                _BINARY_HEADER.unpack_from(data, 0)
+            )
+        except struct.error as e:
+            raise WireFormatError("Truncated header") from e
+        if magic != BINARY_MAGIC or version != WIRE_VERSION:
+            raise WireFormatError("Unsupported binary payload")
+
+        offset = _BINARY_HEADER.size
+        strings = []
+        for _ in range(3 + n_employees):
+            (length,) = _STRING_LENGTH.unpack_from(data, offset)
+            offset += _STRING_LENGTH.size
+            strings.append(bytes(data[offset : offset + length]).decode("utf-8"))
+            offset += length
+
+        batch = cls(
+            strings[0],
+            strings[1],
+            strings[2] or None,
+            datetime.timezone(datetime.timedelta(seconds=tz_offset)),
+        )
+        batch.employees = strings[3:]
+        batch._employee_index = {e: i for i, e in enumerate(batch.employees)}
+
+        columns = [
+            batch.employee_idx,
+            batch.timestamps,
+            batch.event_types,
+            batch.event_minors,
+        ]
+        if flags & FLAG_SERIAL:
+            columns.append(batch.serial_nos)
+        for column in columns:
+            size = column.itemsize * count
+            column.frombytes(bytes(data[offset : offset + size]))
+            if struct.pack("=H", 1) != struct.pack("<H", 1):
+                column.byteswap()
+            offset += size
+
+        if offset != len(data) or len(batch.timestamps) != count:
+            raise WireFormatError("Payload length does not match header")
+        if not flags & FLAG_SERIAL:
+            batch.serial_nos.extend([0] * count)
+        return batch
@@ -0,0 +1,354 @@
+"""Shard devices across worker processes.
+
+SDK callbacks decode records in Python, so every terminal streaming into one
+process competes for the same GIL. `WorkerPool` assigns devices to N worker
+processes by consistent hashing (adding a device or a worker only moves the
+devices whose ring position changed); each worker initializes its own SDK and
+synchronizes its shard on the usual interval.
+
+Workers do not talk to the server for uploads: finished batches travel through
+a multiprocessing queue to the supervisor, which feeds one `BatchUploader` per
+server and sends each upload result back to the worker that owns the device,
+so cursors stay in the worker's device cache. The supervisor restarts crashed
+workers with backoff and re-shards when the configured devices change.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from logging import getLogger
+from typing import Any
+
+from cida_attendance.config import get_state_dir, load_devices
+from cida_attendance.core.client import HttpClient, HttpClientError
+from cida_attendance.core.device_cache import DeviceMetadataCache, device_key
+from cida_attendance.core.uploader import BatchUploader
+from cida_attendance.core.wire import AttendanceBatch
+
+logger = getLogger(__name__)
+
+RING_REPLICAS = 64
+RESTART_BACKOFF_S = 1.0
+RESTART_BACKOFF_MAX_S = 60.0
+RELOAD_INTERVAL_S = 30.0
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    def __init__(self, nodes, replicas: int = RING_REPLICAS):
+        self._ring = sorted(
+            (_ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._hashes = [h for h, _ in self._ring]
+
+    def node_for(self, key: str):
+        if not self._ring:
+            raise ValueError("HashRing has no nodes")
+        i = bisect.bisect(self._hashes, _ring_hash(key)) % len(self._ring)
+        return self._ring[i][1]
+
+
+def assign_devices(devices: list[dict], workers: int) -> dict[int, list[dict]]:
+    ring = HashRing(range(workers))
+    shards: dict[int, list[dict]] = {i: [] for i in range(workers)}
+    for config in devices:
+        shards[ring.node_for(device_key(config))].append(config)
+    return shards
+
+
+class QueueUploader:
+    """`BatchUploader` stand-in used inside a worker.
+
+    Batches go to the supervisor in the binary wire format; the reply comes
+    back on the worker's own queue and resolves the future returned by
+    `submit`.
+    """
+
+    def __init__(self, index: int, config: dict, uploads, replies: "_Replies"):
+        self.index = index
+        self.client = HttpClient(auth_token=config["api_key"], url=config["url"])
+        self.server = (config["url"], config["api_key"])
+        self.preferred = config.get("upload_format", "auto")
+        self.server_formats: list[str] | None = None
+        self._uploads = uploads
+        self._replies = replies
+
+    def submit(self, batch: AttendanceBatch) -> Future:
+        request_id, future = self._replies.expect()
+        self._uploads.put(
+            (
+                self.index,
+                request_id,
+                self.server,
+                self.preferred,
+                self.server_formats,
+                batch.to_binary(),
+            )
+        )
+        return future
+
+
+class _Replies:
+    def __init__(self, replies):
+        self._queue = replies
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[int, int], Future] = {}
+        self._next_id = 0
+
+    def expect(self) -> tuple[tuple[int, int], Future]:
+        # The pid keeps late replies meant for a replaced worker from
+        # resolving this one's futures.
+        future: Future = Future()
+        with self._lock:
+            self._next_id += 1
+            request_id = (os.getpid(), self._next_id)
+            self._pending[request_id] = future
+            return request_id, future
+
+    def drain(self, timeout: float | None = None) -> None:
+        block = timeout is not None
+        while True:
+            try:
+                request_id, ok, value = self._queue.get(block=block, timeout=timeout)
+            except queue.Empty:
+                return
+            block = False
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                message, code = value
+                future.set_exception(HttpClientError(message, code=code))
+
+    def wait_all(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while self._pending and (remaining := deadline - time.monotonic()) > 0:
+            self.drain(timeout=remaining)
+
+
+def _worker_main(index, devices, interval_s, uploads, replies, stop) -> None:
+    from cida_attendance.core.tasks import synchronize
+
+    # Entries written by another shard are never read here: one cache file
+    # per worker avoids concurrent rewrites of the same JSON file.
+    cache = DeviceMetadataCache(
+        os.path.join(get_state_dir(), f"device_cache.w{index}.json")
+    )
+    pending = _Replies(replies)
+    uploaders = {}
+    logger.info("Worker %d started with %d device(s)", index, len(devices))
+
+    while not stop.is_set():
+        started = time.monotonic()
+        for config in devices:
+            if stop.is_set():
+                break
+            server = (config["url"], config["api_key"])
+            uploader = uploaders.setdefault(
+                server, QueueUploader(index, config, uploads, pending)
+            )
+            try:
+                synchronize(config, uploader, cache=cache)
+            except Exception as e:
+                logger.error(
+                    "Worker %d failed on %s: %s", index, config["ip"], e, exc_info=e
+                )
+            pending.drain()
+
+        pending.wait_all(timeout=max(0.0, interval_s - (time.monotonic() - started)))
+        stop.wait(max(0.0, interval_s - (time.monotonic() - started)))
+
+    pending.wait_all(timeout=10.0)
+
+
+class _Worker:
+    def __init__(self, index: int, devices: list[dict]):
+        self.index = index
+        self.devices = devices
+        self.process: multiprocessing.Process | None = None
+        self.failures = 0
+        self.restart_at = 0.0
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        workers: int,
+        interval_s: float,
+        *,
+        devices_source=load_devices,
+        uploader_window_s: float = 2.0,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.interval_s = interval_s
+        self.devices_source = devices_source
+        self.uploader_window_s = uploader_window_s
+
+        # Spawned workers start without the parent's SDK state.
+        self._ctx = multiprocessing.get_context("spawn")
+        self._uploads = self._ctx.Queue()
+        self._replies = [self._ctx.Queue() for _ in range(workers)]
+        self._stop = self._ctx.Event()
+        self._workers = [_Worker(i, []) for i in range(workers)]
+        self._uploaders: dict[tuple[str, str], BatchUploader] = {}
+        self._reloaded_at = 0.0
+
+    def start(self) -> None:
+        self._reload(force=True)
+
+    def poll(self) -> None:
+        """Forward pending uploads, restart dead workers and re-shard on change."""
+
+        self._forward_uploads()
+        self._supervise()
+        self._reload()
+
+    def stop(self, timeout: float = 15.0) -> None:
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            while worker.process.is_alive() and time.monotonic() < deadline:
+                self._forward_uploads()
+                worker.process.join(timeout=0.2)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        self._forward_uploads()
+        for uploader in self._uploaders.values():
+            uploader.close()
+
+    def assignment(self) -> dict[int, list[str]]:
+        return {w.index: [device_key(c) for c in w.devices] for w in self._workers}
+
+    def _spawn(self, worker: _Worker) -> None:
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker.index,
+                worker.devices,
+                self.interval_s,
+                self._uploads,
+                self._replies[worker.index],
+                self._stop,
+            ),
+            name=f"cida-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+
+    def _retire(self, worker: _Worker) -> None:
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        worker.process = None
+
+    def _supervise(self) -> None:
+        now = time.monotonic()
+        for worker in self._workers:
+            if not worker.devices or self._stop.is_set():
+                continue
+            if worker.process is not None and worker.process.is_alive():
+                continue
+            if worker.process is not None:
+                worker.failures += 1
+                delay = min(
+                    RESTART_BACKOFF_MAX_S,
+                    RESTART_BACKOFF_S * 2 ** (worker.failures - 1),
+                )
+                worker.restart_at = now + delay
+                logger.warning(
+                    "Worker %d exited with %s, restarting in %.0fs",
+                    worker.index,
+                    worker.process.exitcode,
+                    delay,
+                )
+                worker.process = None
+            if now >= worker.restart_at:
+                self._spawn(worker)
+
+    def _reload(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._reloaded_at < RELOAD_INTERVAL_S:
+            return
+        self._reloaded_at = now
+
+        shards = assign_devices(self.devices_source(), self.workers)
+        for worker in self._workers:
+            devices = shards[worker.index]
+            if devices == worker.devices and not force:
+                continue
+            if worker.devices or worker.process is not None:
+                logger.info(
+                    "Re-sharding worker %d: %d device(s)", worker.index, len(devices)
+                )
+            self._retire(worker)
+            worker.devices = devices
+            worker.failures = 0
+            worker.restart_at = 0.0
+            if devices:
+                self._spawn(worker)
+
+    def _uploader(
+        self, server: tuple[str, str], preferred: str, formats
+    ) -> BatchUploader:
+        uploader = self._uploaders.get(server)
+        if uploader is None:
+            url, api_key = server
+            uploader = self._uploaders[server] = BatchUploader(
+                HttpClient(auth_token=api_key, url=url),
+                preferred=preferred,
+                window_s=self.uploader_window_s,
+            )
+        if uploader.server_formats is None:
+            uploader.server_formats = formats
+        return uploader
+
+    def _forward_uploads(self) -> None:
+        while True:
+            try:
+                index, request_id, server, preferred, formats, body = (
+                    self._uploads.get_nowait()
+                )
+            except queue.Empty:
+                return
+
+            replies = self._replies[index]
+            try:
+                batch = AttendanceBatch.from_binary(body)
+                future = self._uploader(server, preferred, formats).submit(batch)
+            except Exception as e:
+                replies.put((request_id, False, (str(e), None)))
+                continue
+            future.add_done_callback(
+                lambda f, replies=replies, request_id=request_id: replies.put(
+                    _reply(request_id, f)
+                )
+            )
+
+
+def _reply(request_id: tuple[int, int], future: Future) -> tuple[int, bool, Any]:
+    try:
+        return request_id, True, future.result()
+    except HttpClientError as e:
+        return request_id, False, (str(e), e.code)
+    except Exception as e:
+        return request_id, False, (str(e), None)
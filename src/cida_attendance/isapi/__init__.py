@@ -0,0 +1,9 @@
+"""Device backend speaking ISAPI over HTTP, without HCNetSDK.
+
+Selected per device with `backend = isapi` in its config section.
+"""
+
+from cida_attendance.isapi.client import AsyncIsapiClient, IsapiClient, IsapiError
+from cida_attendance.isapi.session import IsapiSession
+
+__all__ = ["AsyncIsapiClient", "IsapiClient", "IsapiError", "IsapiSession"]
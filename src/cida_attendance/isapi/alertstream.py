@@ -0,0 +1,679 @@
+"""Real-time events from the ISAPI alertStream, without HCNetSDK.
+
+`GET /ISAPI/Event/notification/alertStream` never ends: the terminal writes
+one multipart part per event (JSON or XML depending on firmware), usually
+followed by a JPEG snapshot, plus periodic heartbeats. `MultipartParser`
+reads it through a bounded buffer and hands part bodies to a sink as they
+arrive, so snapshots go to disk (or nowhere) as memoryview slices instead of
+being assembled in memory. `AlertStream` keeps one device's stream open from
+asyncio, reconnects with backoff and, after a drop, fetches what it missed
+through the AcsEvent search; `AlertStreamHub` runs any number of them in one
+loop and feeds their events to an `EventBatcher`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import ssl
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, AsyncIterator, Callable, Protocol
+from xml.etree.ElementTree import ParseError
+
+from cida_attendance.core.listener import EventBatcher
+from cida_attendance.core.uploader import BatchUploader
+from cida_attendance.isapi.client import IsapiClient, IsapiError
+from cida_attendance.isapi.session import IsapiSession, event_from_info
+from cida_attendance.sdk.xmlstream import find_xml_values
+
+logger = getLogger(__name__)
+
+ALERT_STREAM_PATH = "/ISAPI/Event/notification/alertStream"
+READ_SIZE = 64 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+MAX_EVENT_BYTES = 1024 * 1024
+# Terminals send a heartbeat part every 10-30 s; silence beyond this is a
+# dead connection.
+IDLE_TIMEOUT_S = 90.0
+RECONNECT_MIN_S = 1.0
+RECONNECT_MAX_S = 60.0
+MAJOR_EVENT = 0x5
+DEDUPE_WINDOW = 4096
+
+_BOUNDARY = re.compile(r'boundary\s*=\s*"?([^";]+)"?', re.IGNORECASE)
+
+_ALERT_TAGS = [
+    "eventType",
+    "dateTime",
+    "majorEventType",
+    "subEventType",
+    "employeeNoString",
+    "employeeNo",
+    "serialNo",
+    "attendanceStatus",
+]
+
+
+class MultipartError(ValueError):
+    pass
+
+
+class PartSink(Protocol):
+    def write(self, data: memoryview) -> None: ...
+
+    def close(self, complete: bool) -> None: ...
+
+
+class _Discard:
+    def write(self, data: memoryview) -> None:
+        pass
+
+    def close(self, complete: bool) -> None:
+        pass
+
+
+DISCARD = _Discard()
+
+
+class CollectSink:
+    """Buffers a (small) part and passes it to `on_part` once complete;
+    oversized parts are dropped."""
+
+    def __init__(
+        self,
+        headers: dict[str, str],
+        on_part: Callable[[dict[str, str], bytes], None],
+        limit: int = MAX_EVENT_BYTES,
+    ):
+        self.headers = headers
+        self.on_part = on_part
+        self.limit = limit
+        self._data: bytearray | None = bytearray()
+
+    def write(self, data: memoryview) -> None:
+        if self._data is None:
+            return
+        if len(self._data) + len(data) > self.limit:
+            logger.warning(
+                "Dropping a %s part over %d bytes",
+                self.headers.get("content-type"),
+                self.limit,
+            )
+            self._data = None
+            return
+        self._data += data
+
+    def close(self, complete: bool) -> None:
+        if complete and self._data is not None:
+            self.on_part(self.headers, bytes(self._data))
+        self._data = None
+
+
+class SpoolSink:
+    """Writes a part straight to `path`; incomplete parts are removed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+
+    def write(self, data: memoryview) -> None:
+        self._file.write(data)
+
+    def close(self, complete: bool) -> None:
+        self._file.close()
+        if not complete:
+            os.unlink(self.path)
+
+
+_PREAMBLE, _DELIMITER, _HEADERS, _BODY, _EPILOGUE = range(5)
+
+
+class MultipartParser:
+    """Push parser for multipart bodies of unbounded length.
+
+    `feed` consumes whatever it can and keeps only an unfinished delimiter or
+    header block, so the buffer never grows beyond one read plus
+    `max_header_bytes`. Bodies with a Content-Length are passed through
+    without scanning; others end at the next delimiter.
+    """
+
+    def __init__(
+        self,
+        boundary: str,
+        open_part: Callable[[dict[str, str]], PartSink],
+        *,
+        max_header_bytes: int = MAX_HEADER_BYTES,
+    ):
+        self._delimiter = b"--" + boundary.encode("ascii")
+        self._body_end = b"\r\n" + self._delimiter
+        self.open_part = open_part
+        self.max_header_bytes = max_header_bytes
+
+        self._buf = bytearray()
+        self._state = _PREAMBLE
+        self._sink: PartSink | None = None
+        self._remaining: int | None = None
+        self.parts = 0
+
+    @property
+    def finished(self) -> bool:
+        return self._state == _EPILOGUE
+
+    def feed(self, data: bytes) -> None:
+        self._buf += data
+        while self._step():
+            pass
+
+    def close(self) -> None:
+        """End of input: drop a part cut short by the connection."""
+
+        if self._sink is not None:
+            self._sink.close(False)
+            self._sink = None
+        self._buf.clear()
+
+    def _write(self, n: int) -> None:
+        with memoryview(self._buf) as view, view[:n] as chunk:
+            self._sink.write(chunk)
+        del self._buf[:n]
+
+    def _end_part(self) -> None:
+        self._sink.close(True)
+        self._sink = None
+        self._remaining = None
+        self.parts += 1
+        self._state = _PREAMBLE
+
+    def _step(self) -> bool:
+        buf = self._buf
+
+        if self._state == _PREAMBLE:
+            i = buf.find(self._delimiter)
+            if i < 0:
+                del buf[: max(0, len(buf) - len(self._delimiter) + 1)]
+                return False
+            del buf[: i + len(self._delimiter)]
+            self._state = _DELIMITER
+            return True
+
+        if self._state == _DELIMITER:
+            i = buf.find(b"\n")
+            if i < 0:
+                if len(buf) > self.max_header_bytes:
+                    raise MultipartError("Unterminated multipart delimiter line")
+                return False
+            line = bytes(buf[:i]).strip()
+            del buf[: i + 1]
+            if line.startswith(b"--"):
+                self._state = _EPILOGUE
+            elif line:
+                # "--boundary" inside something else: keep looking.
+                self._state = _PREAMBLE
+            else:
+                self._state = _HEADERS
+            return True
+
+        if self._state == _HEADERS:
+            if buf.startswith(b"\r\n"):
+                end, size = 0, 2
+            else:
+                end, size = buf.find(b"\r\n\r\n"), 4
+            if end < 0:
+                if len(buf) > self.max_header_bytes:
+                    raise MultipartError("Multipart part headers too long")
+                return False
+            headers = {}
+            for line in bytes(buf[:end]).decode("latin-1").split("\r\n"):
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            del buf[: end + size]
+
+            length = headers.get("content-length", "").strip()
+            self._remaining = int(length) if length.isdigit() else None
+            self._sink = self.open_part(headers)
+            self._state = _BODY
+            return True
+
+        if self._state == _BODY:
+            if self._remaining is not None:
+                n = min(self._remaining, len(buf))
+                if n:
+                    self._write(n)
+                    self._remaining -= n
+                if self._remaining == 0:
+                    self._end_part()
+                    return True
+                return False
+
+            i = buf.find(self._body_end)
+            if i >= 0:
+                if i:
+                    self._write(i)
+                self._end_part()
+                return True
+            safe = len(buf) - len(self._body_end) + 1
+            if safe > 0:
+                self._write(safe)
+            return False
+
+        buf.clear()
+        return False
+
+
+def parse_alert(headers: dict[str, str], body: bytes) -> dict[str, Any] | None:
+    """An alert part as the JSON `EventNotificationAlert` shape; XML parts are
+    mapped onto the fields `event_from_alert` needs."""
+
+    content_type = headers.get("content-type", "").lower()
+    text = body.lstrip()
+    if "json" in content_type or text.startswith(b"{"):
+        try:
+            alert = json.loads(body)
+        except ValueError:
+            return None
+        return alert if isinstance(alert, dict) else None
+
+    if "xml" in content_type or text.startswith(b"<"):
+        try:
+            values = find_xml_values(body, _ALERT_TAGS)
+        except ParseError:
+            return None
+        if not values.get("eventType"):
+            return None
+        return {
+            "eventType": values.get("eventType"),
+            "dateTime": values.get("dateTime"),
+            "AccessControllerEvent": {
+                name: values.get(name) for name in _ALERT_TAGS[2:] if values.get(name)
+            },
+        }
+    return None
+
+
+def event_from_alert(alert: dict[str, Any]) -> tuple | None:
+    """(employee_no, when, event_type, event_minor, serial_no) of an
+    `AccessControllerEvent` alert, or None for heartbeats, other events and
+    alerts that do not parse."""
+
+    if alert.get("eventType") != "AccessControllerEvent":
+        return None
+    acs = alert.get("AccessControllerEvent") or {}
+    try:
+        if int(acs.get("majorEventType") or 0) != MAJOR_EVENT:
+            return None
+        return event_from_info(
+            {
+                "employeeNoString": acs.get("employeeNoString"),
+                "employeeNo": acs.get("employeeNo"),
+                "time": alert.get("dateTime"),
+                "attendanceStatus": acs.get("attendanceStatus"),
+                "minor": acs.get("subEventType"),
+                "serialNo": acs.get("serialNo"),
+            }
+        )
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def multipart_boundary(content_type: str) -> str | None:
+    match = _BOUNDARY.search(content_type)
+    return match.group(1) if match else None
+
+
+async def iter_body(
+    reader: asyncio.StreamReader,
+    headers: dict[str, str],
+    timeout: float,
+    *,
+    request: bool = False,
+) -> AsyncIterator[bytes]:
+    """Chunks of an HTTP body: chunked, by Content-Length, or (for a response
+    without either) until the connection closes."""
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size_line = await asyncio.wait_for(reader.readuntil(b"\r\n"), timeout)
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Trailers, if any, end with an empty line.
+                while (
+                    await asyncio.wait_for(reader.readuntil(b"\r\n"), timeout)
+                    != b"\r\n"
+                ):
+                    pass
+                return
+            while size:
+                data = await asyncio.wait_for(
+                    reader.read(min(size, READ_SIZE)), timeout
+                )
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", size)
+                size -= len(data)
+                yield data
+            await asyncio.wait_for(reader.readexactly(2), timeout)
+
+    length = headers.get("content-length", "").strip()
+    if length.isdigit():
+        remaining = int(length)
+        while remaining:
+            data = await asyncio.wait_for(
+                reader.read(min(remaining, READ_SIZE)), timeout
+            )
+            if not data:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(data)
+            yield data
+        return
+
+    if not request:
+        while data := await asyncio.wait_for(reader.read(READ_SIZE), timeout):
+            yield data
+
+
+async def _read_head(reader: asyncio.StreamReader) -> tuple[int, dict[str, str]]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, *lines = head.decode("latin-1").split("\r\n")
+    try:
+        status = int(status_line.split(" ", 2)[1])
+    except (IndexError, ValueError):
+        raise IsapiError(f"Invalid status line: {status_line!r}")
+    headers = {}
+    for line in lines:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+class DedupeWindow:
+    """The last `size` keys seen for one device."""
+
+    def __init__(self, size: int = DEDUPE_WINDOW):
+        self.size = size
+        self._seen: OrderedDict[Any, None] = OrderedDict()
+
+    def add(self, key) -> bool:
+        """True the first time `key` is seen."""
+
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return True
+
+
+def dedupe_key(record: tuple):
+    # serialNo is unique per terminal; events without one fall back to
+    # what identifies the mark itself.
+    employee_no, when, _, minor, serial_no = record
+    return serial_no or (employee_no, when.isoformat(), minor)
+
+
+class AlertStream:
+    """One device's alertStream.
+
+    Events are deduplicated through a `DedupeWindow`, so the overlap between
+    a resumed search and the new stream is reported once. A serialNo lower
+    than the last one on a newer event means the terminal's event log was
+    cleared and its serials restarted, which empties the window.
+    `on_event(stream, record)` runs on the event loop and must not block.
+    """
+
+    def __init__(
+        self,
+        client: IsapiClient,
+        on_event: Callable[[AlertStream, tuple], None],
+        *,
+        spool_dir: str | None = None,
+        idle_timeout_s: float = IDLE_TIMEOUT_S,
+        resume: bool = True,
+        serial: str | None = None,
+        model: str | None = None,
+        name: str | None = None,
+    ):
+        self.client = client
+        self.on_event = on_event
+        self.spool_dir = spool_dir
+        self.idle_timeout_s = idle_timeout_s
+        self.resume = resume
+        self.serial = serial
+        self.model = model
+        self.name = name
+
+        self.last_serial_no = 0
+        self.last_time: datetime.datetime | None = None
+        self._seen = DedupeWindow()
+        self.connected = False
+        self._closed = False
+        self.stats = {
+            "events": 0,
+            "resumed": 0,
+            "duplicates": 0,
+            "other": 0,
+            "images": 0,
+            "reconnects": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any], on_event, **kwargs) -> AlertStream:
+        client = IsapiClient.from_config(config, pool_size=1)
+        return cls(client, on_event, name=config.get("name") or None, **kwargs)
+
+    def close(self) -> None:
+        self._closed = True
+        self.client.close()
+
+    async def run(self) -> None:
+        delay = RECONNECT_MIN_S
+        while not self._closed:
+            try:
+                if self.serial is None:
+                    await self._identify()
+                if self.resume and self.last_time is not None:
+                    await self._resume()
+                await self._stream()
+            except (
+                OSError,
+                asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,
+                asyncio.TimeoutError,
+                IsapiError,
+                MultipartError,
+            ) as e:
+                logger.warning("alertStream from %s dropped: %s", self.client.host, e)
+            if self.connected:
+                delay = RECONNECT_MIN_S
+            self.connected = False
+            if self._closed:
+                return
+
+            self.stats["reconnects"] += 1
+            # Jitter keeps a site full of terminals from reconnecting in step.
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, RECONNECT_MAX_S)
+
+    async def _identify(self) -> None:
+        session = IsapiSession(client=self.client)
+        metadata = await asyncio.to_thread(session.get_device_metadata)
+        self.serial = metadata["serial"]
+        self.model = self.model or metadata["model"]
+        self.name = self.name or metadata["name"]
+        if not self.serial:
+            raise IsapiError(f"{self.client.host} did not report a serial number")
+
+    async def _resume(self) -> None:
+        start = self.last_time
+        end = datetime.datetime.now(start.tzinfo) + datetime.timedelta(days=1)
+
+        def fetch() -> list[tuple]:
+            return [
+                event
+                for page in self.client.acs_event_pages(start, end)
+                for info in page
+                if (event := event_from_info(info)) is not None
+            ]
+
+        events = await asyncio.to_thread(fetch)
+        for event in events:
+            if self._emit(event):
+                self.stats["resumed"] += 1
+
+    def _emit(self, record: tuple) -> bool:
+        when, serial_no = record[1], record[4]
+        if (
+            serial_no
+            and serial_no < self.last_serial_no
+            and self.last_time is not None
+            and when.timestamp() > self.last_time.timestamp()
+        ):
+            logger.info(
+                "%s restarted its event serials (%s after %s)",
+                self.serial,
+                serial_no,
+                self.last_serial_no,
+            )
+            self._seen = DedupeWindow()
+            self.last_serial_no = 0
+        if not self._seen.add(dedupe_key(record)):
+            self.stats["duplicates"] += 1
+            return False
+        self.last_serial_no = max(self.last_serial_no, serial_no)
+        self.last_time = when
+        self.stats["events"] += 1
+        self.on_event(self, record)
+        return True
+
+    def _on_part(self, headers: dict[str, str], body: bytes) -> None:
+        alert = parse_alert(headers, body)
+        record = event_from_alert(alert) if alert is not None else None
+        if record is None:
+            self.stats["other"] += 1
+            return
+        self._emit(record)
+
+    def _open_part(self, headers: dict[str, str]) -> PartSink:
+        content_type = headers.get("content-type", "").lower()
+        if not content_type.startswith("image/"):
+            return CollectSink(headers, self._on_part)
+
+        self.stats["images"] += 1
+        if self.spool_dir is None:
+            return DISCARD
+        # Snapshots follow the event they belong to.
+        path = os.path.join(
+            self.spool_dir,
+            f"{self.serial}_{self.last_serial_no}_{self.stats['images']}.jpg",
+        )
+        return SpoolSink(path)
+
+    async def _connect(self):
+        context = ssl.create_default_context() if self.client.https else None
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.client.host, self.client.port, ssl=context),
+            self.client.timeout,
+        )
+
+    async def _request(self):
+        answered = False
+        for _ in range(2):
+            reader, writer = await self._connect()
+            lines = [
+                f"GET {ALERT_STREAM_PATH} HTTP/1.1",
+                f"Host: {self.client.host}:{self.client.port}",
+                "Accept: multipart/mixed",
+            ]
+            if authorization := self.client.auth.header("GET", ALERT_STREAM_PATH):
+                lines.append(f"Authorization: {authorization}")
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            await writer.drain()
+
+            status, headers = await asyncio.wait_for(
+                _read_head(reader), self.client.timeout
+            )
+            if status == 401:
+                writer.close()
+                # After a reboot the device no longer knows our nonce: answer
+                # its fresh challenge once, as `IsapiClient.request` does.
+                challenge = headers.get("www-authenticate", "")
+                if not answered and self.client.auth.challenge(challenge):
+                    answered = True
+                    continue
+                self.client.auth.reset()
+                raise IsapiError("Authentication failed", status)
+            if status >= 400:
+                writer.close()
+                raise IsapiError(f"GET {ALERT_STREAM_PATH} returned {status}", status)
+            return reader, writer, headers
+
+        raise IsapiError("Authentication failed", 401)
+
+    async def _stream(self) -> None:
+        reader, writer, headers = await self._request()
+        parser = None
+        try:
+            boundary = multipart_boundary(headers.get("content-type", ""))
+            if boundary is None:
+                raise IsapiError(
+                    f"alertStream is not multipart: {headers.get('content-type')!r}"
+                )
+            parser = MultipartParser(boundary, self._open_part)
+            self.connected = True
+            logger.info("alertStream from %s (%s) open", self.client.host, self.serial)
+
+            async for data in iter_body(reader, headers, self.idle_timeout_s):
+                parser.feed(data)
+                if parser.finished or self._closed:
+                    return
+        finally:
+            if parser is not None:
+                parser.close()
+            writer.close()
+
+
+class AlertStreamHub:
+    """alertStreams of many devices on one event loop, batched for upload."""
+
+    def __init__(
+        self,
+        uploader: BatchUploader,
+        devices: list[dict[str, Any]],
+        *,
+        spool_dir: str | None = None,
+        **batcher_options,
+    ):
+        self.batcher = EventBatcher(uploader, **batcher_options)
+        self.streams = [
+            AlertStream.from_config(device, self._on_event, spool_dir=spool_dir)
+            for device in devices
+        ]
+
+    def _on_event(self, stream: AlertStream, record: tuple) -> None:
+        self.batcher.add(stream.serial, record, model=stream.model, name=stream.name)
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.batcher.stats,
+            "connected": sum(stream.connected for stream in self.streams),
+            "devices": {
+                stream.serial or stream.client.host: stream.stats
+                for stream in self.streams
+            },
+        }
+
+    async def run(self) -> None:
+        self.batcher.start()
+        try:
+            await asyncio.gather(*(stream.run() for stream in self.streams))
+        finally:
+            for stream in self.streams:
+                stream.close()
+            await asyncio.to_thread(self.batcher.stop)
@@ -0,0 +1,101 @@
+"""HTTP digest authentication (RFC 7616) as used by Hikvision terminals."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+
+_PARAM = re.compile(r'(\w+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^\s,]+))')
+
+_ALGORITHMS = {
+    "MD5": hashlib.md5,
+    "SHA-256": hashlib.sha256,
+}
+
+
+def parse_challenge(header: str) -> dict[str, str] | None:
+    scheme, _, params = header.strip().partition(" ")
+    if scheme.lower() != "digest":
+        return None
+    return {
+        m.group(1).lower(): m.group(2) if m.group(2) is not None else m.group(3)
+        for m in _PARAM.finditer(params)
+    }
+
+
+class DigestAuth:
+    """Answers a challenge once, then signs later requests preemptively.
+
+    The nonce count increases per request so one challenge serves a whole
+    keep-alive session. A later challenge replaces the nonce; `reset` drops
+    it once the device has rejected an answer to a fresh one.
+    """
+
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self._challenge: dict[str, str] | None = None
+        self._nc = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._challenge is not None
+
+    def challenge(self, header: str) -> bool:
+        params = parse_challenge(header)
+        if not params or "nonce" not in params:
+            return False
+        if params.get("algorithm", "MD5").upper() not in _ALGORITHMS:
+            return False
+        with self._lock:
+            self._challenge = params
+            self._nc = 0
+        return True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._challenge = None
+            self._nc = 0
+
+    def header(self, method: str, uri: str) -> str | None:
+        with self._lock:
+            if self._challenge is None:
+                return None
+            params = self._challenge
+            self._nc += 1
+            nc = f"{self._nc:08x}"
+
+        algorithm = params.get("algorithm", "MD5").upper()
+        h = _ALGORITHMS[algorithm]
+
+        def digest(value: str) -> str:
+            return h(value.encode("utf-8")).hexdigest()
+
+        realm, nonce = params.get("realm", ""), params["nonce"]
+        ha1 = digest(f"{self.username}:{realm}:{self.password}")
+        ha2 = digest(f"{method}:{uri}")
+
+        qops = [q.strip() for q in params.get("qop", "").split(",") if q.strip()]
+        fields = {
+            "username": self.username,
+            "realm": realm,
+            "nonce": nonce,
+            "uri": uri,
+            "algorithm": algorithm,
+        }
+        if "auth" in qops:
+            cnonce = os.urandom(8).hex()
+            fields["response"] = digest(f"{ha1}:{nonce}:{nc}:{cnonce}:auth:{ha2}")
+            fields.update(qop="auth", nc=nc, cnonce=cnonce)
+        else:
+            fields["response"] = digest(f"{ha1}:{nonce}:{ha2}")
+        if "opaque" in params:
+            fields["opaque"] = params["opaque"]
+
+        unquoted = {"algorithm", "qop", "nc"}
+        return "Digest " + ", ".join(
+            f"{k}={v}" if k in unquoted else f'{k}="{v}"' for k, v in fields.items()
+        )
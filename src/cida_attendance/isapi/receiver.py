@@ -0,0 +1,333 @@
+"""Receive ISAPI event notifications POSTed by terminals (`httpHosts`).
+
+Terminals configured with an HTTP host send every event as a request of its
+own: a JSON or XML `EventNotificationAlert`, or multipart form data carrying
+the alert plus a snapshot. `NotificationReceiver` runs a small keep-alive
+HTTP server on its own event loop thread, answers each request as soon as
+its alerts are queued (snapshots are discarded while reading) and leaves the
+rest to a consumer task: events are de-duplicated per device, since a
+terminal retries until it sees a 200, and batched for upload by an
+`EventBatcher`. A full queue, or a batcher holding as many records as it
+may while uploads fail, answers 503 so the terminal retries later instead of
+the receiver growing without bound.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from logging import getLogger
+from typing import Any
+
+from cida_attendance.core.device_cache import device_key
+from cida_attendance.core.listener import EventBatcher
+from cida_attendance.core.uploader import BatchUploader
+from cida_attendance.isapi.alertstream import (
+    DISCARD,
+    CollectSink,
+    DedupeWindow,
+    MultipartError,
+    MultipartParser,
+    dedupe_key,
+    event_from_alert,
+    iter_body,
+    multipart_boundary,
+    parse_alert,
+)
+from cida_attendance.isapi.client import IsapiClient, IsapiError
+from cida_attendance.isapi.session import IsapiSession
+
+logger = getLogger(__name__)
+
+RECEIVER_PORT = 8080
+QUEUE_SIZE = 10_000
+MAX_HEAD_BYTES = 16 * 1024
+MAX_BODY_BYTES = 8 * 1024 * 1024
+IDLE_TIMEOUT_S = 60.0
+
+_RESPONSES = {
+    (status, keep_alive): (
+        f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n"
+        + ("" if keep_alive else "Connection: close\r\n")
+        + "\r\n"
+    ).encode("ascii")
+    for status, reason in [
+        (200, "OK"),
+        (400, "Bad Request"),
+        (413, "Payload Too Large"),
+        (503, "Service Unavailable"),
+    ]
+    for keep_alive in (True, False)
+}
+
+
+def _parse_head(head: bytes) -> tuple[str, str, dict[str, str], bool]:
+    request_line, *lines = head.decode("latin-1").split("\r\n")
+    method, path, version = request_line.split(" ", 2)
+    headers = {}
+    for line in lines:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    connection = headers.get("connection", "").lower()
+    if version.strip() == "HTTP/1.0":
+        keep_alive = connection == "keep-alive"
+    else:
+        keep_alive = connection != "close"
+    return method, path, headers, keep_alive
+
+
+class NotificationReceiver:
+    def __init__(
+        self,
+        uploader: BatchUploader,
+        devices: list[dict[str, Any]],
+        *,
+        host: str = "0.0.0.0",
+        port: int = RECEIVER_PORT,
+        queue_size: int = QUEUE_SIZE,
+        **batcher_options,
+    ):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.batcher = EventBatcher(uploader, **batcher_options)
+        self._devices = {config["ip"]: config for config in devices}
+
+        self._identities: dict[str, tuple[str, str | None, str | None]] = {}
+        self._identifying: dict[str, asyncio.Future] = {}
+        self._dedupe: dict[str, DedupeWindow] = {}
+        self.stats = {
+            "requests": 0,
+            "events": 0,
+            "duplicates": 0,
+            "other": 0,
+            "unknown": 0,
+            "rejected": 0,
+            "errors": 0,
+        }
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._stopping: asyncio.Event | None = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._error: BaseException | None = None
+
+    def start(self) -> None:
+        self._ready.clear()
+        self._error = None
+        self.batcher.start()
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self._main(),), name="isapi-receiver", daemon=True
+        )
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            self._thread.join()
+            self.batcher.stop()
+            raise self._error
+        logger.info("Receiving ISAPI notifications on %s:%d", self.host, self.port)
+
+    def stop(self) -> None:
+        """Stop accepting, hand what is queued to the batcher and flush it."""
+
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join()
+        self._thread = None
+        self.batcher.stop()
+
+    def __enter__(self) -> NotificationReceiver:
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    async def _main(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(
+                self._handle, self.host, self.port, limit=MAX_HEAD_BYTES
+            )
+        except OSError as e:
+            self._error = e
+            self._ready.set()
+            return
+
+        self.port = server.sockets[0].getsockname()[1]
+        consumer = asyncio.create_task(self._consume())
+        self._ready.set()
+        async with server:
+            await self._stopping.wait()
+        await self._queue.join()
+        consumer.cancel()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        peer = (writer.get_extra_info("peername") or ("",))[0]
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT_S
+                    )
+                    method, _, headers, keep_alive = _parse_head(head)
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.TimeoutError,
+                    ConnectionError,
+                ):
+                    return
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(_RESPONSES[400, False])
+                    return
+
+                self.stats["requests"] += 1
+                if headers.get("expect", "").lower() == "100-continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+                try:
+                    alerts = await self._read_alerts(reader, headers)
+                except ValueError as e:
+                    # MultipartError included; the body was not consumed.
+                    self.stats["errors"] += 1
+                    logger.debug("Rejected notification from %s: %s", peer, e)
+                    status = 413 if "too large" in str(e) else 400
+                    writer.write(_RESPONSES[status, False])
+                    return
+
+                status = await self._enqueue(peer, alerts)
+                writer.write(_RESPONSES[status, keep_alive])
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    async def _read_alerts(
+        self, reader: asyncio.StreamReader, headers: dict[str, str]
+    ) -> list[dict[str, Any]]:
+        alerts: list[dict[str, Any]] = []
+
+        def on_part(part_headers: dict[str, str], body: bytes) -> None:
+            if (alert := parse_alert(part_headers, body)) is not None:
+                alerts.append(alert)
+
+        content_type = headers.get("content-type", "")
+        boundary = multipart_boundary(content_type)
+        if boundary is not None:
+
+            def open_part(part_headers: dict[str, str]):
+                if part_headers.get("content-type", "").lower().startswith("image/"):
+                    return DISCARD
+                return CollectSink(part_headers, on_part)
+
+            sink = MultipartParser(boundary, open_part)
+        else:
+            sink = CollectSink({"content-type": content_type}, on_part)
+
+        size = 0
+        body = iter_body(reader, headers, IDLE_TIMEOUT_S, request=True)
+        async for data in body:
+            size += len(data)
+            if size > MAX_BODY_BYTES:
+                raise MultipartError(f"Notification body too large ({size} bytes)")
+            if boundary is not None:
+                sink.feed(data)
+            else:
+                sink.write(memoryview(data))
+
+        if boundary is not None:
+            sink.close()
+        else:
+            sink.close(True)
+        return alerts
+
+    async def _enqueue(self, peer: str, alerts: list[dict[str, Any]]) -> int:
+        for alert in alerts:
+            ip = peer if peer in self._devices else alert.get("ipAddress") or peer
+            if ip not in self._devices:
+                self.stats["unknown"] += 1
+                continue
+            if ip not in self._identities and not await self._identify(ip):
+                # Not acknowledged: the terminal sends it again later.
+                return 503
+            if self._queue.qsize() + self.batcher.pending >= self.batcher.max_pending:
+                self.stats["rejected"] += 1
+                return 503
+            try:
+                self._queue.put_nowait((ip, alert))
+            except asyncio.QueueFull:
+                self.stats["rejected"] += 1
+                return 503
+        return 200
+
+    async def _identify(self, ip: str) -> bool:
+        pending = self._identifying.get(ip)
+        if pending is None:
+            pending = self._identifying[ip] = asyncio.ensure_future(
+                asyncio.to_thread(self._lookup, self._devices[ip])
+            )
+            pending.add_done_callback(lambda _: self._identifying.pop(ip, None))
+        try:
+            self._identities[ip] = await asyncio.shield(pending)
+        except (IsapiError, OSError, KeyError) as e:
+            logger.warning("Could not identify the terminal at %s: %s", ip, e)
+            return False
+        return True
+
+    def _lookup(self, config: dict[str, Any]) -> tuple[str, str | None, str | None]:
+        # Shares the metadata cache with `synchronize`, so a terminal that was
+        # synced recently costs no request at all.
+        client = IsapiClient.from_config(config, pool_size=1)
+        try:
+            metadata = self.batcher.cache.get_metadata(
+                device_key(config), IsapiSession(client=client)
+            )
+        finally:
+            client.close()
+        if not metadata.get("serial"):
+            raise KeyError("serial")
+        return (
+            metadata["serial"],
+            metadata.get("model"),
+            config.get("name") or metadata.get("name"),
+        )
+
+    async def _consume(self) -> None:
+        while True:
+            ip, alert = await self._queue.get()
+            try:
+                self._process(ip, alert)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(
+                    "Failed to process a notification from %s: %s", ip, e, exc_info=e
+                )
+            finally:
+                self._queue.task_done()
+
+    def _process(self, ip: str, alert: dict[str, Any]) -> None:
+        record = event_from_alert(alert)
+        if record is None:
+            self.stats["other"] += 1
+            return
+
+        serial, model, name = self._identities[ip]
+        window = self._dedupe.get(serial)
+        if window is None:
+            window = self._dedupe[serial] = DedupeWindow()
+        if not window.add(dedupe_key(record)):
+            self.stats["duplicates"] += 1
+            return
+
+        self.stats["events"] += 1
+        self.batcher.add(serial, record, model=model, name=name)
@@ -0,0 +1,126 @@
+"""Device session over ISAPI, with the surface `synchronize` uses from the SDK
+`Session` (login, metadata, capabilities, device time, ACS events)."""
+
+from __future__ import annotations
+
+import datetime
+from logging import getLogger
+from typing import Any, Iterator
+
+from cida_attendance.isapi.client import IsapiClient, IsapiError
+from cida_attendance.sdk.xmlstream import find_xml_values, iter_xml_records
+
+logger = getLogger(__name__)
+
+# ISAPI reports attendanceStatus as a name; the SDK as byAttendanceStatus.
+ATTENDANCE_STATUS = {
+    "undefined": 0,
+    "checkIn": 1,
+    "checkOut": 2,
+    "breakOut": 3,
+    "breakIn": 4,
+    "overtimeIn": 5,
+    "overtimeOut": 6,
+}
+
+
+def event_from_info(info: dict[str, Any]) -> tuple | None:
+    """(employee_no, when, event_type, event_minor, serial_no) of an
+    `InfoList` entry, or None when it does not name an employee."""
+
+    employee_no = info.get("employeeNoString") or str(info.get("employeeNo") or "")
+    if not employee_no or not info.get("time"):
+        return None
+    return (
+        employee_no,
+        datetime.datetime.fromisoformat(info["time"]),
+        ATTENDANCE_STATUS.get(info.get("attendanceStatus"), 0),
+        int(info.get("minor") or 0),
+        int(info.get("serialNo") or 0),
+    )
+
+
+class IsapiSession:
+    def __init__(self, capture=None, client: IsapiClient | None = None):
+        self.client = client
+        self.serial_number: str | None = None
+        self.capture = capture
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.logout()
+
+    def login(self, **config) -> bool:
+        self.client = IsapiClient.from_config(config)
+        try:
+            self.serial_number = self.get_device_metadata()["serial"]
+        except IsapiError as e:
+            logger.error("ISAPI login to %s failed: %s", config["ip"], e)
+            self.logout()
+            return False
+        return True
+
+    def logout(self) -> bool:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        return True
+
+    def get_device_metadata(self) -> dict[str, str | None]:
+        values = find_xml_values(
+            self.client.get("/ISAPI/System/deviceInfo"),
+            ["model", "serialNumber", "firmwareVersion", "deviceName"],
+        )
+        return {
+            "model": values.get("model"),
+            "serial": values.get("serialNumber"),
+            "firmware": values.get("firmwareVersion"),
+            "name": values.get("deviceName"),
+        }
+
+    def get_capabilities(self) -> dict[str, bool]:
+        capabilities: dict[str, bool] = {}
+        xml = self.client.get("/ISAPI/AccessControl/capabilities")
+        for record in iter_xml_records(xml, "AccessControl"):
+            for name, value in record.items():
+                if name.startswith("isSupport"):
+                    capabilities[name] = (value or "").strip() == "true"
+        return capabilities
+
+    def get_device_time(self):
+        from cida_attendance.sdk.session import parse_isapi_timezone
+
+        values = find_xml_values(
+            self.client.get("/ISAPI/System/time"), ["localTime", "timeZone"]
+        )
+        tz = parse_isapi_timezone(values.get("timeZone"))
+        local_time = datetime.datetime.fromisoformat(values["localTime"])
+        return local_time.replace(tzinfo=tz), tz
+
+    def iter_acs_events(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        *,
+        major: int = 0x5,
+        minor: int = 0,
+    ) -> Iterator[tuple]:
+        for page in self.client.acs_event_pages(start, end, major=major, minor=minor):
+            for info in page:
+                if (event := event_from_info(info)) is not None:
+                    yield event
+
+    def iter_users(self) -> Iterator[dict[str, Any]]:
+        for page in self.client.user_info_pages():
+            yield from page
+
+    def iter_cards(self) -> Iterator[dict[str, Any]]:
+        for page in self.client.card_info_pages():
+            for info in page:
+                yield {
+                    "cardNo": info.get("cardNo"),
+                    "employeeNo": info.get("employeeNo"),
+                    "cardType": info.get("cardType"),
+                }
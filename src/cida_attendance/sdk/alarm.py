@@ -0,0 +1,153 @@
+"""Process-wide alarm callback with per-device routing.
+
+NET_DVR_SetDVRMessageCallBack_V50 holds one callback per index for the whole
+process, so a session installing its own handler replaces every other
+session's. `AlarmDispatcher` installs a single `MSGCallBack` and routes each
+alarm by `pAlarmer.lUserID` (armed sessions) or by serial number (devices
+pushing to a listener) to the handler registered for that device. The same
+callback serves NET_DVR_StartListen_V30, so pushed and armed alarms share
+one routing table. NET_DVR_Cleanup drops the installed callback, so the
+dispatcher forgets it on cleanup and the next `install` sets it again.
+"""
+
+from __future__ import annotations
+
+import threading
+from logging import getLogger
+from typing import Any, Callable
+
+from cida_attendance import sdk
+from cida_attendance.sdk.bindings import add_cleanup_hook, get_last_error
+
+logger = getLogger(__name__)
+
+# Same signature as the SDK callback:
+# (lCommand, pAlarmer, pAlarmInfo, dwBufLen, pUser) -> None
+AlarmHandler = Callable[[int, Any, Any, int, Any], None]
+
+
+def alarmer_serial(alarmer) -> str | None:
+    if not alarmer.bySerialValid:
+        return None
+    return (
+        bytes(alarmer.sSerialNumber)
+        .split(b"\x00", 1)[0]
+        .decode("ascii", errors="ignore")
+        or None
+    )
+
+
+class AlarmDispatcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user: dict[int, AlarmHandler] = {}
+        self._by_serial: dict[str, AlarmHandler] = {}
+        self._fallback: AlarmHandler | None = None
+        self._installed: set[int] = set()
+        self._callback = None
+        self.unrouted = 0
+
+    def _get_callback(self):
+        if self._callback is None:
+            # Referenced for the life of the process: the SDK keeps calling it.
+            self._callback = sdk.MSGCallBack(self._dispatch)
+        return self._callback
+
+    def install(self, callback_index: int = 0) -> None:
+        with self._lock:
+            if callback_index in self._installed:
+                return
+            self._get_callback()
+            if not sdk.NET_DVR_SetDVRMessageCallBack_V50(
+                int(callback_index), self._callback, None
+            ):
+                code, msg = get_last_error()
+                raise RuntimeError(
+                    f"NET_DVR_SetDVRMessageCallBack_V50 falló: {code} {msg}"
+                )
+            self._installed.add(callback_index)
+
+    def _forget_installed(self) -> None:
+        with self._lock:
+            self._installed.clear()
+
+    def start_listen(self, host: str = "0.0.0.0", port: int = 7200) -> int:
+        """Accept alarms pushed by devices configured to report to host:port."""
+
+        with self._lock:
+            callback = self._get_callback()
+        handle = sdk.NET_DVR_StartListen_V30(
+            host.encode("ascii"), int(port), callback, None
+        )
+        if handle < 0:
+            code, msg = get_last_error()
+            raise RuntimeError(f"NET_DVR_StartListen_V30 falló: {code} {msg}")
+        return int(handle)
+
+    def stop_listen(self, handle: int) -> None:
+        if not sdk.NET_DVR_StopListen_V30(int(handle)):
+            logger.warning("NET_DVR_StopListen_V30 falló: %s", get_last_error())
+
+    def register(
+        self,
+        handler: AlarmHandler,
+        *,
+        user_id: int | None = None,
+        serial: str | None = None,
+    ) -> None:
+        with self._lock:
+            if user_id is not None:
+                self._by_user[int(user_id)] = handler
+            if serial:
+                self._by_serial[serial] = handler
+
+    def unregister(
+        self, *, user_id: int | None = None, serial: str | None = None
+    ) -> None:
+        with self._lock:
+            if user_id is not None:
+                self._by_user.pop(int(user_id), None)
+            if serial:
+                self._by_serial.pop(serial, None)
+
+    def set_fallback(self, handler: AlarmHandler | None) -> None:
+        """Handler for alarms from devices nobody registered for."""
+
+        with self._lock:
+            self._fallback = handler
+
+    def route(self, alarmer) -> AlarmHandler | None:
+        # Plain dict reads: safe against concurrent register/unregister.
+        handler = None
+        if alarmer is not None:
+            if alarmer.byUserIDValid:
+                handler = self._by_user.get(int(alarmer.lUserID))
+            if handler is None and (serial := alarmer_serial(alarmer)):
+                handler = self._by_serial.get(serial)
+        return handler or self._fallback
+
+    def _dispatch(self, lCommand, pAlarmer, pAlarmInfo, dwBufLen, pUser) -> None:
+        try:
+            handler = self.route(pAlarmer.contents if pAlarmer else None)
+            if handler is None:
+                self.unrouted += 1
+                logger.debug(
+                    "Dropping alarm 0x%x from an unregistered device", int(lCommand)
+                )
+                return
+            handler(lCommand, pAlarmer, pAlarmInfo, dwBufLen, pUser)
+        except Exception:
+            logger.exception("Error procesando callback de alarma/evento")
+
+
+_dispatcher: AlarmDispatcher | None = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_alarm_dispatcher() -> AlarmDispatcher:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = AlarmDispatcher()
+            add_cleanup_hook(_dispatcher._forget_installed)
+        return _dispatcher
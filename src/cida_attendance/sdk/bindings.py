@@ -11,15 +11,18 @@ from __future__ import annotations
 
 import ctypes
 import datetime
+import os
 import platform
 import sys
-import os
 import threading
-import time
+from logging import getLogger
 from pathlib import Path
 from typing import Callable
 
 from cida_attendance import sdk
+from cida_attendance.sdk.capture import CaptureReader, CaptureWriter
+
+logger = getLogger(__name__)
 
 MAX_LEN_XML = 10 * 1024 * 1024
 XML_ABILITY_IN_LEN = 1024
@@ -37,7 +40,9 @@ def get_sdk_version():
         return {
             "version": version,
             "build": build,
-            "version_string": f"{version >> 24}.{(version >> 16) & 0xFF}.{(version >> 8) & 0xFF}.{version & 0xFF}",
+            "version_string": ".".join(
+                str((version >> shift) & 0xFF) for shift in (24, 16, 8, 0)
+            ),
             "build_string": f"{build}",
         }
     except Exception as e:
@@ -96,7 +101,54 @@ def _configure_sdk_runtime_paths(libs_dir: Path) -> None:
         if com_dir.exists():
             _prepend_env_path("LD_LIBRARY_PATH", com_dir)
 
+
+# NET_DVR_Init/NET_DVR_Cleanup are process-wide: sessions, listeners and the
+# async login share one initialization and the last user cleans up. User ids
+# and callback registrations do not survive a cleanup, so each initialization
+# gets a generation number and modules holding SDK state register a hook that
+# runs right before NET_DVR_Cleanup.
+_init_lock = threading.Lock()
+_init_refs = 0
+_generation = 0
+_cleanup_hooks: list[Callable[[], None]] = []
+
+
+def sdk_generation() -> int:
+    return _generation
+
+
+def add_cleanup_hook(hook: Callable[[], None]) -> None:
+    if hook not in _cleanup_hooks:
+        _cleanup_hooks.append(hook)
+
+
 def init_dll():
+    global _init_refs, _generation
+
+    with _init_lock:
+        if _init_refs == 0:
+            _init_sdk()
+            _generation += 1
+        _init_refs += 1
+
+
+def cleanup_dll():
+    global _init_refs
+
+    with _init_lock:
+        if _init_refs == 0:
+            return
+        _init_refs -= 1
+        if _init_refs == 0:
+            for hook in _cleanup_hooks:
+                try:
+                    hook()
+                except Exception:
+                    logger.exception("Error en hook de limpieza del SDK")
+            sdk.NET_DVR_Cleanup()
+
+
+def _init_sdk():
     # Detect libs directory
     libs_dir = None
     if getattr(sys, "frozen", False):
@@ -130,9 +182,13 @@ def init_dll():
         libcrypto = libs_dir / "libcrypto.so.1.1"
         libssl = libs_dir / "libssl.so.1.1"
         if libcrypto.exists():
-            _set_sdk_init_cfg_path(getattr(sdk, "NET_SDK_INIT_CFG_LIBEAY_PATH", 3), libcrypto)
+            _set_sdk_init_cfg_path(
+                getattr(sdk, "NET_SDK_INIT_CFG_LIBEAY_PATH", 3), libcrypto
+            )
         if libssl.exists():
-            _set_sdk_init_cfg_path(getattr(sdk, "NET_SDK_INIT_CFG_SSLEAY_PATH", 4), libssl)
+            _set_sdk_init_cfg_path(
+                getattr(sdk, "NET_SDK_INIT_CFG_SSLEAY_PATH", 4), libssl
+            )
 
     # Initialize SDK
     sdk.NET_DVR_Init()
@@ -140,10 +196,6 @@ def init_dll():
     sdk.NET_DVR_SetReconnect(10000, True)
 
 
-def cleanup_dll():
-    sdk.NET_DVR_Cleanup()
-
-
 def get_last_error(show_msg: bool = True) -> tuple[int, str | None]:
     error = sdk.NET_DVR_GetLastError()
     if not show_msg:
@@ -199,6 +251,32 @@ def build_net_dvr_xml_config_input(
     return out_buf.value
 
 
+def _drain_remote_config(
+    stream, on_status: Callable = None, on_data: Callable = None
+) -> None:
+    from cida_attendance.sdk.remote_config import (
+        RemoteConfigError,
+        RemoteConfigTimeout,
+    )
+
+    try:
+        for record in stream:
+            if on_data:
+                on_data(record)
+    except RemoteConfigTimeout:
+        return
+    except RemoteConfigError as e:
+        if on_status:
+            on_status(e.status, e.error)
+        return
+    finally:
+        stream.close()
+
+    # Only a status the device actually sent; a cancelled stream reports none.
+    if on_status and stream.status is not None:
+        on_status(stream.status, stream.stats["error"])
+
+
 def build_net_dvr_remoteconfig(
     user_id: int,
     command: int,
@@ -208,81 +286,74 @@ def build_net_dvr_remoteconfig(
     on_data: Callable = None,
     data_cls: ctypes.Structure = None,
     timeout_s: float | None = None,
+    capture: CaptureWriter | None = None,
 ):
-    _event = threading.Event()
-    callback_error: list[BaseException] = []
-
-    @sdk.fRemoteConfigCallback
-    def remote_config_callback(dwType, lpBuffer, dwBufLen, pUserData):
-        try:
-            if dwType == sdk.NET_SDK_CALLBACK_TYPE_STATUS:
-                buffer = ctypes.string_at(lpBuffer, dwBufLen)
-
-                if dwBufLen == 4:
-                    status = int.from_bytes(buffer[:4], "little", signed=False)
-                    if on_status:
-                        on_status(status, None)
-                elif dwBufLen == 8:
-                    status = int.from_bytes(buffer[:4], "little", signed=False)
-                    error = int.from_bytes(buffer[4:8], "little", signed=False)
-                    if on_status:
-                        on_status(status, error)
-
-                _event.set()
-                return
-
-            if dwType == sdk.NET_SDK_CALLBACK_TYPE_PROGRESS:
-                if on_progress:
-                    on_progress()
-                return
-
-            if dwType == sdk.NET_SDK_CALLBACK_TYPE_DATA:
-                if on_data:
-                    if data_cls:
-                        detail = ctypes.cast(lpBuffer, ctypes.POINTER(data_cls))
-                        on_data(detail.contents)
-                    else:
-                        on_data((lpBuffer, dwBufLen))
-        except BaseException as e:
-            callback_error.append(e)
-            _event.set()
-            return
+    """Callback front end for `RemoteConfigStream`.
+
+    `on_data` runs on the calling thread with a copy of each record. The final
+    status is reported once to `on_status` rather than raised. `timeout_s` is
+    an idle timeout: a download of any length completes as long as the device
+    keeps sending, and `timeout_s` of silence ends the command quietly.
+    """
+
+    from cida_attendance.sdk.remote_config import RemoteConfigStream
 
-    res = sdk.NET_DVR_StartRemoteConfig(
+    stream = RemoteConfigStream(
         user_id,
         command,
-        ctypes.byref(cond),
-        ctypes.sizeof(cond),
-        remote_config_callback,
-        None,
+        cond,
+        record_cls=data_cls,
+        timeout_s=timeout_s,
+        on_progress=on_progress,
+        capture=capture,
     )
+    _drain_remote_config(stream.start(), on_status, on_data)
 
-    if res < 0:
-        raise SDKError(*get_last_error())
 
-    start = time.monotonic()
-    try:
-        while True:
-            if _event.wait(timeout=0.25):
-                break
-            if timeout_s is not None and (time.monotonic() - start) >= float(timeout_s):
-                break
-    finally:
-        sdk.NET_DVR_StopRemoteConfig(res)
+def replay_net_dvr_remoteconfig(
+    path: str | os.PathLike,
+    on_status: Callable = None,
+    on_progress: Callable = None,
+    on_data: Callable = None,
+    data_cls: ctypes.Structure = None,
+    speed: float | None = 1.0,
+) -> int:
+    """Feed a capture through `RemoteConfigStream`, like live SDK traffic, one
+    stream per captured command. Returns the number of callbacks replayed."""
 
-    if callback_error:
-        raise callback_error[0]
+    from cida_attendance.sdk.remote_config import RemoteConfigStream
 
-    return
+    count = 0
+    with CaptureReader(path) as reader:
+        records = iter(reader)
+        while True:
+            stream = RemoteConfigStream.replay(
+                records, speed=speed, record_cls=data_cls, on_progress=on_progress
+            )
+            _drain_remote_config(stream, on_status, on_data)
+            if not stream.stats.get("replayed"):
+                return count
+            count += stream.stats["replayed"]
 
 
-def build_net_dvr_user_login_info(device_address, username, password, port=8000):
+def build_net_dvr_user_login_info(
+    device_address, username, password, port=8000, login_callback=None, user_data=None
+):
+    """With `login_callback` (an `fLoginResultCallBack`) the login is
+    asynchronous: NET_DVR_Login_V40 returns at once and the callback reports
+    the result with `user_data` as pUser."""
+
     login_info = sdk.NET_DVR_USER_LOGIN_INFO()
     login_info.sDeviceAddress = device_address.ljust(
         sdk.NET_DVR_DEV_ADDRESS_MAX_LEN, b"\x00"
     )
     login_info.wPort = int(port)
-    login_info.bUseAsynLogin = 0
+    if login_callback is not None:
+        login_info.bUseAsynLogin = 1
+        login_info.cbLoginResult = login_callback
+        login_info.pUser = ctypes.c_void_p(user_data)
+    else:
+        login_info.bUseAsynLogin = 0
     login_info.sUserName = username.ljust(sdk.NET_DVR_LOGIN_USERNAME_MAX_LEN, b"\x00")
     login_info.sPassword = password.ljust(sdk.NET_DVR_LOGIN_PASSWD_MAX_LEN, b"\x00")
     return login_info
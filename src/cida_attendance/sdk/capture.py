@@ -0,0 +1,177 @@
+"""Record and replay of raw SDK callback streams.
+
+Capture files are append-only: an 8 byte magic followed by records of
+
+    kind (u8) | dw_type (u32) | timestamp (f64) | length (u32) | aux_length (u32)
+    | data (length bytes) | aux (aux_length bytes)
+
+`data` holds the callback buffer exactly as the SDK delivered it and `aux`
+holds any side structure needed to rebuild the call (e.g. `NET_DVR_ALARMER`).
+Alarm structs only hold pointers to their payload, so each buffer they point
+to is stored as a `KIND_ALARM_BUFFER` record (dw_type = offset of the pointer
+field) written together with, and right before, its `KIND_ALARM` record.
+Files are memory-mapped on read so replays do not copy the whole capture.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+MAGIC = b"CIDACAP1"
+
+KIND_REMOTE_CONFIG = 1
+KIND_ALARM = 2
+KIND_ALARM_BUFFER = 3
+
+_HEADER = struct.Struct("<BIdII")
+
+
+class CaptureError(Exception):
+    pass
+
+
+class CapturedCallback(NamedTuple):
+    kind: int
+    dw_type: int
+    timestamp: float
+    data: memoryview
+    aux: memoryview
+
+
+class CaptureWriter:
+    def __init__(self, path: str | os.PathLike):
+        self.path = os.fspath(path)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def write(self, kind: int, dw_type: int, data: bytes, aux: bytes = b"") -> None:
+        self.write_many([(kind, dw_type, data, aux)])
+
+    def write_many(self, records: Iterable[tuple[int, int, bytes, bytes]]) -> None:
+        """Write several records back to back, e.g. an alarm and its buffers."""
+
+        timestamp = time.time()
+        chunks = []
+        for kind, dw_type, data, aux in records:
+            chunks.append(
+                _HEADER.pack(
+                    int(kind), int(dw_type) & 0xFFFFFFFF, timestamp, len(data), len(aux)
+                )
+            )
+            chunks.append(data)
+            if aux:
+                chunks.append(aux)
+        # Called from SDK threads: a record must never interleave with another.
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.writelines(chunks)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CaptureReader:
+    def __init__(self, path: str | os.PathLike):
+        self.path = os.fspath(path)
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(MAGIC):
+            self._file.close()
+            raise CaptureError(f"Not a capture file: {self.path}")
+
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if self._view[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise CaptureError(f"Not a capture file: {self.path}")
+
+    def __iter__(self) -> Iterator[CapturedCallback]:
+        view = self._view
+        offset = len(MAGIC)
+        end = len(view)
+
+        while offset + _HEADER.size <= end:
+            kind, dw_type, timestamp, length, aux_length = _HEADER.unpack_from(
+                view, offset
+            )
+            offset += _HEADER.size
+            if offset + length + aux_length > end:
+                # Truncated trailing record (writer killed mid-record).
+                return
+
+            data = view[offset : offset + length]
+            offset += length
+            aux = view[offset : offset + aux_length]
+            offset += aux_length
+            yield CapturedCallback(kind, dw_type, timestamp, data, aux)
+
+    def close(self) -> None:
+        view = getattr(self, "_view", None)
+        if view is not None:
+            view.release()
+            self._view = None
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def replay(
+    records: Iterable[CapturedCallback],
+    handler: Callable[[CapturedCallback], None],
+    *,
+    kind: int | tuple[int, ...] | None = None,
+    speed: float | None = 1.0,
+    max_delay: float = 5.0,
+) -> int:
+    """Feed captured records to `handler`.
+
+    `speed=1.0` reproduces the original pacing, larger values replay faster
+    and `None`/`0` replays as fast as possible. Gaps between records are capped
+    at `max_delay` seconds so captures appended across runs stay usable.
+    """
+
+    kinds = (kind,) if isinstance(kind, int) else kind
+    count = 0
+    previous: float | None = None
+    for record in records:
+        if kinds is not None and record.kind not in kinds:
+            continue
+
+        if speed and previous is not None:
+            delay = min(max(record.timestamp - previous, 0.0), max_delay) / speed
+            if delay > 0:
+                time.sleep(delay)
+        previous = record.timestamp
+
+        handler(record)
+        count += 1
+
+    return count
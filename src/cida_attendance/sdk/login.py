@@ -0,0 +1,194 @@
+"""Concurrent asynchronous logins (`bUseAsynLogin`).
+
+A synchronous NET_DVR_Login_V40 blocks for the whole connect timeout on an
+unreachable terminal, so logging into a site one device at a time is as slow
+as its dead devices. `login_many` starts every login from the calling thread,
+lets the SDK report each result through one shared `fLoginResultCallBack`,
+and gives each login its own deadline.
+
+The SDK must stay initialized (`init_dll`) while the returned user ids are in
+use. Logins that succeed after their deadline are logged out when
+`login_many` finishes waiting or, if they arrive later, right before the SDK
+is cleaned up. The SDK reuses user ids after a re-init, so leftovers from an
+earlier initialization are dropped, never logged out.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import threading
+import time
+from logging import getLogger
+from typing import Callable, Iterable, NamedTuple
+
+from cida_attendance import sdk
+from cida_attendance.sdk.bindings import (
+    add_cleanup_hook,
+    build_net_dvr_user_login_info,
+    get_last_error,
+    sdk_generation,
+)
+
+logger = getLogger(__name__)
+
+LOGIN_TIMEOUT_S = 10.0
+LOGIN_SUCCESS = 1
+
+
+class LoginResult(NamedTuple):
+    config: dict
+    user_id: int
+    serial_number: str | None = None
+    error: tuple[int, str | None] | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.user_id >= 0
+
+
+class _Attempt:
+    __slots__ = ("index", "cond", "result")
+
+    def __init__(self, index: int, cond: threading.Condition):
+        self.index = index
+        self.cond = cond
+        self.result: tuple[int, str | None, tuple | None] | None = None
+
+
+_lock = threading.Lock()
+_attempts: dict[int, _Attempt] = {}
+# (SDK generation, user id) of logins that succeeded after their deadline.
+_orphans: list[tuple[int, int]] = []
+_next_token = 0
+_callback = None
+
+
+def _serial_from(device_info) -> str | None:
+    if not device_info:
+        return None
+    return (
+        bytes(device_info.contents.sSerialNumber)
+        .split(b"\x00", 1)[0]
+        .decode("ascii", errors="ignore")
+        or None
+    )
+
+
+def _on_login_result(lUserID, dwResult, lpDeviceInfo, pUser) -> None:
+    # Runs on an SDK thread: record the outcome and wake the waiter, nothing else.
+    try:
+        if dwResult == LOGIN_SUCCESS and lUserID >= 0:
+            result = (lUserID, _serial_from(lpDeviceInfo), None)
+        else:
+            result = (-1, None, get_last_error())
+    except BaseException as e:
+        result = (-1, None, (-1, str(e)))
+
+    with _lock:
+        attempt = _attempts.pop(pUser or 0, None)
+        if attempt is None:
+            if result[0] >= 0:
+                _orphans.append((sdk_generation(), result[0]))
+            return
+        attempt.result = result
+        attempt.cond.notify_all()
+
+
+def _logout_orphans() -> None:
+    with _lock:
+        orphans, _orphans[:] = list(_orphans), []
+    generation = sdk_generation()
+    for orphan_generation, user_id in orphans:
+        if orphan_generation == generation:
+            sdk.NET_DVR_Logout(user_id)
+
+
+add_cleanup_hook(_logout_orphans)
+
+
+def _get_callback():
+    global _callback
+    if _callback is None:
+        # Kept for the life of the process: late results may still arrive.
+        _callback = sdk.fLoginResultCallBack(_on_login_result)
+    return _callback
+
+
+def login_many(
+    configs: Iterable[dict],
+    timeout_s: float = LOGIN_TIMEOUT_S,
+    on_result: Callable[[LoginResult], None] | None = None,
+) -> list[LoginResult]:
+    """Log into every device at once; results keep the order of `configs`.
+
+    A config may carry its own `login_timeout_s`. `on_result` is called from
+    the calling thread as each login completes or times out.
+    """
+
+    global _next_token
+
+    configs = list(configs)
+    results: list[LoginResult | None] = [None] * len(configs)
+    cond = threading.Condition(_lock)
+    waiting: dict[int, tuple[_Attempt, float]] = {}
+    device_infos = []
+
+    def finish(index: int, user_id: int, serial: str | None, error) -> None:
+        results[index] = LoginResult(configs[index], user_id, serial, error)
+        if on_result is not None:
+            on_result(results[index])
+
+    for index, config in enumerate(configs):
+        with _lock:
+            _next_token += 1
+            token = _next_token
+            attempt = _attempts[token] = _Attempt(index, cond)
+
+        login_info = build_net_dvr_user_login_info(
+            config["ip"].encode("ascii"),
+            config["user"].encode("ascii"),
+            config["password"].encode("ascii"),
+            config["port"],
+            login_callback=_get_callback(),
+            user_data=token,
+        )
+        device_info = sdk.NET_DVR_DEVICEINFO_V40()
+        device_infos.append(device_info)
+
+        if (
+            sdk.NET_DVR_Login_V40(ctypes.byref(login_info), ctypes.byref(device_info))
+            < 0
+        ):
+            error = get_last_error()
+            with _lock:
+                _attempts.pop(token, None)
+            finish(index, -1, None, error)
+            continue
+
+        deadline = time.monotonic() + float(config.get("login_timeout_s", timeout_s))
+        waiting[token] = (attempt, deadline)
+
+    while waiting:
+        done = []
+        with cond:
+            now = time.monotonic()
+            for token, (attempt, deadline) in list(waiting.items()):
+                if attempt.result is not None:
+                    done.append((attempt.index, *attempt.result))
+                elif now >= deadline:
+                    _attempts.pop(token, None)
+                    done.append((attempt.index, -1, None, (-1, "Login timed out")))
+                else:
+                    continue
+                del waiting[token]
+
+            if not done and waiting:
+                cond.wait(max(0.0, min(d for _, d in waiting.values()) - now))
+
+        for index, user_id, serial, error in done:
+            if error is not None:
+                logger.error("Login to %s failed: %s", configs[index]["ip"], error)
+            finish(index, user_id, serial, error)
+
+    _logout_orphans()
+    return results
@@ -0,0 +1,364 @@
+"""Remote-config commands (NET_DVR_StartRemoteConfig) as record streams.
+
+The SDK reports a remote-config download through a callback per record plus
+status and progress callbacks. `RemoteConfigStream` turns that into a
+context manager and iterator for any command:
+
+    with RemoteConfigStream(user_id, sdk.NET_DVR_GET_CARD, cond,
+                            record_cls=sdk.NET_DVR_CARD_RECORD) as cards:
+        for card in cards:
+            ...
+
+Records are copied out of the SDK buffer into a bounded queue. When the
+consumer falls behind, the SDK callback thread waits for room, which stalls
+the download instead of buffering it. Every stream shares one
+`fRemoteConfigCallback` thunk and is routed by the token passed as pUserData.
+
+`RemoteConfigStream.replay` feeds captured callbacks (see `capture`) into
+that same thunk from a thread, so a replay runs the production code path,
+backpressure included.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import queue
+import threading
+import time
+from logging import getLogger
+from typing import Any, Callable, Iterable, Iterator
+
+from cida_attendance import sdk
+from cida_attendance.sdk.bindings import SDKError, get_last_error
+from cida_attendance.sdk.capture import (
+    KIND_REMOTE_CONFIG,
+    CapturedCallback,
+    CaptureWriter,
+    replay,
+)
+
+logger = getLogger(__name__)
+
+MAX_PENDING = 1024
+IDLE_TIMEOUT_S = 15.0
+_PUT_POLL_S = 0.25
+
+STATUS_SUCCESS = 1000
+STATUS_PROCESSING = 1001
+STATUS_NAMES = {
+    1000: "success",
+    1001: "processing",
+    1002: "failed",
+    1003: "exception",
+    1004: "language mismatch",
+    1005: "device type mismatch",
+    1006: "send wait",
+}
+
+
+class RemoteConfigError(SDKError):
+    def __init__(self, command: int, status: int | None, error: int | None = None):
+        name = STATUS_NAMES.get(status, str(status))
+        super().__init__(
+            f"Comando remoto {command} falló: estado {name}, error {error}"
+        )
+        self.command = command
+        self.status = status
+        self.error = error
+
+
+class RemoteConfigTimeout(RemoteConfigError):
+    pass
+
+
+def decode_status(buffer: bytes) -> tuple[int | None, int | None]:
+    """(status, error) of a NET_SDK_CALLBACK_TYPE_STATUS buffer."""
+
+    status = int.from_bytes(buffer[:4], "little") if len(buffer) >= 4 else None
+    error = int.from_bytes(buffer[4:8], "little") if len(buffer) >= 8 else None
+    return status, error
+
+
+_END = object()
+
+_lock = threading.Lock()
+_streams: dict[int, RemoteConfigStream] = {}
+_next_token = 0
+_callback = None
+
+
+def _on_remote_config(dwType, lpBuffer, dwBufLen, pUserData) -> None:
+    stream = _streams.get(pUserData or 0)
+    if stream is None:
+        return
+    try:
+        stream._on_callback(int(dwType), lpBuffer, int(dwBufLen))
+    except BaseException as e:
+        stream._fail(e)
+
+
+def _get_callback():
+    global _callback
+    with _lock:
+        if _callback is None:
+            # Kept for the life of the process, like the alarm callback.
+            _callback = sdk.fRemoteConfigCallback(_on_remote_config)
+        return _callback
+
+
+class RemoteConfigStream:
+    """One NET_DVR_StartRemoteConfig command.
+
+    Yields `record_cls` instances (or raw bytes without one) and stops on the
+    success status. A failure status raises `RemoteConfigError`; no callback
+    for `timeout_s` raises `RemoteConfigTimeout`. `stats` counts records,
+    bytes, progress callbacks, the time the SDK thread spent waiting for the
+    consumer (`blocked_s`) and the stream duration. `status` is the final
+    status the device reported, if any.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        command: int,
+        cond: ctypes.Structure | None = None,
+        *,
+        record_cls: type[ctypes.Structure] | None = None,
+        max_pending: int = MAX_PENDING,
+        timeout_s: float | None = IDLE_TIMEOUT_S,
+        on_progress: Callable[[], None] | None = None,
+        capture: CaptureWriter | None = None,
+    ):
+        self.user_id = user_id
+        self.command = command
+        self.cond = cond
+        self.record_cls = record_cls
+        self.timeout_s = timeout_s
+        self.on_progress = on_progress
+        self.capture = capture
+
+        self._queue: queue.Queue = queue.Queue(max_pending)
+        self._cancelled = threading.Event()
+        self._error: BaseException | None = None
+        self._token = 0
+        self._handle = -1
+        self._started_at: float | None = None
+        self._done = False
+        self._feeder: threading.Thread | None = None
+        self.status: int | None = None
+        self.stats: dict[str, Any] = {
+            "records": 0,
+            "bytes": 0,
+            "progress": 0,
+            "blocked_s": 0.0,
+            "duration_s": 0.0,
+            "status": None,
+            "error": None,
+        }
+
+    def _register(self) -> None:
+        global _next_token
+
+        with _lock:
+            _next_token += 1
+            self._token = _next_token
+            _streams[self._token] = self
+
+    def start(self) -> RemoteConfigStream:
+        callback = _get_callback()
+        self._register()
+
+        cond = self.cond
+        self._started_at = time.monotonic()
+        self._handle = sdk.NET_DVR_StartRemoteConfig(
+            self.user_id,
+            self.command,
+            ctypes.byref(cond) if cond is not None else None,
+            ctypes.sizeof(cond) if cond is not None else 0,
+            callback,
+            ctypes.c_void_p(self._token),
+        )
+        if self._handle < 0:
+            self._unregister()
+            raise SDKError(*get_last_error())
+        return self
+
+    @classmethod
+    def replay(
+        cls,
+        records: Iterable[CapturedCallback],
+        *,
+        speed: float | None = 1.0,
+        **kwargs,
+    ) -> RemoteConfigStream:
+        """A started stream fed from captured callbacks instead of the SDK.
+
+        Consumes `records` up to the first final status, so a capture of
+        several commands replays as several streams. `stats["replayed"]`
+        counts the callbacks fed once the stream is closed.
+        """
+
+        kwargs.setdefault("timeout_s", None)
+        stream = cls(-1, 0, **kwargs)
+        stream._register()
+        stream._started_at = time.monotonic()
+        stream._feeder = threading.Thread(
+            target=stream._feed, args=(iter(records), speed), daemon=True
+        )
+        stream._feeder.start()
+        return stream
+
+    def _feed(self, records: Iterator[CapturedCallback], speed: float | None) -> None:
+        callback = _get_callback()
+
+        def command():
+            while not self._cancelled.is_set():
+                record = next(records, None)
+                if record is None:
+                    return
+                if record.kind != KIND_REMOTE_CONFIG:
+                    continue
+                yield record
+                if (
+                    record.dw_type == sdk.NET_SDK_CALLBACK_TYPE_STATUS
+                    and decode_status(record.data)[0] != STATUS_PROCESSING
+                ):
+                    return
+
+        def feed(record: CapturedCallback) -> None:
+            length = len(record.data)
+            record_size = ctypes.sizeof(self.record_cls) if self.record_cls else 0
+            size = max(length, record_size, 1)
+            buffer = ctypes.create_string_buffer(bytes(record.data), size)
+            callback(record.dw_type, ctypes.addressof(buffer), length, self._token)
+
+        try:
+            self.stats["replayed"] = replay(command(), feed, speed=speed)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(_END)
+
+    def cancel(self) -> None:
+        """Stop the download; a blocked SDK callback returns at once and
+        iteration stops with the records already queued dropped."""
+
+        self._cancelled.set()
+        self.close()
+        self._done = True
+        # Wake a consumer blocked in __next__ on another thread.
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self._queue.put_nowait(_END)
+        except queue.Full:
+            pass
+
+    def close(self) -> None:
+        if self._feeder is not None:
+            self._cancelled.set()
+            self._feeder.join()
+        if self._handle >= 0:
+            self._cancelled.set()
+            if not sdk.NET_DVR_StopRemoteConfig(self._handle):
+                logger.debug("NET_DVR_StopRemoteConfig falló: %s", get_last_error())
+            self._handle = -1
+        self._unregister()
+        if self._started_at is not None:
+            self.stats["duration_s"] = round(time.monotonic() - self._started_at, 3)
+        if self.capture is not None:
+            self.capture.flush()
+
+    def _unregister(self) -> None:
+        with _lock:
+            _streams.pop(self._token, None)
+
+    def __enter__(self) -> RemoteConfigStream:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        if self._done:
+            raise StopIteration
+        try:
+            item = self._queue.get(timeout=self.timeout_s)
+        except queue.Empty:
+            self._done = True
+            raise RemoteConfigTimeout(self.command, self.stats["status"]) from None
+        if item is _END or self._cancelled.is_set():
+            self._done = True
+            if self._error is not None and not self._cancelled.is_set():
+                raise self._error
+            raise StopIteration
+        return item
+
+    def _put(self, item) -> None:
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        blocked_at = time.monotonic()
+        try:
+            while not self._cancelled.is_set():
+                try:
+                    self._queue.put(item, timeout=_PUT_POLL_S)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            self.stats["blocked_s"] += time.monotonic() - blocked_at
+
+    def _fail(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+        self._put(_END)
+
+    def _on_callback(self, dw_type: int, buffer, length: int) -> None:
+        # Runs on an SDK thread.
+        if self.capture is not None:
+            self.capture.write(
+                KIND_REMOTE_CONFIG,
+                dw_type,
+                ctypes.string_at(buffer, length) if buffer else b"",
+            )
+
+        if dw_type == sdk.NET_SDK_CALLBACK_TYPE_STATUS:
+            status, error = decode_status(
+                ctypes.string_at(buffer, length) if buffer else b""
+            )
+            self.stats["status"] = STATUS_NAMES.get(status, status)
+            self.stats["error"] = error
+            if status == STATUS_PROCESSING:
+                return
+            self.status = status
+            if status != STATUS_SUCCESS:
+                self._error = RemoteConfigError(self.command, status, error)
+            self._put(_END)
+            return
+
+        if dw_type == sdk.NET_SDK_CALLBACK_TYPE_PROGRESS:
+            self.stats["progress"] += 1
+            if self.on_progress is not None:
+                self.on_progress()
+            return
+
+        if dw_type == sdk.NET_SDK_CALLBACK_TYPE_DATA and buffer:
+            if self.record_cls is not None:
+                record = self.record_cls()
+                ctypes.memmove(
+                    ctypes.addressof(record), buffer, min(length, ctypes.sizeof(record))
+                )
+            else:
+                record = ctypes.string_at(buffer, length)
+            self.stats["records"] += 1
+            self.stats["bytes"] += length
+            self._put(record)
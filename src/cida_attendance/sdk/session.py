@@ -1,12 +1,15 @@
 import ctypes
 import datetime
+import json
+import os
 import re
 import time
 from logging import getLogger
-from typing import Any, Callable
-from xml.dom import minidom
+from typing import Any, Callable, Iterator
 
 from cida_attendance import sdk
+from cida_attendance.isapi.client import USER_SEARCH_PATH, iter_search_pages
+from cida_attendance.sdk.alarm import get_alarm_dispatcher
 from cida_attendance.sdk.bindings import (
     build_net_dvr_acs_event_cond,
     build_net_dvr_remoteconfig,
@@ -16,26 +19,309 @@ from cida_attendance.sdk.bindings import (
     get_last_error,
     init_dll,
 )
+from cida_attendance.sdk.capture import (
+    KIND_ALARM,
+    KIND_ALARM_BUFFER,
+    CapturedCallback,
+    CaptureReader,
+    CaptureWriter,
+    replay,
+)
+from cida_attendance.sdk.remote_config import RemoteConfigStream
 from cida_attendance.sdk.utils import ctypes_to_dict
+from cida_attendance.sdk.xmlstream import find_xml_values, iter_xml_records
 
 logger = getLogger(__name__)
 
 
 def get_values_from_xml(xml: str, tags: list[str]):
-    dom = minidom.parseString(xml)
+    # One value per tag, in the order requested, skipping missing/empty tags.
+    values = find_xml_values(xml, tags)
     for tag in tags:
-        elements = dom.getElementsByTagName(tag)
-        if elements:
-            for element in elements:
-                if element.firstChild:
-                    yield element.firstChild.nodeValue
+        if values.get(tag):
+            yield values[tag]
+
+
+def _alarm_payloads(
+    command: int,
+) -> tuple[type[ctypes.Structure], dict[str, Callable[[Any], int]]] | None:
+    """Struct of an alarm command and, per pointer field worth capturing, the
+    size of the buffer it points to."""
+
+    if command == sdk.COMM_ISAPI_ALARM:
+        return sdk.NET_DVR_ALARM_ISAPI_INFO, {
+            "pAlarmData": lambda info: info.dwAlarmDataLen
+        }
+    if command == sdk.COMM_ALARM_ACS:
+        return sdk.NET_DVR_ACS_ALARM_INFO, {
+            "pPicData": lambda info: info.dwPicDataLen,
+            "pAcsEventInfoExtend": lambda info: (
+                ctypes.sizeof(sdk.NET_DVR_ACS_EVENT_INFO_EXTEND)
+                if info.byAcsEventInfoExtend
+                else 0
+            ),
+            "pAcsEventInfoExtendV20": lambda info: (
+                ctypes.sizeof(sdk.NET_DVR_ACS_EVENT_INFO_EXTEND_V20)
+                if info.byAcsEventInfoExtendV20
+                else 0
+            ),
+        }
+    return None
+
+
+def _pointer_offsets(cls: type[ctypes.Structure]) -> list[int]:
+    pointer_types = (ctypes._Pointer, ctypes.c_void_p, ctypes.c_char_p, sdk.String)
+    return [
+        getattr(cls, name).offset
+        for name, field_type in cls._fields_
+        if issubclass(field_type, pointer_types)
+    ]
+
+
+def _capture_alarm_buffers(
+    command: int, address: int, length: int
+) -> list[tuple[int, int, bytes, bytes]]:
+    payloads = _alarm_payloads(command)
+    if payloads is None or length < ctypes.sizeof(payloads[0]):
+        return []
+
+    cls, sizes = payloads
+    info = cls.from_address(address)
+    records = []
+    for name, size_of in sizes.items():
+        offset = getattr(cls, name).offset
+        pointer = ctypes.c_void_p.from_address(address + offset).value
+        size = int(size_of(info))
+        if pointer and size:
+            records.append(
+                (KIND_ALARM_BUFFER, offset, ctypes.string_at(pointer, size), b"")
+            )
+    return records
+
+
+def _relink_alarm_buffers(
+    command: int, info: ctypes.Array, buffers: dict[int, bytes], keep: list
+) -> None:
+    """Point the pointer fields of a replayed alarm struct at copies of the
+    captured buffers, or at NULL: the captured addresses are long gone."""
+
+    payloads = _alarm_payloads(command)
+    if payloads is None or ctypes.sizeof(info) < ctypes.sizeof(payloads[0]):
+        return
+
+    base = ctypes.addressof(info)
+    for offset in _pointer_offsets(payloads[0]):
+        target = None
+        data = buffers.get(offset)
+        if data is not None:
+            copy = ctypes.create_string_buffer(data, len(data) + 1)
+            keep.append(copy)
+            target = ctypes.addressof(copy)
+        ctypes.c_void_p.from_address(base + offset).value = target
+
+
+def _build_alarm_handler(
+    on_event: Callable[[int, dict[str, Any] | None, Any, int | None], None] | None,
+    tz: datetime.tzinfo | None,
+    capture: CaptureWriter | None = None,
+) -> Callable:
+    def _callback(
+        lCommand: int,
+        pAlarmer: Any,
+        pAlarmInfo: Any,
+        dwBufLen: int,
+        pUser: Any,
+    ) -> None:
+        try:
+            if capture is not None:
+                address = (
+                    ctypes.cast(pAlarmInfo, ctypes.c_void_p).value
+                    if pAlarmInfo
+                    else None
+                )
+                records = []
+                if address and dwBufLen:
+                    records = _capture_alarm_buffers(
+                        int(lCommand), address, int(dwBufLen)
+                    )
+                records.append(
+                    (
+                        KIND_ALARM,
+                        lCommand,
+                        ctypes.string_at(address, dwBufLen)
+                        if address and dwBufLen
+                        else b"",
+                        ctypes.string_at(pAlarmer, ctypes.sizeof(sdk.NET_DVR_ALARMER))
+                        if pAlarmer
+                        else b"",
+                    )
+                )
+                capture.write_many(records)
+
+            alarm_info_ptr: ctypes.c_void_p | None = None
+            if pAlarmInfo:
+                try:
+                    alarm_info_ptr = ctypes.cast(pAlarmInfo, ctypes.c_void_p)
+                except Exception:
+                    alarm_info_ptr = ctypes.c_void_p(int(pAlarmInfo))
+
+            alarmer_dict: dict[str, Any] | None = None
+            if pAlarmer:
+                try:
+                    alarmer_dict = ctypes_to_dict(pAlarmer.contents, tz=tz)
+                except Exception:
+                    alarmer_dict = None
+
+            p_user_ptr: int | None = None
+            if pUser:
+                try:
+                    p_user_ptr = int(ctypes.cast(pUser, ctypes.c_void_p).value)
+                except Exception:
+                    p_user_ptr = None
+
+            alarm_info: Any = None
+            if alarm_info_ptr and alarm_info_ptr.value and int(dwBufLen) > 0:
+                if int(lCommand) == sdk.COMM_ISAPI_ALARM:
+                    if int(dwBufLen) >= ctypes.sizeof(sdk.NET_DVR_ALARM_ISAPI_INFO):
+                        isapi_info = ctypes.cast(
+                            alarm_info_ptr,
+                            sdk.LPNET_DVR_ALARM_ISAPI_INFO,
+                        ).contents
+                        alarm_info = ctypes_to_dict(isapi_info, tz=tz)
+                    else:
+                        alarm_info = ctypes.string_at(alarm_info_ptr, int(dwBufLen))
+                elif int(lCommand) == sdk.COMM_ALARM_ACS:
+                    if int(dwBufLen) >= ctypes.sizeof(sdk.NET_DVR_ACS_ALARM_INFO):
+                        acs_info = ctypes.cast(
+                            alarm_info_ptr,
+                            sdk.LPNET_DVR_ACS_ALARM_INFO,
+                        ).contents
+                        alarm_info = ctypes_to_dict(acs_info, tz=tz)
+                    else:
+                        alarm_info = ctypes.string_at(alarm_info_ptr, int(dwBufLen))
+                else:
+                    alarm_info = ctypes.string_at(alarm_info_ptr, int(dwBufLen))
+
+            if on_event:
+                on_event(
+                    int(lCommand),
+                    alarmer_dict,
+                    alarm_info,
+                    p_user_ptr,
+                )
+            else:
+                logger.info(
+                    "Alarm/event: cmd=%s len=%s alarmer=%s",
+                    int(lCommand),
+                    int(dwBufLen),
+                    bool(alarmer_dict),
+                )
+        except Exception:
+            logger.exception("Error procesando callback de alarma/evento")
+
+    return _callback
+
+
+def replay_alarm_events(
+    path: str | os.PathLike,
+    on_event: Callable[[int, dict[str, Any] | None, Any, int | None], None] | None,
+    *,
+    tz: datetime.tzinfo | None = None,
+    speed: float | None = 1.0,
+) -> int:
+    """Feed captured alarm callbacks back through the live alarm handler."""
+
+    handler = _build_alarm_handler(on_event, tz)
+    buffers: dict[int, bytes] = {}
+    count = 0
+
+    def _feed(record: CapturedCallback) -> None:
+        nonlocal count
+
+        if record.kind == KIND_ALARM_BUFFER:
+            buffers[record.dw_type] = bytes(record.data)
+            return
+
+        alarmer = None
+        if len(record.aux) >= ctypes.sizeof(sdk.NET_DVR_ALARMER):
+            alarmer = ctypes.pointer(sdk.NET_DVR_ALARMER.from_buffer_copy(record.aux))
+
+        length = len(record.data)
+        info = ctypes.create_string_buffer(bytes(record.data), max(length, 1))
+        keep: list = []
+        _relink_alarm_buffers(record.dw_type, info, buffers, keep)
+        buffers.clear()
+        handler(
+            record.dw_type,
+            alarmer,
+            ctypes.cast(info, ctypes.c_void_p) if length else None,
+            length,
+            None,
+        )
+        count += 1
+
+    with CaptureReader(path) as reader:
+        replay(reader, _feed, kind=(KIND_ALARM_BUFFER, KIND_ALARM), speed=speed)
+    return count
+
+
+# NET_DVR_CARD_COND.dwCardNum asking for every card on the terminal.
+ALL_CARDS = 0xFFFFFFFF
+
+
+def _c_string(value) -> str:
+    return bytes(value).split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+
+
+def _time_ex_iso(value) -> str | None:
+    if not value.wYear:
+        return None
+    return (
+        f"{value.wYear:04d}-{value.byMonth:02d}-{value.byDay:02d}"
+        f"T{value.byHour:02d}:{value.byMinute:02d}:{value.bySecond:02d}"
+    )
+
+
+def card_from_record(record) -> dict[str, Any]:
+    """A NET_DVR_CARD_RECORD with the field names of ISAPI `CardInfo`."""
+
+    valid = record.struValid
+    return {
+        "cardNo": _c_string(record.byCardNo),
+        "employeeNo": str(record.dwEmployeeNo) if record.dwEmployeeNo else None,
+        "cardType": record.byCardType,
+        "name": _c_string(record.byName),
+        "Valid": {
+            "enable": bool(valid.byEnable),
+            "beginTime": _time_ex_iso(valid.struBeginTime),
+            "endTime": _time_ex_iso(valid.struEndTime),
+        },
+    }
+
+
+def parse_isapi_timezone(value: str | None) -> datetime.timezone:
+    mtz = re.match(r"([A-Z]+)([-+]\d+):(\d+):(\d+)", value or "")
+
+    if not mtz:
+        return datetime.timezone.utc
+
+    gtz = mtz.groups()
+    return datetime.timezone(
+        datetime.timedelta(
+            hours=int(gtz[1]),
+            minutes=int(gtz[2]),
+            seconds=int(gtz[3]),
+        ),
+        name=gtz[0],
+    )
 
 
 class Session:
-    def __init__(self):
+    def __init__(self, capture: CaptureWriter | None = None):
         self.user_id = None
+        self.serial_number: str | None = None
+        self.capture = capture
         self._alarm_handle: int | None = None
-        self._alarm_callbacks: dict[int, Any] = {}
         self._alarm_subscribe_buf: ctypes.Array[ctypes.c_char] | None = None
 
     def __del__(self):
@@ -52,6 +338,7 @@ class Session:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.logout()
         self.cleanup()
 
     def login(self, **config):
@@ -77,16 +364,29 @@ class Session:
             return False
 
         self.user_id = user_id
+        self.serial_number = (
+            bytes(device_info.struDeviceV30.sSerialNumber)
+            .split(b"\x00", 1)[0]
+            .decode("ascii", errors="ignore")
+            or None
+        )
         return True
 
+    def attach(self, user_id: int, serial_number: str | None = None) -> None:
+        """Adopt a login made elsewhere (see `sdk.login.login_many`)."""
+
+        self.user_id = user_id
+        self.serial_number = serial_number
+
     def logout(self):
+        # SDK cleanup belongs to `cleanup()`: other sessions may still be
+        # using the same initialization.
         if self._alarm_handle is not None:
             self.stop_alarm_channel()
 
         if self.user_id is not None and self.user_id >= 0:
             sdk.NET_DVR_Logout(self.user_id)
             self.user_id = None
-        sdk.NET_DVR_Cleanup()
         return True
 
     @staticmethod
@@ -130,82 +430,15 @@ class Session:
             except Exception:
                 tz = None
 
-        def _callback(
-            lCommand: int,
-            pAlarmer: Any,
-            pAlarmInfo: Any,
-            dwBufLen: int,
-            pUser: Any,
-        ) -> None:
-            try:
-                alarm_info_ptr: ctypes.c_void_p | None = None
-                if pAlarmInfo:
-                    try:
-                        alarm_info_ptr = ctypes.cast(pAlarmInfo, ctypes.c_void_p)
-                    except Exception:
-                        alarm_info_ptr = ctypes.c_void_p(int(pAlarmInfo))
-
-                alarmer_dict: dict[str, Any] | None = None
-                if pAlarmer:
-                    try:
-                        alarmer_dict = ctypes_to_dict(pAlarmer.contents, tz=tz)
-                    except Exception:
-                        alarmer_dict = None
-
-                p_user_ptr: int | None = None
-                if pUser:
-                    try:
-                        p_user_ptr = int(ctypes.cast(pUser, ctypes.c_void_p).value)
-                    except Exception:
-                        p_user_ptr = None
-
-                alarm_info: Any = None
-                if alarm_info_ptr and alarm_info_ptr.value and int(dwBufLen) > 0:
-                    if int(lCommand) == sdk.COMM_ISAPI_ALARM:
-                        if int(dwBufLen) >= ctypes.sizeof(sdk.NET_DVR_ALARM_ISAPI_INFO):
-                            isapi_info = ctypes.cast(
-                                alarm_info_ptr,
-                                sdk.LPNET_DVR_ALARM_ISAPI_INFO,
-                            ).contents
-                            alarm_info = ctypes_to_dict(isapi_info, tz=tz)
-                        else:
-                            alarm_info = ctypes.string_at(alarm_info_ptr, int(dwBufLen))
-                    elif int(lCommand) == sdk.COMM_ALARM_ACS:
-                        if int(dwBufLen) >= ctypes.sizeof(sdk.NET_DVR_ACS_ALARM_INFO):
-                            acs_info = ctypes.cast(
-                                alarm_info_ptr,
-                                sdk.LPNET_DVR_ACS_ALARM_INFO,
-                            ).contents
-                            alarm_info = ctypes_to_dict(acs_info, tz=tz)
-                        else:
-                            alarm_info = ctypes.string_at(alarm_info_ptr, int(dwBufLen))
-                    else:
-                        alarm_info = ctypes.string_at(alarm_info_ptr, int(dwBufLen))
-
-                if on_event:
-                    on_event(
-                        int(lCommand),
-                        alarmer_dict,
-                        alarm_info,
-                        p_user_ptr,
-                    )
-                else:
-                    logger.info(
-                        "Alarm/event: cmd=%s len=%s alarmer=%s",
-                        int(lCommand),
-                        int(dwBufLen),
-                        bool(alarmer_dict),
-                    )
-            except Exception:
-                logger.exception("Error procesando callback de alarma/evento")
-
-        callback = sdk.MSGCallBack(_callback)
-        self._alarm_callbacks[int(callback_index)] = callback
-
-        ok = sdk.NET_DVR_SetDVRMessageCallBack_V50(int(callback_index), callback, None)
-        if not ok:
-            code, msg = get_last_error()
-            raise RuntimeError(f"NET_DVR_SetDVRMessageCallBack_V50 falló: {code} {msg}")
+        # The SDK callback is process-wide: register with the dispatcher
+        # instead of replacing other sessions' handlers.
+        dispatcher = get_alarm_dispatcher()
+        dispatcher.install(int(callback_index))
+        dispatcher.register(
+            _build_alarm_handler(on_event, tz, self.capture),
+            user_id=self.user_id,
+            serial=self.serial_number,
+        )
 
         setup = sdk.NET_DVR_SETUPALARM_PARAM_V50()
         setup.dwSize = ctypes.sizeof(setup)
@@ -264,6 +497,7 @@ class Session:
         )
 
         if handle < 0:
+            dispatcher.unregister(user_id=self.user_id, serial=self.serial_number)
             code, msg = get_last_error()
             raise RuntimeError(f"NET_DVR_SetupAlarmChan_V50 falló: {code} {msg}")
 
@@ -280,6 +514,9 @@ class Session:
         ok = sdk.NET_DVR_CloseAlarmChan_V30(handle)
         if not ok:
             logger.warning("NET_DVR_CloseAlarmChan_V30 falló: %s", get_last_error())
+        get_alarm_dispatcher().unregister(
+            user_id=self.user_id, serial=self.serial_number
+        )
 
     def listen_alarm_events(self, duration_s: float | None = None) -> None:
         if self._alarm_handle is None:
@@ -308,32 +545,88 @@ class Session:
             recv_timeout,
         ).decode("ascii")
 
+    def remote_config_stream(
+        self,
+        command: int,
+        cond: ctypes.Structure | None = None,
+        record_cls: type[ctypes.Structure] | None = None,
+        **options,
+    ) -> RemoteConfigStream:
+        """Any NET_DVR_StartRemoteConfig command as a record stream; use it
+        as a context manager."""
+
+        return RemoteConfigStream(
+            self.user_id,
+            command,
+            cond,
+            record_cls=record_cls,
+            capture=self.capture,
+            **options,
+        )
+
+    def isapi_post_json(self, path: str, payload: dict[str, Any]) -> dict[str, Any]:
+        """POST a JSON ISAPI request through the SDK connection."""
+
+        out = build_net_dvr_xml_config_input(
+            self.user_id, f"POST {path}", json.dumps(payload, separators=(",", ":"))
+        )
+        return json.loads(out.decode("utf-8", errors="replace") or "{}")
+
+    def iter_users(self) -> Iterator[dict[str, Any]]:
+        """`UserInfo` entries, fetched page by page."""
+
+        for page in iter_search_pages(
+            self.isapi_post_json, USER_SEARCH_PATH, "UserInfo"
+        ):
+            yield from page
+
+    def iter_cards(self, **options) -> Iterator[dict[str, Any]]:
+        """Every card on the terminal via NET_DVR_GET_CARD (see
+        `card_from_record`); `options` go to `RemoteConfigStream`."""
+
+        cond = sdk.NET_DVR_CARD_COND()
+        cond.dwSize = ctypes.sizeof(cond)
+        cond.dwCardNum = ALL_CARDS
+        with self.remote_config_stream(
+            sdk.NET_DVR_GET_CARD, cond, sdk.NET_DVR_CARD_RECORD, **options
+        ) as stream:
+            for record in stream:
+                yield card_from_record(record)
+
     def get_device_info(self):
         return get_values_from_xml(
             self.send_data_request("GET /ISAPI/System/deviceInfo"),
             ["model", "serialNumber"],
         )
 
+    def get_device_metadata(self) -> dict[str, str | None]:
+        values = find_xml_values(
+            self.send_data_request("GET /ISAPI/System/deviceInfo"),
+            ["model", "serialNumber", "firmwareVersion", "deviceName"],
+        )
+        return {
+            "model": values.get("model"),
+            "serial": values.get("serialNumber"),
+            "firmware": values.get("firmwareVersion"),
+            "name": values.get("deviceName"),
+        }
+
+    def get_capabilities(self) -> dict[str, bool]:
+        capabilities: dict[str, bool] = {}
+        xml = self.send_data_request("GET /ISAPI/AccessControl/capabilities")
+        for record in iter_xml_records(xml, "AccessControl"):
+            for name, value in record.items():
+                if name.startswith("isSupport"):
+                    capabilities[name] = (value or "").strip() == "true"
+        return capabilities
+
     def get_device_time(self):
         slt, stz = get_values_from_xml(
             self.send_data_request("GET /ISAPI/System/time"),
             ["localTime", "timeZone"],
         )
 
-        mtz = re.match(r"([A-Z]+)([-+]\d+):(\d+):(\d+)", stz)
-
-        if mtz:
-            gtz = mtz.groups()
-            tz = datetime.timezone(
-                datetime.timedelta(
-                    hours=int(gtz[1]),
-                    minutes=int(gtz[2]),
-                    seconds=int(gtz[3]),
-                ),
-                name=gtz[0],
-            )
-        else:
-            tz = datetime.timezone.utc
+        tz = parse_isapi_timezone(stz)
 
         # `localTime` es tiempo local del dispositivo; lo hacemos timezone-aware
         # con el offset entregado por `timeZone`.
@@ -365,4 +658,5 @@ class Session:
             on_data=on_data,
             data_cls=sdk.NET_DVR_ACS_EVENT_CFG,
             timeout_s=timeout_s,
+            capture=self.capture,
         )
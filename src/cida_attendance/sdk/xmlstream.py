@@ -0,0 +1,164 @@
+"""Streaming extraction of values from ISAPI XML documents.
+
+ISAPI answers are parsed incrementally with `XMLPullParser`: finished
+elements are dropped from the tree as soon as they are consumed, so memory
+stays bounded by the nesting depth (plus one record for `iter_xml_records`)
+instead of the document size, and `iter_xml_values` stops parsing as soon as
+every requested tag has been seen.
+
+Tags are matched by local name (`model`) regardless of the ISAPI namespace,
+or exactly when given in Clark notation (`{http://...}model`).
+"""
+
+from __future__ import annotations
+
+from typing import IO, Iterable, Iterator
+from xml.etree.ElementTree import Element, XMLPullParser
+
+CHUNK_SIZE = 64 * 1024
+
+XmlSource = str | bytes | IO[bytes] | Iterable[bytes]
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _matches(tag: str, wanted: str) -> bool:
+    if wanted.startswith("{"):
+        return tag == wanted
+    return _local_name(tag) == wanted
+
+
+def _iter_chunks(source: XmlSource, chunk_size: int) -> Iterator[str | bytes]:
+    if isinstance(source, (str, bytes, bytearray)):
+        for offset in range(0, len(source), chunk_size):
+            yield source[offset : offset + chunk_size]
+        return
+
+    read = getattr(source, "read", None)
+    if read is not None:
+        while chunk := read(chunk_size):
+            yield chunk
+        return
+
+    yield from source
+
+
+def _iter_events(source: XmlSource, chunk_size: int) -> Iterator[tuple[str, Element]]:
+    parser = XMLPullParser(events=("start", "end"))
+    for chunk in _iter_chunks(source, chunk_size):
+        parser.feed(chunk)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def iter_xml_values(
+    source: XmlSource,
+    tags: Iterable[str],
+    *,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[tuple[str, str | None]]:
+    """Yield `(tag, text)` for the first occurrence of each requested tag.
+
+    Values come out in document order and parsing stops once all tags
+    have been found.
+    """
+
+    pending = list(dict.fromkeys(tags))
+    if not pending:
+        return
+
+    stack: list[Element] = []
+    for event, element in _iter_events(source, chunk_size):
+        if event == "start":
+            stack.append(element)
+            continue
+
+        stack.pop()
+        for wanted in pending:
+            if _matches(element.tag, wanted):
+                pending.remove(wanted)
+                yield wanted, element.text
+                break
+
+        if not pending:
+            return
+
+        # Children of the parent are all finished: drop them.
+        if stack:
+            del stack[-1][:]
+
+
+def find_xml_values(
+    source: XmlSource,
+    tags: Iterable[str],
+    *,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict[str, str | None]:
+    return dict(iter_xml_values(source, tags, chunk_size=chunk_size))
+
+
+def iter_xml_records(
+    source: XmlSource,
+    path: str,
+    fields: Iterable[str] | None = None,
+    *,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[dict[str, str | None]]:
+    """Yield one dict per element matching `path` (e.g. `UserInfoList/UserInfo`).
+
+    The path is matched against the trailing elements of the current
+    ancestry, so leading levels can be omitted. Each dict maps the local name
+    of the record's leaf descendants to their text (first occurrence wins),
+    restricted to `fields` when given.
+    """
+
+    steps = [step for step in path.strip("/").split("/") if step]
+    if not steps:
+        raise ValueError("path must name at least one element")
+
+    wanted_fields = set(fields) if fields is not None else None
+    stack: list[Element] = []
+    # Children are dropped as they finish, so leafness is tracked separately.
+    has_children: list[bool] = []
+    record: dict[str, str | None] | None = None
+    record_depth = 0
+
+    def _at_path() -> bool:
+        if len(stack) < len(steps):
+            return False
+        return all(
+            _matches(element.tag, step)
+            for element, step in zip(stack[-len(steps) :], steps)
+        )
+
+    for event, element in _iter_events(source, chunk_size):
+        if event == "start":
+            if has_children:
+                has_children[-1] = True
+            stack.append(element)
+            has_children.append(False)
+            if record is None and _at_path():
+                record = {}
+                record_depth = len(stack)
+            continue
+
+        depth = len(stack)
+        stack.pop()
+        is_leaf = not has_children.pop()
+
+        if record is not None:
+            if depth == record_depth:
+                yield record
+                record = None
+            elif is_leaf:
+                name = _local_name(element.tag)
+                if (wanted_fields is None or name in wanted_fields) and (
+                    name not in record
+                ):
+                    record[name] = element.text
+
+        if stack:
+            del stack[-1][:]
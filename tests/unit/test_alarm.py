@@ -0,0 +1,65 @@
+import ctypes
+
+from cida_attendance import sdk
+from cida_attendance.sdk import alarm, bindings
+from cida_attendance.sdk.alarm import AlarmDispatcher
+
+
+def make_alarmer(user_id=None, serial=None):
+    alarmer = sdk.NET_DVR_ALARMER()
+    if user_id is not None:
+        alarmer.byUserIDValid = 1
+        alarmer.lUserID = user_id
+    if serial is not None:
+        alarmer.bySerialValid = 1
+        ctypes.memmove(alarmer.sSerialNumber, serial.encode(), len(serial))
+    return ctypes.pointer(alarmer)
+
+
+def test_alarms_are_routed_per_device():
+    dispatcher = AlarmDispatcher()
+    seen = []
+
+    for user_id in range(300):
+        dispatcher.register(
+            lambda cmd, *_, user_id=user_id: seen.append((user_id, cmd)),
+            user_id=user_id,
+        )
+    dispatcher.register(
+        lambda cmd, *_: seen.append(("pushed", cmd)), serial="DS-K1T0001"
+    )
+
+    dispatcher._dispatch(0x5002, make_alarmer(user_id=7), None, 0, None)
+    dispatcher._dispatch(0x5002, make_alarmer(user_id=299), None, 0, None)
+    dispatcher._dispatch(0x5002, make_alarmer(serial="DS-K1T0001"), None, 0, None)
+    dispatcher._dispatch(0x5002, make_alarmer(serial="unknown"), None, 0, None)
+    assert seen == [(7, 0x5002), (299, 0x5002), ("pushed", 0x5002)]
+    assert dispatcher.unrouted == 1
+
+    dispatcher.unregister(user_id=7)
+    dispatcher.set_fallback(lambda cmd, *_: seen.append(("fallback", cmd)))
+    dispatcher._dispatch(0x5002, make_alarmer(user_id=7), None, 0, None)
+    assert seen[-1] == ("fallback", 0x5002)
+
+
+def test_callback_is_reinstalled_after_cleanup(monkeypatch):
+    installs = []
+    monkeypatch.setattr(alarm, "_dispatcher", None)
+    monkeypatch.setattr(bindings, "_init_refs", 0)
+    monkeypatch.setattr(bindings, "_cleanup_hooks", [])
+    monkeypatch.setattr(bindings, "_init_sdk", lambda: None)
+    monkeypatch.setattr(sdk, "NET_DVR_Cleanup", lambda: None, raising=False)
+    monkeypatch.setattr(
+        sdk,
+        "NET_DVR_SetDVRMessageCallBack_V50",
+        lambda index, callback, user: installs.append(index) or True,
+        raising=False,
+    )
+
+    dispatcher = alarm.get_alarm_dispatcher()
+    for _ in range(2):
+        bindings.init_dll()
+        dispatcher.install()
+        dispatcher.install()
+        bindings.cleanup_dll()
+    assert installs == [0, 0]
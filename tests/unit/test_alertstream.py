@@ -0,0 +1,253 @@
+import asyncio
+import datetime
+import json
+import random
+
+from cida_attendance.isapi.alertstream import (
+    DISCARD,
+    AlertStream,
+    CollectSink,
+    MultipartParser,
+    SpoolSink,
+    event_from_alert,
+    parse_alert,
+)
+from cida_attendance.isapi.client import IsapiClient
+from cida_attendance.isapi.digest import parse_challenge
+
+BOUNDARY = "MIME_boundary"
+
+XML_ALERT = b"""<EventNotificationAlert version="2.0" xmlns="http://www.isapi.org/ver20/XMLSchema">
+<ipAddress>10.0.0.5</ipAddress><dateTime>2024-05-01T08:01:00-04:00</dateTime>
+<eventType>AccessControllerEvent</eventType><eventState>active</eventState>
+<AccessControllerEvent><majorEventType>5</majorEventType><subEventType>75</subEventType>
+<employeeNoString>E7</employeeNoString><serialNo>12</serialNo>
+<attendanceStatus>checkOut</attendanceStatus></AccessControllerEvent>
+</EventNotificationAlert>"""
+
+
+def json_alert(serial_no, employee="E1", minute=0):
+    return json.dumps(
+        {
+            "ipAddress": "10.0.0.5",
+            "dateTime": f"2024-05-01T08:{minute:02d}:00-04:00",
+            "eventType": "AccessControllerEvent",
+            "AccessControllerEvent": {
+                "majorEventType": 5,
+                "subEventType": 75,
+                "employeeNoString": employee,
+                "serialNo": serial_no,
+                "attendanceStatus": "checkIn",
+            },
+        }
+    ).encode()
+
+
+HEARTBEAT = json.dumps({"eventType": "videoloss", "eventState": "inactive"}).encode()
+
+
+def part(body, content_type="application/json", length=True):
+    headers = f"Content-Type: {content_type}\r\n"
+    if length:
+        headers += f"Content-Length: {len(body)}\r\n"
+    return f"--{BOUNDARY}\r\n{headers}\r\n".encode() + body + b"\r\n"
+
+
+def stream_body(*serial_nos, image=b"\xff\xd8" + bytes(range(256)) * 40 + b"\xff\xd9"):
+    body = b""
+    for serial_no in serial_nos:
+        body += part(json_alert(serial_no, minute=serial_no))
+        body += part(image, "image/jpeg", length=serial_no % 2 == 0)
+        body += part(HEARTBEAT)
+    return body
+
+
+def parse(data, chunk_sizes, spool_dir=None):
+    parts, images = [], []
+
+    def open_part(headers):
+        if headers["content-type"].startswith("image/"):
+            if spool_dir is None:
+                return DISCARD
+            path = spool_dir / f"{len(images)}.jpg"
+            images.append(path)
+            return SpoolSink(str(path))
+        return CollectSink(headers, lambda h, body: parts.append(body))
+
+    parser = MultipartParser(BOUNDARY, open_part, max_header_bytes=1024)
+    offset = 0
+    while offset < len(data):
+        size = chunk_sizes()
+        parser.feed(data[offset : offset + size])
+        assert len(parser._buf) <= size + 1024
+        offset += size
+    parser.close()
+    return parser, parts, images
+
+
+def test_parser_handles_any_chunking(tmp_path):
+    image = b"\xff\xd8" + b"\r\n--MIME" * 500 + b"\xff\xd9"
+    data = stream_body(1, 2, 3, image=image) + part(
+        XML_ALERT, "application/xml", length=False
+    )
+    data += f"--{BOUNDARY}--\r\n".encode()
+    rng = random.Random(7)
+
+    for chunk_sizes in (
+        lambda: 1,
+        lambda: 7,
+        lambda: rng.randint(1, 4096),
+        lambda: 1 << 20,
+    ):
+        parser, parts, _ = parse(data, chunk_sizes)
+        assert parser.parts == 10 and parser.finished
+        assert parts[:2] == [json_alert(1, minute=1), HEARTBEAT]
+        assert parts[-1] == XML_ALERT
+
+    _, _, images = parse(data, lambda: 4096, spool_dir=tmp_path)
+    assert [p.read_bytes() for p in images] == [image] * 3
+
+
+def test_truncated_part_is_dropped(tmp_path):
+    data = stream_body(2)
+    cut = data.index(b"\xff\xd8") + 100
+    _, parts, images = parse(data[:cut], lambda: 64, spool_dir=tmp_path)
+    assert parts == [json_alert(2, minute=2)]
+    assert images and not images[0].exists()
+
+
+def test_alert_events():
+    tz = datetime.timezone(datetime.timedelta(hours=-4))
+    headers = {"content-type": "application/json"}
+    json_event = event_from_alert(parse_alert(headers, json_alert(9)))
+    assert json_event == (
+        "E1",
+        datetime.datetime(2024, 5, 1, 8, 0, tzinfo=tz),
+        1,
+        75,
+        9,
+    )
+    assert event_from_alert(parse_alert({}, XML_ALERT)) == (
+        "E7",
+        datetime.datetime(2024, 5, 1, 8, 1, tzinfo=tz),
+        2,
+        75,
+        12,
+    )
+    assert event_from_alert(parse_alert({}, HEARTBEAT)) is None
+
+
+def test_restarted_serials_are_not_duplicates():
+    events = []
+    stream = AlertStream(
+        IsapiClient("127.0.0.1", 80),
+        lambda s, record: events.append(record[4]),
+        serial="SN1",
+    )
+    headers = {"content-type": "application/json"}
+    for serial_no, minute in [(500, 1), (501, 2), (500, 1), (1, 3), (2, 4), (1, 3)]:
+        stream._on_part(headers, json_alert(serial_no, minute=minute))
+    assert events == [500, 501, 1, 2]
+    assert stream.stats["duplicates"] == 2
+
+
+def test_stream_reconnects_and_deduplicates():
+    bodies = [stream_body(1, 2, 3), stream_body(2, 3, 4, 5)]
+    requests = []
+
+    async def handle(reader, writer):
+        requests.append(await reader.readuntil(b"\r\n\r\n"))
+        body = bodies[min(len(requests), len(bodies)) - 1]
+        head = (
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: multipart/mixed; boundary={BOUNDARY}\r\n"
+            "Transfer-Encoding: chunked\r\n\r\n"
+        ).encode()
+        writer.write(head)
+        for offset in range(0, len(body), 1000):
+            chunk = body[offset : offset + 1000]
+            writer.write(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        events = []
+        stream = AlertStream(
+            IsapiClient("127.0.0.1", port, "admin", "secret"),
+            lambda s, record: events.append((s.serial, record[4])),
+            resume=False,
+            serial="DS-K1T6710001",
+        )
+        task = asyncio.create_task(stream.run())
+        while len(events) < 5:
+            await asyncio.sleep(0.01)
+        stream.close()
+        task.cancel()
+        server.close()
+        return stream, events
+
+    stream, events = asyncio.run(asyncio.wait_for(run(), 10))
+    assert events == [("DS-K1T6710001", n) for n in (1, 2, 3, 4, 5)]
+    assert stream.stats["duplicates"] == 2
+    assert stream.stats["other"] >= 7
+    assert stream.stats["reconnects"] >= 1
+    assert b"GET /ISAPI/Event/notification/alertStream" in requests[0]
+
+
+def test_stream_answers_new_nonce_after_reboot():
+    nonces = ["boot1"]
+    bodies = [stream_body(1), stream_body(2)]
+    served = []
+
+    async def handle(reader, writer):
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        authorization = next(
+            (
+                line[15:]
+                for line in head.split("\r\n")
+                if line.startswith("Authorization: ")
+            ),
+            "",
+        )
+        if (parse_challenge(authorization) or {}).get("nonce") != nonces[-1]:
+            writer.write(
+                b"HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\n"
+                b'WWW-Authenticate: Digest realm="DS", qop="auth", nonce="%s"\r\n\r\n'
+                % nonces[-1].encode()
+            )
+        else:
+            body = bodies[len(served)]
+            served.append(nonces[-1])
+            # The terminal reboots after the first stream.
+            nonces.append("boot2")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: multipart/mixed; boundary=%s\r\n"
+                b"Content-Length: %d\r\n\r\n" % (BOUNDARY.encode(), len(body)) + body
+            )
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        events = []
+        stream = AlertStream(
+            IsapiClient("127.0.0.1", port, "admin", "secret"),
+            lambda s, record: events.append(record[4]),
+            resume=False,
+            serial="DS-K1T6710001",
+        )
+        task = asyncio.create_task(stream.run())
+        while len(events) < 2:
+            await asyncio.sleep(0.01)
+        stream.close()
+        task.cancel()
+        server.close()
+        return events
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == [1, 2]
+    assert served == ["boot1", "boot2"]
@@ -0,0 +1,110 @@
+import ctypes
+
+import pytest
+
+from cida_attendance import sdk
+from cida_attendance.sdk.capture import (
+    KIND_ALARM,
+    KIND_REMOTE_CONFIG,
+    MAGIC,
+    CaptureError,
+    CaptureReader,
+    CaptureWriter,
+    replay,
+)
+from cida_attendance.sdk.session import _build_alarm_handler, replay_alarm_events
+
+
+def test_roundtrip_preserves_order_and_payloads(tmp_path):
+    path = tmp_path / "events.cap"
+
+    with CaptureWriter(path) as writer:
+        writer.write(KIND_REMOTE_CONFIG, 2, b"\x01\x02\x03")
+        writer.write(KIND_ALARM, 0x5002, b"info", b"alarmer")
+
+    # Appending keeps a single header.
+    with CaptureWriter(path) as writer:
+        writer.write(KIND_REMOTE_CONFIG, 0, (1000).to_bytes(4, "little"))
+
+    with CaptureReader(path) as reader:
+        records = [(r.kind, r.dw_type, bytes(r.data), bytes(r.aux)) for r in reader]
+
+    assert records == [
+        (KIND_REMOTE_CONFIG, 2, b"\x01\x02\x03", b""),
+        (KIND_ALARM, 0x5002, b"info", b"alarmer"),
+        (KIND_REMOTE_CONFIG, 0, (1000).to_bytes(4, "little"), b""),
+    ]
+    assert path.read_bytes().count(MAGIC) == 1
+
+
+def test_truncated_trailing_record_is_ignored(tmp_path):
+    path = tmp_path / "events.cap"
+    with CaptureWriter(path) as writer:
+        writer.write(KIND_REMOTE_CONFIG, 2, b"complete")
+        writer.write(KIND_REMOTE_CONFIG, 2, b"truncated")
+
+    path.write_bytes(path.read_bytes()[:-3])
+
+    with CaptureReader(path) as reader:
+        assert [bytes(r.data) for r in reader] == [b"complete"]
+
+
+def test_rejects_foreign_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a capture")
+
+    with pytest.raises(CaptureError):
+        CaptureReader(path)
+
+
+def test_replay_filters_by_kind(tmp_path):
+    path = tmp_path / "events.cap"
+    with CaptureWriter(path) as writer:
+        writer.write(KIND_REMOTE_CONFIG, 2, b"a")
+        writer.write(KIND_ALARM, 1, b"b")
+        writer.write(KIND_REMOTE_CONFIG, 2, b"c")
+
+    seen = []
+    with CaptureReader(path) as reader:
+        count = replay(
+            reader,
+            lambda r: seen.append(bytes(r.data)),
+            kind=KIND_REMOTE_CONFIG,
+            speed=None,
+        )
+
+    assert count == 2
+    assert seen == [b"a", b"c"]
+
+
+def test_alarm_replay_restores_pointer_payloads(tmp_path):
+    path = tmp_path / "alarms.cap"
+    payload = b'{"eventType":"AccessControllerEvent"}'
+    data = ctypes.create_string_buffer(payload)
+    info = sdk.NET_DVR_ALARM_ISAPI_INFO()
+    info.pAlarmData = sdk.String(ctypes.cast(data, ctypes.POINTER(ctypes.c_char)))
+    info.dwAlarmDataLen = len(payload)
+    info.pPicPackData = 0xDEAD0000  # Never dereferenced, live or replayed.
+
+    with CaptureWriter(path) as writer:
+        handler = _build_alarm_handler(lambda *_: None, None, capture=writer)
+        handler(
+            sdk.COMM_ISAPI_ALARM,
+            None,
+            ctypes.cast(ctypes.pointer(info), ctypes.c_void_p),
+            ctypes.sizeof(info),
+            None,
+        )
+    # A capture from before buffers were recorded: the pointer is stale.
+    info.pAlarmData = sdk.String(ctypes.cast(0xDEAD0000, ctypes.POINTER(ctypes.c_char)))
+    with CaptureWriter(path) as writer:
+        writer.write(KIND_ALARM, sdk.COMM_ISAPI_ALARM, bytes(info))
+    del data
+
+    seen = []
+    count = replay_alarm_events(path, lambda *args: seen.append(args), speed=None)
+    assert count == 2
+    assert seen[0][2]["pAlarmData"]["data"] == payload
+    assert seen[0][2]["dwAlarmDataLen"] == len(payload)
+    assert seen[0][2]["pPicPackData"] is None
+    assert seen[1][2]["pAlarmData"]["data"] is None
@@ -0,0 +1,169 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+from cida_attendance.core.client import (
+    CircuitBreaker,
+    CircuitOpenError,
+    HttpClient,
+    HttpClientError,
+    InvalidResponseError,
+)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    responses: list[tuple[int, dict, dict]] = []
+    requests: list[dict] = []
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        Handler.requests.append(
+            {"method": self.command, "headers": dict(self.headers), "body": body}
+        )
+        status, payload, headers = Handler.responses.pop(0)
+        if status is None:
+            # Drop the connection without answering.
+            self.close_connection = True
+            return
+        out = (
+            payload
+            if isinstance(payload, bytes)
+            else json.dumps(payload).encode("utf-8")
+        )
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.responses = []
+    Handler.requests = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/sync_attendance.php", Handler
+    httpd.shutdown()
+
+
+def test_post_accepts_async_ingest(server):
+    url, handler = server
+    handler.responses.append((202, {"status": "accepted", "batch_id": 7}, {}))
+
+    client = HttpClient(auth_token="token", url=url)
+    assert client.post({"device_id": "SN1"})["batch_id"] == 7
+
+    headers = handler.requests[0]["headers"]
+    assert headers["Prefer"] == "respond-async"
+    assert headers["Authorization"] == "Bearer token"
+
+
+def test_retries_honour_retry_after(server):
+    url, handler = server
+    handler.responses.append((429, {"error": "Busy"}, {"Retry-After": "3"}))
+    handler.responses.append((503, {"error": "Down"}, {}))
+    handler.responses.append((200, {"status": "ok", "inserted": 1}, {}))
+
+    delays = []
+    client = HttpClient(auth_token="token", url=url, sleep=delays.append)
+    assert client.post({"device_id": "SN1"}) == {"status": "ok", "inserted": 1}
+
+    assert len(handler.requests) == 3
+    assert 3 <= delays[0] <= 3 + client.backoff_base
+    assert 0 <= delays[1] <= client.backoff_base * 2
+
+
+def test_client_errors_are_not_retried(server):
+    url, handler = server
+    handler.responses.append((415, {"error": "Unsupported Content-Type"}, {}))
+
+    client = HttpClient(auth_token="token", url=url, sleep=lambda s: None)
+    with pytest.raises(HttpClientError) as exc:
+        client.post(b"x", content_type="application/x-test")
+    assert exc.value.code == 415
+    assert len(handler.requests) == 1
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    now = [0.0]
+    breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=10, clock=lambda: now[0]
+    )
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now[0] = 10.0
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial call while half-open
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 20.0
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_fails_fast(server):
+    url, handler = server
+    client = HttpClient(auth_token="token", url=url, max_retries=0)
+    for _ in range(client.breaker.failure_threshold):
+        client.breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        client.get()
+    assert handler.requests == []
+
+
+def test_dropped_connection_releases_half_open_trial(server):
+    url, handler = server
+    now = [0.0]
+    client = HttpClient(auth_token="token", url=url, max_retries=0)
+    client.breaker = CircuitBreaker(
+        failure_threshold=1, reset_timeout=10, clock=lambda: now[0]
+    )
+    client.breaker.record_failure()
+    now[0] = 10.0
+
+    handler.responses.append((None, None, {}))
+    with pytest.raises(HttpClientError) as exc:
+        client.get()
+    assert exc.value.code is None
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 20.0
+    handler.responses.append((200, {"status": "ok"}, {}))
+    assert client.get() == {"status": "ok"}
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_invalid_body_on_success_is_not_retried(server):
+    url, handler = server
+    client = HttpClient(auth_token="token", url=url, sleep=lambda s: None)
+    client.breaker = CircuitBreaker(failure_threshold=1)
+
+    # The upload was stored; posting it again would only repeat the work.
+    handler.responses.append((200, b"<html>ok</html>", {}))
+    with pytest.raises(InvalidResponseError) as exc:
+        client.post({"device_id": "SN1"})
+    assert exc.value.code == 200
+    assert len(handler.requests) == 1
+    assert client.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from cida_attendance import config
+
+
+class FakeKeyring:
+    def __init__(self):
+        self.passwords = {}
+        self.get_calls = 0
+
+    def get_password(self, service, user):
+        self.get_calls += 1
+        return self.passwords.get((service, user))
+
+    def set_password(self, service, user, password):
+        self.passwords[(service, user)] = password
+
+
+@pytest.fixture
+def fake_keyring(tmp_path, monkeypatch):
+    keyring = FakeKeyring()
+    monkeypatch.setattr(config, "_keyring", lambda: keyring)
+    monkeypatch.setenv("CONFIG_FILE", str(tmp_path / "config.ini"))
+    config.invalidate_config()
+    config.refresh_secrets()
+    yield keyring
+    config.invalidate_config()
+    config.refresh_secrets()
+
+
+def test_secrets_are_memoized_until_refresh(fake_keyring):
+    config.save_config("http://x", "key", "admin", "secret", "10.0.0.2", 8000, "door")
+
+    for _ in range(3):
+        assert config.load_config()["password"] == "secret"
+        assert config.check_config()
+    assert fake_keyring.get_calls == 0
+
+    fake_keyring.passwords[(config.get_name_app(), "admin")] = "rotated"
+    assert config.load_config()["password"] == "secret"
+
+    config.refresh_secrets()
+    assert config.load_config()["password"] == "rotated"
+    assert fake_keyring.get_calls == 1
+
+
+def test_file_changes_invalidate_parsed_config(fake_keyring):
+    config.save_config("http://x", "key", "admin", "secret", "10.0.0.2", 8000, "door")
+    assert config.load_config()["ip"] == "10.0.0.2"
+
+    filename = config.get_filename()
+    with open(filename) as f:
+        content = f.read()
+    with open(filename, "w") as f:
+        f.write(content.replace("10.0.0.2", "10.0.0.30"))
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert config.load_config()["ip"] == "10.0.0.30"
+
+
+def test_load_config_does_not_mutate_cached_parser(fake_keyring):
+    assert config.load_config()["port"] == 8000
+    assert not config.check_config()
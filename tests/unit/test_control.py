@@ -0,0 +1,64 @@
+import os
+import socket
+import stat
+import tempfile
+
+import pytest
+
+from cida_attendance.core.control import (
+    ControlClient,
+    ControlError,
+    ControlServer,
+    ControlUnavailable,
+)
+
+
+@pytest.fixture
+def sock_path():
+    with tempfile.TemporaryDirectory(dir="/tmp") as tmp:
+        yield os.path.join(tmp, "control.sock")
+
+
+def test_requests_are_dispatched_to_handlers(sock_path):
+    calls = []
+
+    def sync(device=None):
+        calls.append(device)
+        return {"ok": True}
+
+    server = ControlServer({"ping": lambda: {"ok": True}, "sync": sync}, sock_path)
+    assert server.start()
+    try:
+        assert stat.S_IMODE(os.stat(sock_path).st_mode) == 0o600
+        client = ControlClient(sock_path, timeout=5.0)
+        assert client.request("sync", device="10.0.0.5") == {"ok": True}
+        assert client.request("reboot") == {"ok": False, "error": "Invalid request"}
+        assert not client.request("ping", force=True)["ok"]
+    finally:
+        server.close()
+
+    assert calls == ["10.0.0.5"]
+    assert not os.path.exists(sock_path)
+    with pytest.raises(ControlUnavailable):
+        ControlClient(sock_path).request("ping")
+
+
+def test_stale_socket_file_is_replaced(sock_path):
+    open(sock_path, "w").close()
+    server = ControlServer({"ping": lambda: {"ok": True}}, sock_path)
+    assert server.start()
+    try:
+        assert ControlClient(sock_path).request("ping") == {"ok": True}
+        assert not ControlServer({}, sock_path).start()
+    finally:
+        server.close()
+
+
+def test_hung_daemon_is_an_error_not_unavailable(sock_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(sock_path)
+        listener.listen()
+        # Connected but silent: the caller must not run the sync itself.
+        with pytest.raises(ControlError) as excinfo:
+            ControlClient(sock_path, timeout=0.1).request("ping")
+        assert not isinstance(excinfo.value, ControlUnavailable)
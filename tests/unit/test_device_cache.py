@@ -0,0 +1,98 @@
+import datetime
+
+from cida_attendance.core.device_cache import DeviceClock, DeviceMetadataCache
+
+TZ = datetime.timezone(datetime.timedelta(hours=-4), name="VET")
+
+
+class FakeSession:
+    def __init__(self, serial="SN1"):
+        self.serial_number = serial
+        self.calls = {"metadata": 0, "time": 0}
+
+    def get_device_metadata(self):
+        self.calls["metadata"] += 1
+        return {"model": "DS-K1T", "serial": self.serial_number, "firmware": "V1"}
+
+    def get_capabilities(self):
+        return {"isSupportAcsEvent": True}
+
+    def get_device_time(self):
+        self.calls["time"] += 1
+        return datetime.datetime.now(TZ).replace(microsecond=0), TZ
+
+
+def test_metadata_is_fetched_once_and_persisted(tmp_path):
+    path = str(tmp_path / "device_cache.json")
+    session = FakeSession()
+
+    cache = DeviceMetadataCache(path)
+    for _ in range(3):
+        metadata = cache.get_metadata("10.0.0.2:8000", session)
+    assert metadata["model"] == "DS-K1T"
+    assert metadata["capabilities"] == {"isSupportAcsEvent": True}
+    assert session.calls["metadata"] == 1
+
+    DeviceMetadataCache(path).get_metadata("10.0.0.2:8000", session)
+    assert session.calls["metadata"] == 1
+
+
+def test_swapped_device_refreshes_metadata(tmp_path):
+    cache = DeviceMetadataCache(str(tmp_path / "device_cache.json"))
+    cache.get_metadata("10.0.0.2:8000", FakeSession("SN1"))
+
+    other = FakeSession("SN2")
+    assert cache.get_metadata("10.0.0.2:8000", other)["serial"] == "SN2"
+    assert other.calls["metadata"] == 1
+
+
+def test_device_time_is_computed_locally_until_reanchor(tmp_path):
+    path = str(tmp_path / "device_cache.json")
+    session = FakeSession()
+
+    cache = DeviceMetadataCache(path)
+    first, tz = cache.get_device_time("dev", session)
+    second, _ = cache.get_device_time("dev", session)
+    assert session.calls["time"] == 1
+    assert tz == TZ
+    assert second.tzinfo == TZ
+    assert abs((second - first).total_seconds()) <= 1
+
+    # A new process trusts the persisted offset while it is recent.
+    DeviceMetadataCache(path).get_device_time("dev", session)
+    assert session.calls["time"] == 1
+
+    DeviceMetadataCache(path, reanchor_s=0).get_device_time("dev", session)
+    assert session.calls["time"] == 2
+
+
+def test_clock_roundtrip_keeps_offset():
+    local_time = datetime.datetime(2024, 5, 1, 8, 0, 0, tzinfo=TZ)
+    clock = DeviceClock.anchor(local_time, TZ)
+    restored = DeviceClock.from_json(clock.to_json())
+
+    assert restored.offset_s == clock.offset_s
+    assert restored.tz.utcoffset(None) == TZ.utcoffset(None)
+
+
+def test_sync_cursor_from_upload_response(tmp_path):
+    from cida_attendance.core.tasks import update_sync_cursor
+    from cida_attendance.core.wire import AttendanceBatch
+
+    path = str(tmp_path / "device_cache.json")
+    cache = DeviceMetadataCache(path)
+    batch = AttendanceBatch("SN1", "DS-K1T", tz=TZ)
+    batch.append("E1", datetime.datetime(2024, 5, 1, 8, 0, tzinfo=TZ), 1, 75, 41)
+
+    response = {"cursor": {"last_sync": "2024-05-01 08:00:00", "last_serial": 41}}
+    assert update_sync_cursor(cache, "k", "SN1", "http://srv", batch, response, ["f"])
+
+    cursor = DeviceMetadataCache(path).get_sync_cursor("k", "SN1", "http://srv")
+    assert cursor["last_serial"] == 41
+    assert cursor["formats"] == ["f"]
+    assert cache.get_sync_cursor("k", "SN2", "http://srv") is None
+
+    # A cursor behind the uploaded events (or a 202 without one) forces a GET.
+    behind = {"cursor": {"last_sync": "2024-05-01 07:59:59", "last_serial": 40}}
+    assert not update_sync_cursor(cache, "k", "SN1", "http://srv", batch, behind, None)
+    assert cache.get_sync_cursor("k", "SN1", "http://srv") is None
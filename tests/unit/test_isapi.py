@@ -0,0 +1,206 @@
+import asyncio
+import datetime
+import hashlib
+import http.server
+import json
+import threading
+
+import pytest
+
+from cida_attendance.isapi import (
+    AsyncIsapiClient,
+    IsapiClient,
+    IsapiError,
+    IsapiSession,
+)
+from cida_attendance.isapi.digest import parse_challenge
+
+REALM, NONCE, USER, PASSWORD = "DS-K1T", "abc123", "admin", "secret"
+
+DEVICE_INFO = """<?xml version="1.0" encoding="UTF-8"?>
+<DeviceInfo xmlns="http://www.isapi.org/ver20/XMLSchema">
+<deviceName>Lobby</deviceName><model>DS-K1T671</model>
+<serialNumber>DS-K1T6710001</serialNumber><firmwareVersion>V3.2</firmwareVersion>
+</DeviceInfo>"""
+
+TIME = """<Time xmlns="http://www.isapi.org/ver20/XMLSchema">
+<localTime>2024-05-01T12:00:00-04:00</localTime><timeZone>CST+4:00:00</timeZone></Time>"""
+
+
+def make_events(n):
+    tz = datetime.timezone(datetime.timedelta(hours=-4))
+    start = datetime.datetime(2024, 5, 1, 8, tzinfo=tz)
+    return [
+        {
+            "major": 5,
+            "minor": 75,
+            "time": (start + datetime.timedelta(minutes=i)).isoformat(),
+            "employeeNoString": f"E{i % 3}",
+            "serialNo": 100 + i,
+            "attendanceStatus": "checkOut" if i % 2 else "checkIn",
+        }
+        for i in range(n)
+    ]
+
+
+class IsapiStub(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    events: list[dict] = []
+    users: list[dict] = []
+    connections: set = set()
+    challenges = 0
+    nonce = NONCE
+
+    def _authorized(self) -> bool:
+        params = parse_challenge(self.headers.get("Authorization", "")) or {}
+        nonce = IsapiStub.nonce
+        if params.get("username") != USER or params.get("nonce") != nonce:
+            return False
+        ha1 = hashlib.md5(f"{USER}:{REALM}:{PASSWORD}".encode()).hexdigest()
+        ha2 = hashlib.md5(f"{self.command}:{params['uri']}".encode()).hexdigest()
+        expected = hashlib.md5(
+            f"{ha1}:{nonce}:{params['nc']}:{params['cnonce']}:auth:{ha2}".encode()
+        ).hexdigest()
+        return params["response"] == expected
+
+    def _send(self, status, body, content_type="application/xml", headers=()):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        IsapiStub.connections.add(self.client_address)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if not self._authorized():
+            IsapiStub.challenges += 1
+            challenge = f'Digest realm="{REALM}", qop="auth", nonce="{IsapiStub.nonce}", algorithm=MD5'
+            return self._send(401, "", headers=[("WWW-Authenticate", challenge)])
+
+        if self.path == "/ISAPI/System/deviceInfo":
+            return self._send(200, DEVICE_INFO)
+        if self.path == "/ISAPI/System/time":
+            return self._send(200, TIME)
+        if self.path == "/ISAPI/AccessControl/AcsEvent?format=json":
+            cond = json.loads(body)["AcsEventCond"]
+            position, size = cond["searchResultPosition"], cond["maxResults"]
+            page = IsapiStub.events[position : position + size]
+            more = position + len(page) < len(IsapiStub.events)
+            result = {
+                "AcsEvent": {
+                    "searchID": cond["searchID"],
+                    "responseStatusStrg": "MORE" if more else "OK",
+                    "numOfMatches": len(page),
+                    "totalMatches": len(IsapiStub.events),
+                    "InfoList": page,
+                }
+            }
+            return self._send(200, json.dumps(result), "application/json")
+        if self.path == "/ISAPI/AccessControl/UserInfo/Search?format=json":
+            cond = json.loads(body)["UserInfoSearchCond"]
+            position, size = cond["searchResultPosition"], min(cond["maxResults"], 30)
+            page = IsapiStub.users[position : position + size]
+            more = position + len(page) < len(IsapiStub.users)
+            status = "MORE" if more else "OK"
+            result = {
+                "UserInfoSearch": {"responseStatusStrg": status, "UserInfo": page}
+            }
+            return self._send(200, json.dumps(result), "application/json")
+        return self._send(404, "")
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def device():
+    IsapiStub.events = make_events(250)
+    IsapiStub.users = [{"employeeNo": str(i), "name": f"User {i}"} for i in range(75)]
+    IsapiStub.connections = set()
+    IsapiStub.challenges = 0
+    IsapiStub.nonce = NONCE
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), IsapiStub)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield {
+        "ip": "127.0.0.1",
+        "isapi_port": httpd.server_port,
+        "user": USER,
+        "password": PASSWORD,
+    }
+    httpd.shutdown()
+
+
+def test_session_pages_events_over_one_connection(device):
+    with IsapiSession() as session:
+        assert session.login(**device)
+        assert session.serial_number == "DS-K1T6710001"
+        local_time, tz = session.get_device_time()
+        events = list(
+            session.iter_acs_events(local_time - datetime.timedelta(days=1), local_time)
+        )
+
+    assert len(events) == 250
+    assert events[1][0] == "E1" and events[1][2:] == (2, 75, 101)
+    assert events[-1][1] == datetime.datetime.fromisoformat(
+        IsapiStub.events[-1]["time"]
+    )
+    assert IsapiStub.challenges == 1
+    assert len(IsapiStub.connections) == 1
+
+
+def test_wrong_password_is_rejected(device):
+    assert not IsapiSession().login(**{**device, "password": "wrong"})
+
+
+def test_new_nonce_after_reboot_is_answered(device):
+    client = IsapiClient("127.0.0.1", device["isapi_port"], USER, PASSWORD)
+    assert "DS-K1T671" in client.get("/ISAPI/System/deviceInfo")
+
+    # A rebooted device forgets the nonce and challenges again without stale=true.
+    IsapiStub.nonce = "def456"
+    assert "DS-K1T671" in client.get("/ISAPI/System/deviceInfo")
+    assert IsapiStub.challenges == 2
+
+    client.auth.password = "wrong"
+    with pytest.raises(IsapiError):
+        client.get("/ISAPI/System/deviceInfo")
+    assert not client.auth.ready
+
+
+def test_async_client_pages(device):
+    async def collect():
+        client = AsyncIsapiClient(
+            IsapiClient("127.0.0.1", device["isapi_port"], USER, PASSWORD)
+        )
+        end = datetime.datetime(2024, 5, 2, tzinfo=datetime.timezone.utc)
+        pages = [page async for page in client.acs_event_pages(end, end, page_size=100)]
+        info, _ = await asyncio.gather(
+            client.get("/ISAPI/System/deviceInfo"), client.get("/ISAPI/System/time")
+        )
+        client.close()
+        return pages, info
+
+    pages, info = asyncio.run(collect())
+    assert [len(p) for p in pages] == [100, 100, 50]
+    assert "DS-K1T671" in info
+    with pytest.raises(IsapiError):
+        IsapiClient("127.0.0.1", device["isapi_port"], USER, PASSWORD).get(
+            "/ISAPI/missing"
+        )
+
+
+def test_session_pages_users(device):
+    with IsapiSession() as session:
+        assert session.login(**device)
+        users = list(session.iter_users())
+    assert [u["employeeNo"] for u in users] == [str(i) for i in range(75)]
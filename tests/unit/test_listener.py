@@ -0,0 +1,135 @@
+import ctypes
+import datetime
+from concurrent.futures import Future
+
+from cida_attendance import sdk
+from cida_attendance.core.client import HttpClientError
+from cida_attendance.core.listener import AlarmListener, EventBatcher
+from cida_attendance.sdk.bindings import build_datetime_to_net_dvr_time
+
+TZ = datetime.timezone(datetime.timedelta(hours=-4))
+
+
+class FakeCache:
+    def find_by_serial(self, serial):
+        return {"serial": serial, "model": "DS-K1T671"} if serial == "SN1" else None
+
+
+class FakeUploader:
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def submit(self, batch):
+        self.batches.append(batch)
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result({"status": "ok"})
+        return future
+
+
+def push(listener, serial, employee_no, when, major=0x5):
+    alarmer = sdk.NET_DVR_ALARMER()
+    alarmer.bySerialValid = 1
+    ctypes.memmove(alarmer.sSerialNumber, serial.encode(), len(serial))
+
+    extend = sdk.NET_DVR_ACS_EVENT_INFO_EXTEND()
+    ctypes.memmove(extend.byEmployeeNo, employee_no.encode(), len(employee_no))
+    extend.byAttendanceStatus = 1
+
+    info = sdk.NET_DVR_ACS_ALARM_INFO()
+    info.dwMajor = major
+    info.dwMinor = 75
+    build_datetime_to_net_dvr_time(when, info.struTime)
+    info.struAcsEventInfo.dwSerialNo = 42
+    info.byAcsEventInfoExtend = 1
+    ctypes.c_void_p.from_buffer(
+        info, type(info).pAcsEventInfoExtend.offset
+    ).value = ctypes.addressof(extend)
+
+    listener.on_alarm(
+        sdk.COMM_ALARM_ACS,
+        ctypes.pointer(alarmer),
+        ctypes.cast(ctypes.pointer(info), ctypes.c_void_p),
+        ctypes.sizeof(info),
+        None,
+    )
+
+
+def test_pushed_events_are_batched_per_device():
+    uploader = FakeUploader()
+    listener = AlarmListener(uploader, cache=FakeCache(), tz=TZ)
+    when = datetime.datetime(2024, 5, 1, 8, 0, tzinfo=TZ)
+
+    push(listener, "SN1", "E1", when)
+    push(listener, "SN1", "E2", when + datetime.timedelta(minutes=1))
+    push(listener, "SN2", "E1", when)
+    push(listener, "SN2", "E3", when, major=0x2)
+
+    assert listener.flush() == 2
+    first, second = uploader.batches
+    assert (first.device_id, first.device_model) == ("SN1", "DS-K1T671")
+    assert second.device_model == "Unknown"
+    assert list(first.records())[1] == {
+        "employee_id": "E2",
+        "timestamp": "2024-05-01T08:01:00-04:00",
+        "event_type": 1,
+        "event_minor": 75,
+        "serial_no": 42,
+    }
+    assert listener.stats == {
+        "received": 3,
+        "ignored": 1,
+        "uploaded": 3,
+        "failed": 0,
+        "dropped": 0,
+    }
+    assert listener.flush() == 0
+
+
+def test_failed_uploads_are_capped():
+    uploader = FakeUploader(error=OSError("server down"))
+    listener = AlarmListener(uploader, cache=FakeCache(), tz=TZ, max_pending=3)
+    when = datetime.datetime(2024, 5, 1, 8, 0, tzinfo=TZ)
+
+    for minute in range(5):
+        push(listener, "SN1", f"E{minute}", when + datetime.timedelta(minutes=minute))
+        listener.flush(force=True)
+
+    assert len(uploader.batches[-1]) == 3
+    assert listener.batcher.pending == 3
+    assert listener.stats["dropped"] == 2
+
+
+def test_failed_device_backs_off():
+    now = [0.0]
+    uploader = FakeUploader(error=OSError("server down"))
+    batcher = EventBatcher(
+        uploader, flush_s=5, cache=FakeCache(), tz=TZ, clock=lambda: now[0]
+    )
+    when = datetime.datetime(2024, 5, 1, 8, 0, tzinfo=TZ)
+    batcher.add("SN1", ("E1", when, 1, 75))
+
+    # 5 s, then 10 s after the second consecutive failure.
+    assert batcher.flush() == 1
+    now[0] = 4.9
+    assert batcher.flush() == 0
+    now[0] = 5.0
+    assert batcher.flush() == 1
+    now[0] = 14.9
+    assert batcher.flush() == 0
+
+    # The server's Retry-After wins; a success resets the device.
+    uploader.error = HttpClientError("HTTP error: 503", code=503, retry_after=60)
+    now[0] = 15.0
+    assert batcher.flush() == 1
+    now[0] = 74.9
+    assert batcher.flush() == 0
+    uploader.error = None
+    now[0] = 75.0
+    assert batcher.flush() == 1
+    batcher.add("SN1", ("E2", when, 1, 75))
+    assert batcher.flush() == 1
+    assert batcher.pending == 0
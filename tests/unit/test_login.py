@@ -0,0 +1,110 @@
+import ctypes
+import threading
+
+from cida_attendance import sdk
+from cida_attendance.sdk import bindings, login
+
+
+def make_config(ip, **extra):
+    return {"ip": ip, "port": 8000, "user": "admin", "password": "secret", **extra}
+
+
+def test_logins_complete_independently(monkeypatch):
+    logged_out = []
+
+    def fake_login(info_ref, device_info_ref):
+        info = info_ref._obj
+        assert info.bUseAsynLogin == 1
+        ip = info.sDeviceAddress.decode()
+        if ip == "10.0.0.3":
+            return -1
+        if ip == "10.0.0.2":
+            return 0  # never answers
+
+        device_info = sdk.NET_DVR_DEVICEINFO_V30()
+        serial = b"SN-" + ip.encode()
+        ctypes.memmove(device_info.sSerialNumber, serial, len(serial))
+        callback, token = info.cbLoginResult, info.pUser
+        threading.Timer(
+            0.01, lambda: callback(7, 1, ctypes.pointer(device_info), token)
+        ).start()
+        return 0
+
+    monkeypatch.setattr(sdk, "NET_DVR_Login_V40", fake_login, raising=False)
+    monkeypatch.setattr(sdk, "NET_DVR_Logout", logged_out.append, raising=False)
+    monkeypatch.setattr(login, "get_last_error", lambda: (7, "connect failed"))
+
+    reported = []
+    results = login.login_many(
+        [
+            make_config("10.0.0.1"),
+            make_config("10.0.0.2", login_timeout_s=0.2),
+            make_config("10.0.0.3"),
+        ],
+        timeout_s=5.0,
+        on_result=lambda r: reported.append(r.config["ip"]),
+    )
+
+    assert [(r.user_id, r.serial_number) for r in results] == [
+        (7, "SN-10.0.0.1"),
+        (-1, None),
+        (-1, None),
+    ]
+    assert results[0].ok and not results[1].ok
+    assert results[1].error == (-1, "Login timed out")
+    assert results[2].error == (7, "connect failed")
+    assert reported == ["10.0.0.3", "10.0.0.1", "10.0.0.2"]
+    assert logged_out == []
+
+
+def test_sdk_is_initialized_once_per_process(monkeypatch):
+    calls = []
+    monkeypatch.setattr(bindings, "_init_refs", 0)
+    monkeypatch.setattr(bindings, "_init_sdk", lambda: calls.append("init"))
+    monkeypatch.setattr(
+        sdk, "NET_DVR_Cleanup", lambda: calls.append("cleanup"), raising=False
+    )
+
+    bindings.init_dll()
+    bindings.init_dll()
+    bindings.cleanup_dll()
+    assert calls == ["init"]
+    bindings.cleanup_dll()
+    bindings.cleanup_dll()
+    assert calls == ["init", "cleanup"]
+
+
+def test_late_logins_are_logged_out_in_their_generation(monkeypatch):
+    pending = []
+    logged_out = []
+
+    def fake_login(info_ref, device_info_ref):
+        info = info_ref._obj
+        pending.append((info.cbLoginResult, info.pUser))
+        return 0
+
+    monkeypatch.setattr(bindings, "_init_refs", 0)
+    monkeypatch.setattr(bindings, "_init_sdk", lambda: None)
+    monkeypatch.setattr(sdk, "NET_DVR_Cleanup", lambda: None, raising=False)
+    monkeypatch.setattr(sdk, "NET_DVR_Login_V40", fake_login, raising=False)
+    monkeypatch.setattr(sdk, "NET_DVR_Logout", logged_out.append, raising=False)
+
+    def late_login(user_id):
+        callback, token = pending.pop()
+        callback(user_id, 1, ctypes.pointer(sdk.NET_DVR_DEVICEINFO_V30()), token)
+
+    bindings.init_dll()
+    results = login.login_many([make_config("10.0.0.1")], timeout_s=0.05)
+    assert not results[0].ok
+    late_login(3)
+    bindings.cleanup_dll()
+    assert logged_out == [3]
+
+    bindings.init_dll()
+    login.login_many([make_config("10.0.0.1")], timeout_s=0.05)
+    late_login(4)
+    # The same id from an earlier initialization must be left alone.
+    login._orphans.append((bindings.sdk_generation() - 1, 5))
+    login.login_many([], timeout_s=0.05)
+    bindings.cleanup_dll()
+    assert logged_out == [3, 4]
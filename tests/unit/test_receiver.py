@@ -0,0 +1,149 @@
+import datetime
+import http.client
+import json
+from concurrent.futures import Future
+
+from cida_attendance.isapi.receiver import DedupeWindow, NotificationReceiver
+
+TZ = datetime.timezone(datetime.timedelta(hours=-4))
+
+
+class FakeCache:
+    def __init__(self):
+        self.lookups = 0
+
+    def get_metadata(self, key, session):
+        self.lookups += 1
+        assert key == "127.0.0.1:8000"
+        return {"serial": "SN1", "model": "DS-K1T671", "name": "Lobby"}
+
+    def find_by_serial(self, serial):
+        return None
+
+
+class FakeUploader:
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def submit(self, batch):
+        self.batches.append(batch)
+        future = Future()
+        if self.error is not None:
+            future.set_exception(self.error)
+        else:
+            future.set_result({"status": "ok"})
+        return future
+
+
+def alert(serial_no, event_type="AccessControllerEvent"):
+    return json.dumps(
+        {
+            "ipAddress": "127.0.0.1",
+            "dateTime": f"2024-05-01T08:{serial_no:02d}:00-04:00",
+            "eventType": event_type,
+            "AccessControllerEvent": {
+                "majorEventType": 5,
+                "subEventType": 75,
+                "employeeNoString": f"E{serial_no}",
+                "serialNo": serial_no,
+                "attendanceStatus": "checkIn",
+            },
+        }
+    ).encode()
+
+
+def form_data(body):
+    boundary = "----hik"
+    data = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="AccessControllerEvent"\r\n'
+        "Content-Type: application/json\r\n\r\n"
+    ).encode() + body
+    data += (
+        (
+            f"\r\n--{boundary}\r\n"
+            'Content-Disposition: form-data; name="Picture"; filename="Picture.jpg"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n"
+        ).encode()
+        + b"\xff\xd8"
+        + b"\x00" * 50_000
+        + b"\xff\xd9"
+    )
+    data += f"\r\n--{boundary}--\r\n".encode()
+    return data, f"multipart/form-data; boundary={boundary}"
+
+
+def test_notifications_are_acknowledged_deduplicated_and_batched():
+    uploader, cache = FakeUploader(), FakeCache()
+    devices = [
+        {"ip": "127.0.0.1", "port": 8000, "name": "", "user": "admin", "password": ""}
+    ]
+    receiver = NotificationReceiver(
+        uploader, devices, host="127.0.0.1", port=0, cache=cache, tz=TZ, flush_s=60
+    )
+    with receiver:
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port, timeout=5)
+        requests = [
+            (alert(1), "application/json"),
+            form_data(alert(2)),
+            (alert(1), "application/json"),  # retried by the terminal
+            (alert(3, event_type="heartBeat"), "application/json"),
+            (b"<not xml", "application/xml"),
+        ]
+        for body, content_type in requests:
+            conn.request("POST", "/event", body, {"Content-Type": content_type})
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 200
+        conn.close()
+
+    assert cache.lookups == 1
+    assert receiver.stats["requests"] == 5
+    assert receiver.stats["events"] == 2
+    assert receiver.stats["duplicates"] == 1
+    assert receiver.stats["other"] == 1
+    (batch,) = uploader.batches
+    assert batch.device_id == "SN1" and batch.device_name == "Lobby"
+    assert len(batch) == 2
+
+
+def test_unreachable_server_backs_pressure_onto_terminals():
+    uploader = FakeUploader(error=OSError("server down"))
+    devices = [
+        {"ip": "127.0.0.1", "port": 8000, "name": "", "user": "admin", "password": ""}
+    ]
+    receiver = NotificationReceiver(
+        uploader,
+        devices,
+        host="127.0.0.1",
+        port=0,
+        cache=FakeCache(),
+        flush_s=60,
+        max_pending=2,
+    )
+    with receiver:
+        conn = http.client.HTTPConnection("127.0.0.1", receiver.port, timeout=5)
+
+        def post(serial_no):
+            conn.request(
+                "POST", "/event", alert(serial_no), {"Content-Type": "application/json"}
+            )
+            response = conn.getresponse()
+            response.read()
+            return response.status
+
+        assert [post(1), post(2), post(3)] == [200, 200, 503]
+        receiver.batcher.flush()  # fails and is held for the next flush
+        assert post(3) == 503
+        conn.close()
+
+    assert receiver.batcher.pending == 2
+    assert receiver.stats["rejected"] == 2
+
+
+def test_dedupe_window_forgets_old_keys():
+    window = DedupeWindow(size=2)
+    assert window.add(1) and window.add(2) and not window.add(1)
+    assert window.add(3)
+    assert window.add(2)
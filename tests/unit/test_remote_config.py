@@ -0,0 +1,177 @@
+import ctypes
+import threading
+import time
+
+import pytest
+
+from cida_attendance import sdk
+from cida_attendance.sdk import bindings, remote_config
+from cida_attendance.sdk.capture import CaptureWriter
+from cida_attendance.sdk.remote_config import RemoteConfigError, RemoteConfigStream
+
+
+class FakeDevice:
+    """Answers NET_DVR_StartRemoteConfig from a thread, like the SDK."""
+
+    def __init__(self, monkeypatch, records, final_status=1000, error=0, delay=0.0):
+        self.records = records
+        self.final_status = final_status
+        self.error = error
+        self.delay = delay
+        self.callbacks = []
+        self.stopped = threading.Event()
+        self.sent = 0
+        monkeypatch.setattr(sdk, "NET_DVR_StartRemoteConfig", self.start, raising=False)
+        monkeypatch.setattr(sdk, "NET_DVR_StopRemoteConfig", self.stop, raising=False)
+
+    def start(self, user_id, command, cond, cond_size, callback, user_data):
+        self.callbacks.append(callback)
+        token = user_data.value
+        threading.Thread(target=self._run, args=(callback, token), daemon=True).start()
+        return 3
+
+    def stop(self, handle):
+        self.stopped.set()
+        return True
+
+    def _run(self, callback, token):
+        for number in self.records:
+            if self.stopped.is_set():
+                return
+            time.sleep(self.delay)
+            record = sdk.NET_DVR_CARD_RECORD()
+            card_no = f"C{number:05d}".encode()
+            ctypes.memmove(record.byCardNo, card_no, len(card_no))
+            record.dwEmployeeNo = number
+            callback(
+                sdk.NET_SDK_CALLBACK_TYPE_DATA,
+                ctypes.addressof(record),
+                ctypes.sizeof(record),
+                token,
+            )
+            self.sent += 1
+        status = self.final_status.to_bytes(4, "little") + self.error.to_bytes(
+            4, "little"
+        )
+        buffer = ctypes.create_string_buffer(status)
+        callback(sdk.NET_SDK_CALLBACK_TYPE_STATUS, ctypes.addressof(buffer), 8, token)
+
+
+def test_stream_yields_copies_with_backpressure(monkeypatch):
+    device = FakeDevice(monkeypatch, range(50))
+    stream = RemoteConfigStream(
+        1,
+        sdk.NET_DVR_GET_CARD,
+        sdk.NET_DVR_CARD_COND(),
+        record_cls=sdk.NET_DVR_CARD_RECORD,
+        max_pending=4,
+    )
+    numbers = []
+    with stream:
+        for card in stream:
+            # The producer never gets more than the queue ahead of us.
+            assert device.sent - len(numbers) <= 5
+            numbers.append(card.dwEmployeeNo)
+            time.sleep(0.001)
+
+    assert numbers == list(range(50))
+    assert bytes(card.byCardNo).rstrip(b"\x00") == b"C00049"
+    assert stream.stats["records"] == 50
+    assert stream.stats["bytes"] == 50 * ctypes.sizeof(sdk.NET_DVR_CARD_RECORD)
+    assert stream.stats["status"] == "success"
+    assert stream.stats["blocked_s"] > 0
+    assert device.stopped.is_set()
+
+
+def test_failure_status_and_cancel(monkeypatch):
+    FakeDevice(monkeypatch, range(3), final_status=1002, error=1900)
+    with RemoteConfigStream(1, sdk.NET_DVR_GET_CARD) as stream:
+        with pytest.raises(RemoteConfigError) as excinfo:
+            list(stream)
+    assert excinfo.value.status == 1002 and excinfo.value.error == 1900
+    assert stream.stats["records"] == 3
+
+    device = FakeDevice(monkeypatch, range(10_000))
+    with RemoteConfigStream(
+        1, sdk.NET_DVR_GET_CARD, max_pending=2, timeout_s=5
+    ) as stream:
+        next(stream)
+        stream.cancel()
+        started = time.monotonic()
+        assert list(stream) == []
+        assert time.monotonic() - started < 1
+    assert device.stopped.is_set() and device.sent < 10_000
+
+    # Cancelling from another thread wakes a consumer waiting for records.
+    monkeypatch.setattr(
+        sdk, "NET_DVR_StartRemoteConfig", lambda *args: 4, raising=False
+    )
+    with RemoteConfigStream(1, sdk.NET_DVR_GET_CARD, timeout_s=5) as stream:
+        threading.Timer(0.05, stream.cancel).start()
+        started = time.monotonic()
+        assert list(stream) == []
+        assert time.monotonic() - started < 1
+    # Both streams went through the one shared thunk.
+    assert remote_config._callback is not None
+    assert not remote_config._streams
+
+
+def test_callback_front_end_reports_status(monkeypatch):
+    # timeout_s is an idle timeout: this download outlasts it in total.
+    FakeDevice(monkeypatch, range(10), delay=0.03)
+    statuses, data = [], []
+    bindings.build_net_dvr_remoteconfig(
+        1,
+        sdk.NET_DVR_GET_CARD,
+        sdk.NET_DVR_CARD_COND(),
+        on_status=lambda status, error: statuses.append((status, error)),
+        on_data=lambda record: data.append(record.dwEmployeeNo),
+        data_cls=sdk.NET_DVR_CARD_RECORD,
+        timeout_s=0.2,
+    )
+    assert data == list(range(10))
+    assert statuses == [(1000, 0)]
+
+    FakeDevice(monkeypatch, range(5), final_status=1002, error=7)
+    statuses, data = [], []
+    bindings.build_net_dvr_remoteconfig(
+        1,
+        sdk.NET_DVR_GET_CARD,
+        sdk.NET_DVR_CARD_COND(),
+        on_status=lambda status, error: statuses.append((status, error)),
+        on_data=lambda record: data.append(record.dwEmployeeNo),
+        data_cls=sdk.NET_DVR_CARD_RECORD,
+        timeout_s=5,
+    )
+    assert data == [0, 1, 2, 3, 4]
+    assert statuses == [(1002, 7)]
+
+
+def test_replay_runs_through_the_stream(monkeypatch, tmp_path):
+    path = tmp_path / "cards.cap"
+    with CaptureWriter(path) as writer:
+        for final_status in (1002, 1000):
+            FakeDevice(monkeypatch, range(3), final_status=final_status)
+            bindings.build_net_dvr_remoteconfig(
+                1,
+                sdk.NET_DVR_GET_CARD,
+                sdk.NET_DVR_CARD_COND(),
+                data_cls=sdk.NET_DVR_CARD_RECORD,
+                timeout_s=5,
+                capture=writer,
+            )
+
+    # Replay must not reach the SDK; the captured callbacks go to the thunk.
+    monkeypatch.setattr(sdk, "NET_DVR_StartRemoteConfig", None, raising=False)
+    statuses, data = [], []
+    count = bindings.replay_net_dvr_remoteconfig(
+        path,
+        on_status=lambda status, error: statuses.append(status),
+        on_data=lambda record: data.append(record.dwEmployeeNo),
+        data_cls=sdk.NET_DVR_CARD_RECORD,
+        speed=None,
+    )
+    assert count == 8
+    assert data == [0, 1, 2, 0, 1, 2]
+    assert statuses == [1002, 1000]
+    assert not remote_config._streams
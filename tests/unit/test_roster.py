@@ -0,0 +1,89 @@
+import ctypes
+
+import pytest
+
+from cida_attendance import sdk
+from cida_attendance.core.roster import RosterSnapshot
+from cida_attendance.sdk.bindings import SDKError
+from cida_attendance.sdk.session import card_from_record
+
+
+def users(n, renamed=(), skip=()):
+    for i in range(n):
+        if i in skip:
+            continue
+        yield {
+            "employeeNo": f"{i:05d}",
+            "name": f"Empleado {i}" + (" (nuevo)" if i in renamed else ""),
+            "userType": "normal",
+            "Valid": {"enable": True, "beginTime": "2024-01-01T00:00:00"},
+        }
+
+
+def test_repeat_runs_only_rewrite_changes(tmp_path):
+    with RosterSnapshot(str(tmp_path / "roster.sqlite3")) as snapshot:
+        first = snapshot.update("users", "SN1", users(50_000))
+        assert (first.added, first.changed, first.unchanged, first.removed) == (
+            50_000,
+            0,
+            0,
+            0,
+        )
+
+        second = snapshot.update(
+            "users", "SN1", users(50_000, renamed={7, 9}, skip={3})
+        )
+        assert (second.added, second.changed, second.unchanged, second.removed) == (
+            0,
+            2,
+            49_997,
+            1,
+        )
+        assert [
+            u["employeeNo"] for u in snapshot.changes("users", "SN1", second.run)
+        ] == [
+            "00007",
+            "00009",
+        ]
+        assert snapshot.count("users", "SN1") == 49_999
+
+        snapshot.update("users", "SN2", users(10))
+        found = snapshot.find_employee("00007")
+        assert [u["device"] for u in found["users"]] == ["SN1", "SN2"]
+        assert found["users"][0]["name"] == "Empleado 7 (nuevo)"
+
+
+def test_failed_download_keeps_previous_snapshot(tmp_path):
+    def broken():
+        yield from users(10)
+        raise SDKError(7, "connection lost")
+
+    with RosterSnapshot(str(tmp_path / "roster.sqlite3")) as snapshot:
+        snapshot.update("users", "SN1", users(20))
+        with pytest.raises(SDKError):
+            snapshot.update("users", "SN1", broken(), chunk_size=4)
+        assert snapshot.count("users", "SN1") == 20
+        with pytest.raises(ValueError):
+            snapshot.count("users; DROP TABLE users")
+
+
+def test_card_record_uses_isapi_names():
+    record = sdk.NET_DVR_CARD_RECORD()
+    ctypes.memmove(record.byCardNo, b"0012345678", 10)
+    name = "Peña".encode()
+    ctypes.memmove(record.byName, name, len(name))
+    record.dwEmployeeNo = 42
+    record.byCardType = 1
+    record.struValid.byEnable = 1
+    record.struValid.struBeginTime.wYear = 2024
+    record.struValid.struBeginTime.byMonth = 1
+    record.struValid.struBeginTime.byDay = 2
+
+    card = card_from_record(record)
+    assert card["cardNo"] == "0012345678" and card["employeeNo"] == "42"
+    assert card["name"] == "Peña"
+    assert card["Valid"] == {
+        "enable": True,
+        "beginTime": "2024-01-02T00:00:00",
+        "endTime": None,
+    }
@@ -0,0 +1,118 @@
+import datetime
+from concurrent.futures import Future
+
+import cida_attendance.isapi
+from cida_attendance.core import tasks
+from cida_attendance.core.client import HttpClientError
+from cida_attendance.core.wire import NDJSON_CONTENT_TYPE, AttendanceBatch
+
+TZ = datetime.timezone(datetime.timedelta(hours=-4))
+
+
+class FailingUploader:
+    def __init__(self, client, preferred="auto"):
+        self.futures = []
+
+    def submit(self, batch):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def close(self):
+        for future in self.futures:
+            future.set_exception(HttpClientError("HTTP error: 500", code=500))
+
+
+def test_failed_shared_upload_fails_the_sweep(monkeypatch):
+    devices = [
+        {
+            "ip": f"10.0.0.{i}",
+            "port": 80,
+            "backend": "isapi",
+            "url": "http://s",
+            "api_key": "k",
+        }
+        for i in (1, 2)
+    ]
+    monkeypatch.setattr(tasks, "select_devices", lambda device=None: devices)
+    monkeypatch.setattr(tasks, "init_dll", lambda: None)
+    monkeypatch.setattr(tasks, "cleanup_dll", lambda: None)
+    monkeypatch.setattr(tasks, "BatchUploader", FailingUploader)
+    # Both devices read fine; the upload they share fails after they return.
+    monkeypatch.setattr(
+        tasks,
+        "synchronize",
+        lambda config, uploader, login=None: uploader.submit(config),
+    )
+
+    assert tasks.synchronize_all() is False
+
+    monkeypatch.setattr(tasks, "synchronize", lambda config, uploader, login=None: True)
+    assert tasks.synchronize_all() is True
+
+
+class FakeIsapiSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def login(self, **config):
+        return True
+
+    def logout(self):
+        return True
+
+    def iter_acs_events(self, start, end, major=0x5):
+        yield "E1", datetime.datetime(2024, 5, 1, 8, tzinfo=TZ), 1, 75
+
+
+class FakeCache:
+    def get_metadata(self, key, session):
+        return {"model": "DS-K1T", "serial": "SN1"}
+
+    def get_device_time(self, key, session):
+        return datetime.datetime(2024, 5, 2, tzinfo=TZ), TZ
+
+    def get_sync_cursor(self, key, serial, url):
+        return None
+
+    def clear_sync_cursor(self, key):
+        pass
+
+
+class FakeClient:
+    url = "http://s"
+
+    def get(self, **params):
+        # Cold start against a server that accepts NDJSON.
+        return {"last_sync": None, "formats": [NDJSON_CONTENT_TYPE]}
+
+
+class RecordingUploader:
+    client = FakeClient()
+    server_formats = None
+
+    def __init__(self):
+        self.batches = []
+
+    def submit(self, batch):
+        self.batches.append(batch)
+        return Future()
+
+
+def test_shared_upload_never_streams_ndjson(monkeypatch):
+    monkeypatch.setattr(cida_attendance.isapi, "IsapiSession", FakeIsapiSession)
+    config = {
+        "ip": "10.0.0.1",
+        "port": 80,
+        "name": "Lobby",
+        "backend": "isapi",
+        "upload_format": "ndjson",
+    }
+    uploader = RecordingUploader()
+
+    assert isinstance(tasks.synchronize(config, uploader, FakeCache()), Future)
+    [batch] = uploader.batches
+    assert isinstance(batch, AttendanceBatch) and len(batch) == 1
@@ -0,0 +1,95 @@
+import datetime
+import json
+
+from cida_attendance.core.client import HttpClientError
+from cida_attendance.core.uploader import BatchUploader
+from cida_attendance.core.wire import (
+    COLUMNAR_CONTENT_TYPE,
+    ENVELOPE_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    AttendanceBatch,
+)
+
+TZ = datetime.timezone.utc
+
+
+class FakeClient:
+    url = "http://server/sync"
+
+    def __init__(self, reject_envelope=False):
+        self.reject_envelope = reject_envelope
+        self.posts = []
+
+    def post(self, body, content_type=JSON_CONTENT_TYPE):
+        self.posts.append((content_type, json.loads(body)))
+        if content_type == ENVELOPE_CONTENT_TYPE:
+            if self.reject_envelope:
+                raise HttpClientError("Unsupported Media Type", code=415)
+            return {
+                "status": "ok",
+                "results": [
+                    {
+                        "device_id": b["device_id"],
+                        "status": "ok",
+                        "inserted": len(b["time"]),
+                    }
+                    if b["device_id"] != "BAD"
+                    else {
+                        "device_id": "BAD",
+                        "status": "error",
+                        "code": 400,
+                        "error": "bad",
+                    }
+                    for b in json.loads(body)["batches"]
+                ],
+            }
+        return {"status": "ok", "inserted": len(json.loads(body)["records"])}
+
+
+def make_batch(serial, n):
+    batch = AttendanceBatch(serial, "DS-K1T", serial, TZ)
+    for i in range(n):
+        batch.append("E1", datetime.datetime(2024, 5, 1, 8, i, tzinfo=TZ), 1, 75)
+    return batch
+
+
+def test_batches_within_window_share_one_request():
+    client = FakeClient()
+    formats = [JSON_CONTENT_TYPE, COLUMNAR_CONTENT_TYPE, ENVELOPE_CONTENT_TYPE]
+    with BatchUploader(client, formats, window_s=60, preferred="columnar") as uploader:
+        futures = [uploader.submit(make_batch(f"SN{i}", i + 1)) for i in range(3)]
+
+    assert uploader.requests == 1
+    ((content_type, body),) = client.posts
+    assert content_type == ENVELOPE_CONTENT_TYPE
+    assert [b["device_id"] for b in body["batches"]] == ["SN0", "SN1", "SN2"]
+    assert [f.result()["inserted"] for f in futures] == [1, 2, 3]
+
+
+def test_envelope_rejected_falls_back_to_one_request_per_batch():
+    client = FakeClient(reject_envelope=True)
+    formats = [JSON_CONTENT_TYPE, ENVELOPE_CONTENT_TYPE]
+    with BatchUploader(client, formats, window_s=60) as uploader:
+        futures = [uploader.submit(make_batch(f"SN{i}", 2)) for i in range(2)]
+
+    assert [content_type for content_type, _ in client.posts] == [
+        ENVELOPE_CONTENT_TYPE,
+        JSON_CONTENT_TYPE,
+        JSON_CONTENT_TYPE,
+    ]
+    assert not uploader.envelope_supported
+    assert [f.result()["inserted"] for f in futures] == [2, 2]
+
+
+def test_rejected_batch_fails_only_its_future():
+    client = FakeClient()
+    formats = [JSON_CONTENT_TYPE, COLUMNAR_CONTENT_TYPE, ENVELOPE_CONTENT_TYPE]
+    with BatchUploader(client, formats, window_s=60) as uploader:
+        good, bad = (
+            uploader.submit(make_batch("SN1", 2)),
+            uploader.submit(make_batch("BAD", 1)),
+        )
+
+    assert good.result()["inserted"] == 2
+    error = bad.exception()
+    assert isinstance(error, HttpClientError) and error.code == 400
@@ -0,0 +1,113 @@
+import datetime
+import json
+
+from cida_attendance.core.wire import (
+    BINARY_CONTENT_TYPE,
+    COLUMNAR_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    NDJSON_CONTENT_TYPE,
+    AttendanceBatch,
+    choose_format,
+)
+
+TZ = datetime.timezone(datetime.timedelta(hours=-4))
+
+
+def make_batch(n=3):
+    batch = AttendanceBatch("SN1", "DS-K1T", "Lobby", TZ)
+    start = datetime.datetime(2024, 5, 1, 8, 0, 0, tzinfo=TZ)
+    for i in range(n):
+        batch.append(f"E{i % 2}", start + datetime.timedelta(minutes=i), 1, 75)
+    return batch
+
+
+def test_records_match_legacy_shape():
+    batch = make_batch()
+    assert batch.employees == ["E0", "E1"]
+    assert batch.to_json()["records"][1] == {
+        "employee_id": "E1",
+        "timestamp": "2024-05-01T08:01:00-04:00",
+        "event_type": 1,
+        "event_minor": 75,
+    }
+
+
+def test_binary_roundtrip():
+    batch = make_batch(10)
+    body, content_type = batch.encode("binary")
+    assert content_type == BINARY_CONTENT_TYPE
+
+    decoded = AttendanceBatch.from_binary(body)
+    assert decoded.to_json() == batch.to_json()
+    assert decoded.tz_offset == -4 * 3600
+
+
+def test_columnar_is_smaller_than_json():
+    batch = make_batch(500)
+    legacy, _ = batch.encode("json")
+    columnar, content_type = batch.encode("columnar")
+    binary, _ = batch.encode("binary")
+
+    assert content_type == COLUMNAR_CONTENT_TYPE
+    assert json.loads(columnar)["time"][0] == int(
+        datetime.datetime(2024, 5, 1, 8, 0, 0, tzinfo=TZ).timestamp()
+    )
+    assert len(columnar) * 3 < len(legacy)
+    assert len(binary) * 5 < len(legacy)
+
+
+def test_choose_format_negotiation():
+    assert choose_format(None) == "json"
+    assert choose_format([JSON_CONTENT_TYPE, COLUMNAR_CONTENT_TYPE]) == "columnar"
+    assert choose_format([BINARY_CONTENT_TYPE, COLUMNAR_CONTENT_TYPE]) == "binary"
+    assert choose_format([COLUMNAR_CONTENT_TYPE], preferred="binary") == "json"
+    assert choose_format([BINARY_CONTENT_TYPE], preferred="json") == "json"
+    # NDJSON only fits streamed uploads; batches fall back to the best other format.
+    both = [NDJSON_CONTENT_TYPE, BINARY_CONTENT_TYPE]
+    assert choose_format(both, preferred="ndjson") == "binary"
+    assert choose_format(both, preferred="ndjson", streaming=True) == "ndjson"
+
+
+def test_ndjson_stream_ends_with_count_trailer():
+    lines = b"".join(make_batch(3).iter_ndjson()).splitlines()
+    assert json.loads(lines[0])["device_id"] == "SN1"
+    assert json.loads(lines[-1]) == {"end": True, "count": 3}
+    assert len(lines) == 5
+
+
+def test_ndjson_upload_stream_feeds_chunked_post():
+    from cida_attendance.core.tasks import NdjsonUploadStream
+
+    class FakeClient:
+        body = b""
+
+        def post_stream(self, chunks, content_type):
+            assert content_type == "application/x-ndjson"
+            FakeClient.body = b"".join(chunks)
+            return {"status": "ok"}
+
+    stream = NdjsonUploadStream(FakeClient(), "SN1", "DS-K1T", queue_size=2)
+    start = datetime.datetime(2024, 5, 1, 8, 0, 0, tzinfo=TZ)
+    for i in range(10):
+        stream.append("E1", start + datetime.timedelta(seconds=i), 1, 75)
+
+    assert stream.finish() == {"status": "ok"}
+    lines = FakeClient.body.splitlines()
+    assert len(lines) == 12
+    assert json.loads(lines[1])["timestamp"] == "2024-05-01T08:00:00-04:00"
+    assert json.loads(lines[-1]) == {"end": True, "count": 10}
+
+
+def test_serial_numbers_are_optional_columns():
+    batch = make_batch(2)
+    assert "serial" not in batch.to_columnar()
+    assert AttendanceBatch.from_binary(batch.to_binary()).max_serial() is None
+
+    batch.append("E1", datetime.datetime(2024, 5, 1, 9, 0, tzinfo=TZ), 1, 75, 99)
+    assert batch.to_columnar()["serial"] == [0, 0, 99]
+    assert list(batch.records())[-1]["serial_no"] == 99
+    assert "serial_no" not in list(batch.records())[0]
+
+    decoded = AttendanceBatch.from_binary(batch.to_binary())
+    assert decoded.max_serial() == 99
+    assert decoded.to_json() == batch.to_json()
@@ -0,0 +1,62 @@
+import datetime
+import queue
+
+from cida_attendance.core.client import HttpClientError
+from cida_attendance.core.wire import AttendanceBatch
+from cida_attendance.core.workers import QueueUploader, _Replies, assign_devices
+
+
+def make_devices(n):
+    return [
+        {
+            "ip": f"10.0.{i // 256}.{i % 256}",
+            "port": 8000,
+            "url": "http://s",
+            "api_key": "k",
+        }
+        for i in range(n)
+    ]
+
+
+def shard_of(shards):
+    return {(c["ip"], c["port"]): i for i, configs in shards.items() for c in configs}
+
+
+def test_consistent_hashing_moves_few_devices():
+    devices = make_devices(400)
+    before = shard_of(assign_devices(devices, 4))
+    assert len(set(before.values())) == 4
+
+    after = shard_of(assign_devices(devices, 5))
+    moved = [key for key in before if before[key] != after[key]]
+    assert all(after[key] == 4 for key in moved)
+    assert len(moved) < len(devices) / 3
+
+    grown = shard_of(assign_devices(devices + make_devices(401)[400:], 4))
+    assert all(grown[key] == before[key] for key in before)
+
+
+def test_queue_uploader_resolves_futures_from_replies():
+    uploads, replies = queue.Queue(), queue.Queue()
+    pending = _Replies(replies)
+    uploader = QueueUploader(2, make_devices(1)[0], uploads, pending)
+
+    batch = AttendanceBatch("SN1", "DS-K1T", "Lobby", datetime.timezone.utc)
+    batch.append(
+        "E1", datetime.datetime(2024, 5, 1, 8, tzinfo=datetime.timezone.utc), 1, 75
+    )
+    ok, failed = uploader.submit(batch), uploader.submit(batch)
+
+    index, first_id, server, _, _, body = uploads.get_nowait()
+    _, second_id, *_ = uploads.get_nowait()
+    assert (index, server) == (2, ("http://s", "k"))
+    assert AttendanceBatch.from_binary(body).to_json() == batch.to_json()
+
+    replies.put(((0, first_id[1]), True, {"status": "stale"}))
+    replies.put((first_id, True, {"status": "ok"}))
+    replies.put((second_id, False, ("Service Unavailable", 503)))
+    pending.wait_all(timeout=1.0)
+
+    assert ok.result() == {"status": "ok"}
+    assert isinstance(failed.exception(), HttpClientError)
+    assert failed.exception().code == 503
@@ -0,0 +1,74 @@
+import io
+
+from cida_attendance.sdk.session import get_values_from_xml
+from cida_attendance.sdk.xmlstream import (
+    find_xml_values,
+    iter_xml_records,
+    iter_xml_values,
+)
+
+DEVICE_INFO = """<?xml version="1.0" encoding="UTF-8"?>
+<DeviceInfo version="2.0" xmlns="http://www.isapi.org/ver20/XMLSchema">
+<deviceName>Access Controller</deviceName>
+<model>DS-K1T671M</model>
+<serialNumber>DS-K1T671M20210101V030000ENG12345678</serialNumber>
+<firmwareVersion>V3.2.30</firmwareVersion>
+</DeviceInfo>
+"""
+
+
+def test_get_values_from_xml_keeps_requested_order():
+    model, serial = get_values_from_xml(DEVICE_INFO, ["model", "serialNumber"])
+    assert model == "DS-K1T671M"
+    assert serial.endswith("12345678")
+
+    serial, model = get_values_from_xml(DEVICE_INFO, ["serialNumber", "model"])
+    assert model == "DS-K1T671M"
+
+
+def test_clark_notation_matches_namespace_exactly():
+    ns = "{http://www.isapi.org/ver20/XMLSchema}"
+    assert find_xml_values(DEVICE_INFO, [f"{ns}model", "{urn:other}model"]) == {
+        f"{ns}model": "DS-K1T671M"
+    }
+
+
+def test_stops_once_all_tags_are_found():
+    class Source(io.BytesIO):
+        reads = 0
+
+        def read(self, size=-1):
+            Source.reads += 1
+            return super().read(size)
+
+    body = b"<Root><model>M</model>" + b"<pad>x</pad>" * 100_000 + b"</Root>"
+    source = Source(body)
+
+    assert list(iter_xml_values(source, ["model"], chunk_size=1024)) == [("model", "M")]
+    assert Source.reads == 1
+
+
+def test_iter_xml_records_yields_repeated_elements():
+    users = "".join(
+        f"<UserInfo><employeeNo>{i}</employeeNo><name>User {i}</name>"
+        f"<Valid><enable>true</enable><beginTime>2024-01-01T00:00:00</beginTime></Valid>"
+        f"</UserInfo>"
+        for i in range(3)
+    )
+    xml = (
+        '<UserInfoSearch xmlns="http://www.isapi.org/ver20/XMLSchema">'
+        f"<numOfMatches>3</numOfMatches><UserInfoList>{users}</UserInfoList>"
+        "</UserInfoSearch>"
+    )
+
+    records = list(iter_xml_records(xml, "UserInfoList/UserInfo"))
+    assert [r["employeeNo"] for r in records] == ["0", "1", "2"]
+    assert records[0] == {
+        "employeeNo": "0",
+        "name": "User 0",
+        "enable": "true",
+        "beginTime": "2024-01-01T00:00:00",
+    }
+
+    names = list(iter_xml_records(xml, "UserInfo", fields=["name"]))
+    assert names == [{"name": "User 0"}, {"name": "User 1"}, {"name": "User 2"}]